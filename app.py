@@ -1,10 +1,19 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, g, has_request_context, render_template, request, jsonify
+import click
 import sqlite3
 from datetime import datetime, timedelta
+import hashlib
+import math
 import os
 import requests
 import json
-from db import init_db, get_db, DATABASE_URL
+from cost_graph import (CostCycleError, CostGraph, explode_requirements, recompute_costs,
+                        recompute_product_costs, record_cost_history, simulate_costs, unit_price_sql)
+from facts import GRANULARITIES, bucketed_facts, rebuild_facts, refresh_facts, refresh_product_facts
+from material_lots import apply_production_change, reallocate_lots, rebuild_lots, refresh_lot_prices
+from db import get_db as open_db
+from db import (init_db, get_pool_stats, insert_returning_id, execute_many, iter_rows,
+                upsert_rows, delete_rows, bump_data_version, get_data_versions, DATABASE_URL)
 
 app = Flask(__name__)
 
@@ -197,6 +206,57 @@ def _get_db_legacy():
     conn.row_factory = sqlite3.Row
     return conn
 
+# ===== 요청 단위 DB 연결 =====
+
+# DB 연결 열기 (요청 중 연 연결 수를 집계)
+def get_db(readonly=False, replica=False):
+    if has_request_context():
+        g.db_connections = g.get('db_connections', 0) + 1
+    return open_db(readonly, replica)
+
+# 요청 동안 헬퍼 함수들이 공유하는 연결 (요청 종료 시 자동으로 닫힘)
+def get_request_db():
+    if 'db' not in g:
+        g.db = get_db()
+    return g.db
+
+@app.teardown_appcontext
+def close_request_db(exception):
+    conn = g.pop('db', None)
+    if conn is not None:
+        conn.close()
+
+# 진단용: 이 요청에서 연 DB 연결 수
+@app.after_request
+def add_db_connection_count(response):
+    response.headers['X-DB-Connections'] = str(g.get('db_connections', 0))
+    return response
+
+# ===== 조건부 GET (ETag) =====
+
+# 관련 테이블 데이터 버전과 요청 경로/인자로 만든 ETag (데이터를 읽은 연결에서 조회해야 복제본 지연과 어긋나지 않음)
+def data_etag(conn, tables):
+    versions = get_data_versions(conn, tables)
+    key = json.dumps([request.path, sorted(request.args.items(multi=True)),
+                      [(table, versions[table]) for table in sorted(tables)]])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+# 클라이언트가 같은 ETag를 갖고 있으면 304 응답, 아니면 None
+def not_modified_response(etag):
+    if etag not in request.if_none_match:
+        return None
+    response = Response(status=304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+# ETag를 붙인 JSON 응답 (브라우저가 매번 If-None-Match로 재검증하도록 no-cache)
+def etag_response(data, etag):
+    response = jsonify(data)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 # ===== Ecount API 함수 =====
 
 # Ecount API 로그인
@@ -243,15 +303,14 @@ def ecount_login(settings):
 # Ecount 설정 가져오기
 def get_ecount_settings():
     """활성화된 Ecount 설정을 가져옵니다."""
-    conn = get_db()
+    conn = get_request_db()
     settings = conn.execute('SELECT * FROM ecount_settings WHERE is_active = 1 ORDER BY created_at DESC LIMIT 1').fetchone()
-    conn.close()
     return dict(settings) if settings else None
 
 # Ecount 동기화 로그 기록
 def log_ecount_sync(sync_type, record_id, record_type, status, request_data=None, response_data=None, error_message=None):
     """Ecount 동기화 로그를 기록합니다."""
-    conn = get_db()
+    conn = get_request_db()
     conn.execute('''INSERT INTO ecount_sync_logs
                     (sync_type, record_id, record_type, status, request_data, response_data, error_message)
                     VALUES (?, ?, ?, ?, ?, ?, ?)''',
@@ -260,7 +319,6 @@ def log_ecount_sync(sync_type, record_id, record_type, status, request_data=None
                   json.dumps(response_data, ensure_ascii=False) if response_data else None,
                   error_message))
     conn.commit()
-    conn.close()
 
 # Ecount에 생산입고 데이터 전송 (생산 실적 → 생산입고)
 def sync_production_to_ecount_sale(production_record_id):
@@ -278,12 +336,11 @@ def sync_production_to_ecount_sale(production_record_id):
     session_id = login_result['session_id']
 
     # 생산 실적 데이터 가져오기
-    conn = get_db()
+    conn = get_request_db()
     record = conn.execute('''SELECT pr.*, p.name as product_name, p.price, p.ecount_code
                              FROM production_records pr
                              JOIN products p ON pr.product_id = p.id
                              WHERE pr.id = ?''', (production_record_id,)).fetchone()
-    conn.close()
 
     if not record:
         return {'success': False, 'error': '생산 실적을 찾을 수 없습니다.'}
@@ -388,12 +445,11 @@ def sync_receipt_to_ecount_purchase(receipt_id):
     session_id = login_result['session_id']
 
     # 입고 데이터 가져오기
-    conn = get_db()
+    conn = get_request_db()
     record = conn.execute('''SELECT mr.*, m.name as material_name, m.ecount_code
                              FROM material_receipts mr
                              JOIN materials m ON mr.material_id = m.id
                              WHERE mr.id = ?''', (receipt_id,)).fetchone()
-    conn.close()
 
     if not record:
         return {'success': False, 'error': '입고 기록을 찾을 수 없습니다.'}
@@ -452,10 +508,16 @@ def index():
 # 제품 목록 조회
 @app.route('/api/products', methods=['GET'])
 def get_products():
-    conn = get_db()
+    conn = get_db(readonly=True)
+    etag = data_etag(conn, ['products'])
+    not_modified = not_modified_response(etag)
+    if not_modified:
+        conn.close()
+        return not_modified
+
     products = conn.execute('SELECT * FROM products ORDER BY display_order, name').fetchall()
     conn.close()
-    return jsonify([dict(p) for p in products])
+    return etag_response([dict(p) for p in products], etag)
 
 # 제품 추가
 @app.route('/api/products', methods=['POST'])
@@ -464,16 +526,17 @@ def add_product():
     try:
         conn = get_db()
         c = conn.cursor()
-        c.execute('''INSERT INTO products
-                     (name, unit, price, cost, stock_type, category, ecount_code, display_order)
-                     VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
-                  (data['name'], data['unit'],
-                   data.get('price', 0), data.get('cost', 0),
-                   data.get('stock_type', '일반'), data.get('category', '기타'),
-                   data.get('ecount_code'),
-                   data.get('display_order', 999)))
+        product_id = insert_returning_id(c, '''INSERT INTO products
+                                               (name, unit, price, cost, stock_type, category, ecount_code, display_order)
+                                               VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                                         (data['name'], data['unit'],
+                                          data.get('price', 0), data.get('cost', 0),
+                                          data.get('stock_type', '일반'), data.get('category', '기타'),
+                                          data.get('ecount_code'),
+                                          data.get('display_order', 999)))
+        record_cost_history(conn, 'p.id = ?', [product_id])
+        bump_data_version(c, 'products')
         conn.commit()
-        product_id = c.lastrowid
         conn.close()
         return jsonify({'success': True, 'id': product_id})
     except sqlite3.IntegrityError:
@@ -486,6 +549,7 @@ def update_product(product_id):
     try:
         conn = get_db()
         c = conn.cursor()
+        before = c.execute('SELECT category, stock_type FROM products WHERE id = ?', (product_id,)).fetchone()
         c.execute('''UPDATE products
                      SET name=?, unit=?, price=?, cost=?, stock_type=?, category=?, ecount_code=?, display_order=?
                      WHERE id=?''',
@@ -495,6 +559,15 @@ def update_product(product_id):
                    data.get('ecount_code'),
                    data.get('display_order', 999),
                    product_id))
+        # 가격/원가가 바뀌면 오늘부터 적용되는 이력 기록
+        record_cost_history(conn, 'p.id = ?', [product_id])
+        # 카테고리/재고 방식이 바뀌면 판매/기부 계산 방식이 달라지므로 일별 집계 전체 갱신
+        if before and (before['category'], before['stock_type']) != (data.get('category', '기타'),
+                                                                      data.get('stock_type', '일반')):
+            refresh_product_facts(conn, [product_id])
+            bump_data_version(c, 'products', 'daily_product_facts')
+        else:
+            bump_data_version(c, 'products')
         conn.commit()
         conn.close()
         return jsonify({'success': True})
@@ -505,8 +578,17 @@ def update_product(product_id):
 @app.route('/api/products/<int:product_id>', methods=['DELETE'])
 def delete_product(product_id):
     conn = get_db()
+    # 삭제되는 생산 기록만큼 자재 로트 복원 (FIFO 모드)
+    produced = conn.execute('SELECT SUM(quantity) as quantity FROM production_records WHERE product_id = ?',
+                            (product_id,)).fetchone()['quantity']
+    apply_production_change(conn, {product_id: -(produced or 0)})
     conn.execute('DELETE FROM production_records WHERE product_id = ?', (product_id,))
+    conn.execute('DELETE FROM product_cost_history WHERE product_id = ?', (product_id,))
+    conn.execute('DELETE FROM product_cost_breakdown WHERE product_id = ?', (product_id,))
+    conn.execute('DELETE FROM daily_product_facts WHERE product_id = ?', (product_id,))
+    conn.execute('DELETE FROM monthly_product_facts WHERE product_id = ?', (product_id,))
     conn.execute('DELETE FROM products WHERE id = ?', (product_id,))
+    bump_data_version(conn, 'products', 'production_records', 'daily_product_facts')
     conn.commit()
     conn.close()
     return jsonify({'success': True})
@@ -517,16 +599,81 @@ def add_production():
     data = request.json
     conn = get_db()
     c = conn.cursor()
+    # 같은 날짜에 이미 기록이 있으면 생산량을 합산하고 입력 건수(통계의 기록 수)를 1 늘림
     c.execute('''INSERT INTO production_records
                  (product_id, quantity, production_date, note)
-                 VALUES (?, ?, ?, ?)''',
+                 VALUES (?, ?, ?, ?)
+                 ON CONFLICT (product_id, production_date)
+                 DO UPDATE SET quantity = production_records.quantity + excluded.quantity,
+                               entry_count = production_records.entry_count + 1''',
               (data['product_id'], data['quantity'],
                data['production_date'], data.get('note', '')))
+    record = c.execute('''SELECT id FROM production_records
+                          WHERE product_id = ? AND production_date = ?''',
+                       (data['product_id'], data['production_date'])).fetchone()
+    apply_production_change(conn, {data['product_id']: data['quantity']})
+    refresh_facts(c, data['production_date'], data['production_date'], [data['product_id']])
+    bump_data_version(c, 'production_records', 'daily_product_facts')
     conn.commit()
-    record_id = c.lastrowid
+    record_id = record['id']
     conn.close()
     return jsonify({'success': True, 'id': record_id})
 
+# 이력 조회 응답 (기본: 전체 목록, page_size/cursor: 키셋 페이지, stream=1: 스트리밍)
+def list_response(conn, query, params, date_column, id_column, limit=None):
+    """query는 WHERE 절로 끝나야 하며 정렬은 (date_column, id_column) 내림차순으로 붙입니다."""
+    params = list(params)
+    cursor = request.args.get('cursor')
+    page_size = request.args.get('page_size')
+
+    if page_size is not None:
+        page_size = int(page_size) if page_size.isdigit() else 0
+        if page_size < 1:
+            conn.close()
+            return jsonify({'success': False, 'error': 'page_size는 1 이상의 정수여야 합니다.'}), 400
+
+    # 이전 페이지 마지막 행("날짜|id") 이후부터 조회
+    if cursor:
+        last_date, _, last_id = cursor.rpartition('|')
+        if not last_date or not last_id.isdigit():
+            conn.close()
+            return jsonify({'success': False, 'error': 'cursor 형식이 올바르지 않습니다.'}), 400
+        query += f' AND ({date_column} < ? OR ({date_column} = ? AND {id_column} < ?))'
+        params += [last_date, last_date, int(last_id)]
+
+    query += f' ORDER BY {date_column} DESC, {id_column} DESC'
+    date_key = date_column.split('.')[-1]
+    id_key = id_column.split('.')[-1]
+
+    if page_size:
+        query += ' LIMIT ?'
+        rows = conn.execute(query, params + [page_size + 1]).fetchall()
+        conn.close()
+        items = [dict(r) for r in rows[:page_size]]
+        next_cursor = None
+        if len(rows) > page_size:
+            next_cursor = f'{items[-1][date_key]}|{items[-1][id_key]}'
+        return jsonify({'items': items, 'next_cursor': next_cursor})
+
+    if limit:
+        query += ' LIMIT ?'
+        params.append(limit)
+
+    if request.args.get('stream') == '1':
+        def generate():
+            try:
+                yield '['
+                for i, row in enumerate(iter_rows(conn, query, params)):
+                    yield (',' if i else '') + app.json.dumps(dict(row))
+                yield ']'
+            finally:
+                conn.close()
+        return Response(generate(), mimetype='application/json')
+
+    records = conn.execute(query, params).fetchall()
+    conn.close()
+    return jsonify([dict(r) for r in records])
+
 # 생산량 기록 조회
 @app.route('/api/production', methods=['GET'])
 def get_production():
@@ -534,7 +681,7 @@ def get_production():
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
 
-    conn = get_db()
+    conn = get_db(replica=True)
     query = '''SELECT pr.*, p.name as product_name, p.unit
                FROM production_records pr
                JOIN products p ON pr.product_id = p.id
@@ -553,45 +700,107 @@ def get_production():
         query += ' AND pr.production_date <= ?'
         params.append(end_date)
 
-    query += ' ORDER BY pr.production_date DESC, pr.created_at DESC'
-
-    records = conn.execute(query, params).fetchall()
-    conn.close()
-    return jsonify([dict(r) for r in records])
+    return list_response(conn, query, params, 'pr.production_date', 'pr.id')
 
 # 생산량 기록 삭제
 @app.route('/api/production/<int:record_id>', methods=['DELETE'])
 def delete_production(record_id):
     conn = get_db()
+    record = conn.execute('SELECT product_id, quantity, production_date FROM production_records WHERE id = ?',
+                          (record_id,)).fetchone()
     conn.execute('DELETE FROM production_records WHERE id = ?', (record_id,))
+    if record:
+        apply_production_change(conn, {record['product_id']: -record['quantity']})
+        refresh_facts(conn, record['production_date'], record['production_date'], [record['product_id']])
+        bump_data_version(conn, 'production_records', 'daily_product_facts')
     conn.commit()
     conn.close()
     return jsonify({'success': True})
 
-# 통계 조회 (매출, 원가, 이익 포함)
+# 통계 구간 단위 검증 (잘못된 값이면 오류 응답, 아니면 None)
+def invalid_granularity_response(granularity):
+    if granularity and granularity not in GRANULARITIES:
+        return jsonify({'success': False,
+                        'error': f'granularity는 {", ".join(GRANULARITIES)} 중 하나여야 합니다.'}), 400
+    return None
+
+# 통계 기간 (생략 가능) 검증, YYYY-MM-DD로 맞춘 (시작일, 종료일, 오류 응답)
+def parse_statistics_dates():
+    try:
+        start_date, end_date = [datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d') if value else None
+                                for value in (request.args.get('start_date'), request.args.get('end_date'))]
+    except ValueError:
+        return None, None, (jsonify({'success': False,
+                                     'error': 'start_date/end_date는 YYYY-MM-DD 형식이어야 합니다.'}), 400)
+    return start_date, end_date, None
+
+# 구간별 제품 통계 [(구간 라벨, 구간 시작일, 제품, 집계)], 구간 시작일 → 제품 표시 순서로 정렬
+def load_bucketed_statistics(conn, start_date, end_date, granularity):
+    buckets = bucketed_facts(conn, start_date, end_date, granularity)
+    products = {p['id']: dict(p) for p in conn.execute(
+        'SELECT id, name, unit, price, cost, category, stock_type, display_order FROM products').fetchall()}
+
+    rows = []
+    for (period, period_start, product_id), (quantity, count, revenue, cost) in buckets.items():
+        product = products.get(product_id)
+        if product is None:
+            continue
+        rows.append((period, period_start, product, {
+            'total_quantity': quantity,
+            'record_count': count,
+            'total_sales': revenue,
+            'total_cost': cost,
+            'total_profit': revenue - cost
+        }))
+    rows.sort(key=lambda r: (r[1], r[2]['display_order'] or 0, r[2]['name']))
+    return rows
+
+# 통계 조회 (매출, 원가, 이익 포함, granularity를 주면 구간별)
 @app.route('/api/statistics', methods=['GET'])
 def get_statistics():
-    start_date = request.args.get('start_date')
-    end_date = request.args.get('end_date')
+    start_date, end_date, error = parse_statistics_dates()
+    if error:
+        return error
     category = request.args.get('category')
+    granularity = request.args.get('granularity')
 
-    conn = get_db()
+    error = invalid_granularity_response(granularity)
+    if error:
+        return error
+
+    conn = get_db(replica=True)
+
+    # 구간별: 온전한 달은 월별 집계, 나머지는 일별 집계에서 읽음
+    if granularity:
+        rows = load_bucketed_statistics(conn, start_date, end_date, granularity)
+        conn.close()
+        return jsonify([
+            {'period': period, 'period_start': period_start,
+             'id': product['id'], 'name': product['name'], 'unit': product['unit'],
+             'price': product['price'], 'cost': product['cost'],
+             'category': product['category'], 'stock_type': product['stock_type'], **totals}
+            for period, period_start, product, totals in rows
+            if not category or product['category'] == category
+        ])
+
+    # 일별 집계의 생산 기록 수량/입력 건수와 그 날짜 기준 매출/원가 사용
     query = '''SELECT p.id, p.name, p.unit, p.price, p.cost, p.category, p.stock_type,
-                      SUM(pr.quantity) as total_quantity,
-                      COUNT(pr.id) as record_count,
-                      SUM(pr.quantity * p.price) as total_sales,
-                      SUM(pr.quantity * p.cost) as total_cost,
-                      SUM(pr.quantity * (p.price - p.cost)) as total_profit
+                      SUM(f.recorded_quantity) as total_quantity,
+                      COALESCE(SUM(f.record_count), 0) as record_count,
+                      SUM(f.revenue) as total_sales,
+                      SUM(f.cost) as total_cost,
+                      SUM(f.revenue - f.cost) as total_profit
                FROM products p
-               LEFT JOIN production_records pr ON p.id = pr.product_id'''
+               LEFT JOIN daily_product_facts f
+                   ON p.id = f.product_id AND f.recorded_quantity IS NOT NULL'''
     params = []
     conditions = []
 
     if start_date:
-        conditions.append('pr.production_date >= ?')
+        conditions.append('f.fact_date >= ?')
         params.append(start_date)
     if end_date:
-        conditions.append('pr.production_date <= ?')
+        conditions.append('f.fact_date <= ?')
         params.append(end_date)
     if category:
         conditions.append('p.category = ?')
@@ -609,26 +818,56 @@ def get_statistics():
 # 전체 요약 통계
 @app.route('/api/statistics/summary', methods=['GET'])
 def get_statistics_summary():
-    start_date = request.args.get('start_date')
-    end_date = request.args.get('end_date')
+    start_date, end_date, error = parse_statistics_dates()
+    if error:
+        return error
+    granularity = request.args.get('granularity')
+
+    error = invalid_granularity_response(granularity)
+    if error:
+        return error
+
+    conn = get_db(replica=True)
+
+    # 구간별 전체/카테고리 합계
+    if granularity:
+        rows = load_bucketed_statistics(conn, start_date, end_date, granularity)
+        conn.close()
+
+        summary = {}
+        by_category = {}
+        for period, period_start, product, totals in rows:
+            entries = (summary.setdefault(period_start, {'period': period, 'period_start': period_start}),
+                       by_category.setdefault((period_start, product['category'] or ''),
+                                              {'period': period, 'period_start': period_start,
+                                               'category': product['category']}))
+            for entry in entries:
+                entry['product_count'] = entry.get('product_count', 0) + 1
+                for field in ('total_quantity', 'total_sales', 'total_cost', 'total_profit'):
+                    entry[field] = entry.get(field, 0) + totals[field]
+
+        return jsonify({
+            'summary': [summary[key] for key in sorted(summary)],
+            'by_category': [by_category[key] for key in sorted(by_category)]
+        })
 
-    conn = get_db()
     query = '''SELECT
                    COUNT(DISTINCT p.id) as product_count,
-                   SUM(pr.quantity) as total_quantity,
-                   SUM(pr.quantity * p.price) as total_sales,
-                   SUM(pr.quantity * p.cost) as total_cost,
-                   SUM(pr.quantity * (p.price - p.cost)) as total_profit
+                   SUM(f.recorded_quantity) as total_quantity,
+                   SUM(f.revenue) as total_sales,
+                   SUM(f.cost) as total_cost,
+                   SUM(f.revenue - f.cost) as total_profit
                FROM products p
-               LEFT JOIN production_records pr ON p.id = pr.product_id'''
+               LEFT JOIN daily_product_facts f
+                   ON p.id = f.product_id AND f.recorded_quantity IS NOT NULL'''
     params = []
     conditions = []
 
     if start_date:
-        conditions.append('pr.production_date >= ?')
+        conditions.append('f.fact_date >= ?')
         params.append(start_date)
     if end_date:
-        conditions.append('pr.production_date <= ?')
+        conditions.append('f.fact_date <= ?')
         params.append(end_date)
 
     if conditions:
@@ -639,12 +878,13 @@ def get_statistics_summary():
     # 카테고리별 통계
     cat_query = '''SELECT p.category,
                           COUNT(DISTINCT p.id) as product_count,
-                          SUM(pr.quantity) as total_quantity,
-                          SUM(pr.quantity * p.price) as total_sales,
-                          SUM(pr.quantity * p.cost) as total_cost,
-                          SUM(pr.quantity * (p.price - p.cost)) as total_profit
+                          SUM(f.recorded_quantity) as total_quantity,
+                          SUM(f.revenue) as total_sales,
+                          SUM(f.cost) as total_cost,
+                          SUM(f.revenue - f.cost) as total_profit
                    FROM products p
-                   LEFT JOIN production_records pr ON p.id = pr.product_id'''
+                   LEFT JOIN daily_product_facts f
+                       ON p.id = f.product_id AND f.recorded_quantity IS NOT NULL'''
 
     if conditions:
         cat_query += ' WHERE ' + ' AND '.join(conditions)
@@ -664,7 +904,13 @@ def get_statistics_summary():
 def get_production_grid():
     production_date = request.args.get('date')
 
-    conn = get_db()
+    conn = get_db(readonly=True)
+    etag = data_etag(conn, ['products', 'production_records'])
+    not_modified = not_modified_response(etag)
+    if not_modified:
+        conn.close()
+        return not_modified
+
     # 정기 제품과 해당 날짜의 생산량을 함께 조회 (비정기 제품 제외)
     query = '''SELECT p.id, p.name, p.unit, p.category, p.price, p.cost,
                       pr.quantity, pr.id as record_id
@@ -676,7 +922,11 @@ def get_production_grid():
 
     results = conn.execute(query, [production_date]).fetchall()
     conn.close()
-    return jsonify([dict(r) for r in results])
+    return etag_response([dict(r) for r in results], etag)
+
+# 그리드 입력값이 비어있거나 0인지 확인 (해당 레코드 삭제 대상)
+def is_empty_quantity(quantity):
+    return quantity is None or quantity == '' or float(quantity) == 0
 
 # 일괄 생산량 저장/수정 (엑셀 스타일 입력용)
 @app.route('/api/production/bulk', methods=['POST'])
@@ -689,33 +939,27 @@ def bulk_save_production():
     c = conn.cursor()
 
     try:
-        for item in products:
-            product_id = item['product_id']
-            quantity = item.get('quantity')
-
-            # 빈 값이거나 0이면 기존 레코드 삭제
-            if quantity is None or quantity == '' or float(quantity) == 0:
-                c.execute('''DELETE FROM production_records
-                            WHERE product_id = ? AND production_date = ?''',
-                         (product_id, production_date))
-            else:
-                # 해당 날짜의 레코드가 있는지 확인
-                existing = c.execute('''SELECT id FROM production_records
-                                       WHERE product_id = ? AND production_date = ?''',
-                                    (product_id, production_date)).fetchone()
-
-                if existing:
-                    # 업데이트
-                    c.execute('''UPDATE production_records
-                                SET quantity = ?
-                                WHERE product_id = ? AND production_date = ?''',
-                             (quantity, product_id, production_date))
-                else:
-                    # 새로 추가
-                    c.execute('''INSERT INTO production_records
-                                (product_id, quantity, production_date, note)
-                                VALUES (?, ?, ?, ?)''',
-                             (product_id, quantity, production_date, ''))
+        # 제품별 마지막 입력값 기준으로 삭제 대상과 저장 대상을 나눔
+        latest = {item['product_id']: item.get('quantity') for item in products}
+        delete_ids = [pid for pid, quantity in latest.items() if is_empty_quantity(quantity)]
+        rows = [(pid, quantity, production_date, '')
+                for pid, quantity in latest.items() if not is_empty_quantity(quantity)]
+        previous = {r['product_id']: r['quantity'] for r in c.execute(
+            'SELECT product_id, quantity FROM production_records WHERE production_date = ?',
+            [production_date]).fetchall()}
+
+        # 빈 값이거나 0이면 기존 레코드 삭제
+        delete_rows(c, 'production_records', 'product_id', delete_ids,
+                    'production_date = ?', [production_date])
+        upsert_rows(c, 'production_records', ['product_id', 'quantity', 'production_date', 'note'], rows,
+                    ['product_id', 'production_date'], ['quantity'])
+
+        # 생산량 증감분만큼 자재 로트 차감 (FIFO 모드)
+        apply_production_change(conn, {pid: (0 if is_empty_quantity(quantity) else float(quantity))
+                                            - previous.get(pid, 0)
+                                       for pid, quantity in latest.items()})
+        refresh_facts(c, production_date, production_date, latest)
+        bump_data_version(c, 'production_records', 'daily_product_facts')
 
         conn.commit()
         conn.close()
@@ -729,24 +973,32 @@ def bulk_save_production():
 # 자재 목록 조회
 @app.route('/api/materials', methods=['GET'])
 def get_materials():
-    conn = get_db()
-    materials = conn.execute('SELECT * FROM materials ORDER BY type, name').fetchall()
+    conn = get_db(readonly=True)
+    etag = data_etag(conn, ['materials', 'material_recipes'])
+    not_modified = not_modified_response(etag)
+    if not_modified:
+        conn.close()
+        return not_modified
+
+    # 프랩 자재의 레시피 기반 원가를 한 번의 집계 쿼리로 함께 조회
+    materials = conn.execute(f'''SELECT m.*, rc.recipe_cost
+                                FROM materials m
+                                LEFT JOIN (SELECT mr.prep_material_id,
+                                                  SUM(mr.quantity * {unit_price_sql('ing')}) as recipe_cost
+                                           FROM material_recipes mr
+                                           JOIN materials ing ON mr.ingredient_material_id = ing.id
+                                           GROUP BY mr.prep_material_id) rc
+                                    ON rc.prep_material_id = m.id
+                                ORDER BY m.type, m.name''').fetchall()
+    conn.close()
 
-    # 프랩 자재의 원가를 레시피 기반으로 계산
     result = []
     for material in materials:
         m_dict = dict(material)
+        calculated_cost = m_dict.pop('recipe_cost') or 0
 
-        # 프랩 자재인 경우 레시피 기반 원가 계산
+        # 프랩 자재인 경우 계산된 원가를 추가 필드로 제공
         if m_dict['type'] == '프랩':
-            recipe = conn.execute('''SELECT mr.quantity, ing.price_per_unit
-                                    FROM material_recipes mr
-                                    JOIN materials ing ON mr.ingredient_material_id = ing.id
-                                    WHERE mr.prep_material_id = ?''', (m_dict['id'],)).fetchall()
-
-            calculated_cost = sum(r['quantity'] * (r['price_per_unit'] or 0) for r in recipe)
-
-            # 계산된 원가를 추가 필드로 제공
             m_dict['recipe_cost'] = calculated_cost
 
             # 단위당 가격도 계산
@@ -755,8 +1007,7 @@ def get_materials():
 
         result.append(m_dict)
 
-    conn.close()
-    return jsonify(result)
+    return etag_response(result, etag)
 
 # 자재 추가
 @app.route('/api/materials', methods=['POST'])
@@ -780,16 +1031,17 @@ def add_material():
             price_per_unit = purchase_price / quantity if quantity > 0 else 0
             price_per_gram = price_per_unit  # 하위 호환성
 
-        c.execute('''INSERT INTO materials
-                     (name, type, weight, unit, purchase_price, price_per_gram, price_per_unit, supplier, note, ecount_code)
-                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                  (data['name'], material_type,
-                   quantity, data.get('unit', 'g'),
-                   purchase_price, price_per_gram, price_per_unit,
-                   data.get('supplier', ''), data.get('note', ''),
-                   data.get('ecount_code')))
+        material_id = insert_returning_id(c, '''INSERT INTO materials
+                                                (name, type, weight, unit, purchase_price, price_per_gram, price_per_unit,
+                                                 supplier, note, ecount_code)
+                                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                                          (data['name'], material_type,
+                                           quantity, data.get('unit', 'g'),
+                                           purchase_price, price_per_gram, price_per_unit,
+                                           data.get('supplier', ''), data.get('note', ''),
+                                           data.get('ecount_code')))
+        bump_data_version(c, 'materials')
         conn.commit()
-        material_id = c.lastrowid
         conn.close()
         return jsonify({'success': True, 'id': material_id})
     except sqlite3.IntegrityError:
@@ -809,16 +1061,11 @@ def update_material(material_id):
         quantity = float(data['weight'])
         material_type = data.get('type', '원자재')
 
-        # 프랩 자재는 입고 단가를 레시피에서 계산
+        # 프랩 자재는 입고 단가를 레시피에서 계산 (아래 recompute_costs)
         if material_type == '프랩':
-            # 레시피 기반 원가 계산
-            recipe = conn.execute('''SELECT mr.quantity, ing.price_per_unit
-                                    FROM material_recipes mr
-                                    JOIN materials ing ON mr.ingredient_material_id = ing.id
-                                    WHERE mr.prep_material_id = ?''', (material_id,)).fetchall()
-            purchase_price = sum(r['quantity'] * (r['price_per_unit'] or 0) for r in recipe)
-            price_per_unit = purchase_price / quantity if quantity > 0 else 0
-            price_per_gram = price_per_unit
+            purchase_price = 0
+            price_per_unit = 0
+            price_per_gram = 0
         else:
             purchase_price = float(data.get('purchase_price', 0))
             price_per_unit = purchase_price / quantity if quantity > 0 else 0
@@ -834,14 +1081,15 @@ def update_material(material_id):
                    data.get('supplier', ''), data.get('note', ''),
                    data.get('ecount_code'),
                    material_id))
-        conn.commit()
 
-        # 이 자재를 사용하는 모든 제품의 원가 재계산
-        products = c.execute('''SELECT DISTINCT product_id
-                               FROM product_materials
-                               WHERE material_id = ?''', (material_id,)).fetchall()
-        for p in products:
-            update_product_cost(p['product_id'], conn)
+        # 입고 기록이 있는 원자재는 입고 기준 단가(평균, FIFO 모드면 로트 단가)를 유지
+        apply_material_average_price(c, material_id)
+        refresh_lot_prices(c, [material_id])
+
+        # 이 자재를 쓰는 프랩 자재와 제품 원가를 한 번에 재계산
+        recompute_costs(conn, material_ids=[material_id])
+        bump_data_version(c, 'materials')
+        conn.commit()
 
         conn.close()
         return jsonify({'success': True})
@@ -854,10 +1102,17 @@ def update_material(material_id):
 @app.route('/api/materials/<int:material_id>', methods=['DELETE'])
 def delete_material(material_id):
     conn = get_db()
+    products = conn.execute('SELECT DISTINCT product_id FROM product_materials WHERE material_id = ?',
+                            (material_id,)).fetchall()
     conn.execute('DELETE FROM product_materials WHERE material_id = ?', (material_id,))
     conn.execute('DELETE FROM material_recipes WHERE prep_material_id = ? OR ingredient_material_id = ?',
                  (material_id, material_id))
     conn.execute('DELETE FROM materials WHERE id = ?', (material_id,))
+    conn.execute('DELETE FROM material_price_totals WHERE material_id = ?', (material_id,))
+
+    # 삭제된 자재를 쓰던 프랩 자재와 제품 원가 재계산
+    recompute_costs(conn, [p['product_id'] for p in products])
+    bump_data_version(conn, 'materials', 'material_recipes')
     conn.commit()
     conn.close()
     return jsonify({'success': True})
@@ -867,7 +1122,7 @@ def delete_material(material_id):
 # 자재의 레시피 조회 (프랩 자재가 어떤 재료로 만들어지는지)
 @app.route('/api/materials/<int:material_id>/recipe', methods=['GET'])
 def get_material_recipe(material_id):
-    conn = get_db()
+    conn = get_db(readonly=True)
     # 해당 자재 정보
     material = conn.execute('SELECT * FROM materials WHERE id = ?', (material_id,)).fetchone()
 
@@ -892,20 +1147,44 @@ def add_ingredient_to_material(material_id):
     try:
         conn = get_db()
         c = conn.cursor()
-        c.execute('''INSERT INTO material_recipes (prep_material_id, ingredient_material_id, quantity)
-                       VALUES (?, ?, ?)''',
-                    (material_id, data['material_id'], data['quantity']))
-        conn.commit()
-        new_id = c.lastrowid
+        new_id = insert_returning_id(c, '''INSERT INTO material_recipes (prep_material_id, ingredient_material_id, quantity)
+                                           VALUES (?, ?, ?)''',
+                                     (material_id, data['material_id'], data['quantity']))
 
-        # 프랩 자재의 입고 단가 재계산
-        update_prep_material_cost(material_id, conn)
+        # 프랩 자재(및 이를 쓰는 프랩/제품)의 원가 재계산
+        recompute_costs(conn, material_ids=[material_id])
+        bump_data_version(c, 'material_recipes', 'materials')
+        conn.commit()
 
         conn.close()
         return jsonify({'success': True, 'id': new_id})
+    except CostCycleError as e:
+        conn.close()
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
+# 자재 레시피 전체 교체 (요청 예: {"items": [{"material_id": 1, "quantity": 500}, ...]})
+@app.route('/api/materials/<int:material_id>/recipe', methods=['PUT'])
+def replace_material_recipe(material_id):
+    items = (request.json or {}).get('items', [])
+    conn = get_db()
+    c = conn.cursor()
+
+    try:
+        changes = replace_recipe_rows(c, 'material_recipes', 'prep_material_id', 'ingredient_material_id',
+                                      material_id, items)
+
+        # 프랩 자재(및 이를 쓰는 프랩/제품)의 원가 한 번만 재계산
+        recompute_costs(conn, material_ids=[material_id])
+        bump_data_version(c, 'material_recipes', 'materials')
+        conn.commit()
+        conn.close()
+        return jsonify({'success': True, **changes})
+    except Exception as e:
+        conn.close()
+        return jsonify({'success': False, 'error': str(e)}), 400
+
 # 자재 레시피에서 재료 삭제
 @app.route('/api/materials/recipe/<int:recipe_id>', methods=['DELETE'])
 def delete_ingredient_from_material(recipe_id):
@@ -916,21 +1195,57 @@ def delete_ingredient_from_material(recipe_id):
     recipe = c.execute('SELECT prep_material_id FROM material_recipes WHERE id = ?', (recipe_id,)).fetchone()
 
     c.execute('DELETE FROM material_recipes WHERE id = ?', (recipe_id,))
-    conn.commit()
 
-    # 프랩 자재의 입고 단가 재계산
+    # 프랩 자재(및 이를 쓰는 프랩/제품)의 원가 재계산
     if recipe:
-        update_prep_material_cost(recipe['prep_material_id'], conn)
+        recompute_costs(conn, material_ids=[recipe['prep_material_id']])
+    bump_data_version(c, 'material_recipes', 'materials')
+    conn.commit()
 
     conn.close()
     return jsonify({'success': True})
 
+# 레시피를 요청한 전체 목록과 같게 맞춤 (기존 행과 비교해 바뀐 행만 추가/수정/삭제)
+def replace_recipe_rows(c, table, owner_column, item_column, owner_id, items):
+    # 같은 자재가 여러 번 오면 마지막 값, 수량이 비었거나 0이면 레시피에서 제외
+    desired = {int(item['material_id']): float(item['quantity'])
+               for item in items if not is_empty_quantity(item.get('quantity'))}
+
+    if desired:
+        placeholders = ', '.join(['?'] * len(desired))
+        found = {r['id'] for r in c.execute(f'SELECT id FROM materials WHERE id IN ({placeholders})',
+                                            list(desired)).fetchall()}
+        missing = sorted(set(desired) - found)
+        if missing:
+            raise ValueError(f'존재하지 않는 자재입니다 (자재 ID: {", ".join(map(str, missing))})')
+
+    current = c.execute(f'''SELECT id, {item_column} as material_id, quantity FROM {table}
+                            WHERE {owner_column} = ? ORDER BY id''', (owner_id,)).fetchall()
+    kept = set()
+    delete_ids = []
+    updates = []
+    for row in current:
+        material_id = row['material_id']
+        if material_id not in desired or material_id in kept:
+            delete_ids.append(row['id'])
+            continue
+        kept.add(material_id)
+        if row['quantity'] != desired[material_id]:
+            updates.append((desired[material_id], row['id']))
+    inserts = [(owner_id, material_id, quantity) for material_id, quantity in desired.items()
+               if material_id not in kept]
+
+    delete_rows(c, table, 'id', delete_ids)
+    execute_many(c, f'UPDATE {table} SET quantity = ? WHERE id = ?', updates)
+    execute_many(c, f'INSERT INTO {table} ({owner_column}, {item_column}, quantity) VALUES (?, ?, ?)', inserts)
+    return {'added': len(inserts), 'updated': len(updates), 'deleted': len(delete_ids)}
+
 # ==================== 제품 레시피 (BOM) API ====================
 
 # 제품의 레시피 조회
 @app.route('/api/products/<int:product_id>/recipe', methods=['GET'])
 def get_product_recipe(product_id):
-    conn = get_db()
+    conn = get_db(readonly=True)
     recipe = conn.execute('''SELECT pm.id, pm.quantity, m.*
                             FROM product_materials pm
                             JOIN materials m ON pm.material_id = m.id
@@ -949,16 +1264,35 @@ def add_material_to_product(product_id):
         c.execute('''INSERT INTO product_materials (product_id, material_id, quantity)
                      VALUES (?, ?, ?)''',
                   (product_id, data['material_id'], data['quantity']))
-        conn.commit()
 
         # 원가 재계산
-        update_product_cost(product_id, conn)
+        recompute_product_costs(conn, [product_id])
+        conn.commit()
 
         conn.close()
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
+# 제품 레시피 전체 교체 (요청 예: {"items": [{"material_id": 1, "quantity": 120}, ...]})
+@app.route('/api/products/<int:product_id>/recipe', methods=['PUT'])
+def replace_product_recipe(product_id):
+    items = (request.json or {}).get('items', [])
+    conn = get_db()
+    c = conn.cursor()
+
+    try:
+        changes = replace_recipe_rows(c, 'product_materials', 'product_id', 'material_id', product_id, items)
+
+        # 원가 한 번만 재계산
+        recompute_product_costs(conn, [product_id])
+        conn.commit()
+        conn.close()
+        return jsonify({'success': True, **changes})
+    except Exception as e:
+        conn.close()
+        return jsonify({'success': False, 'error': str(e)}), 400
+
 # 레시피 항목 수정
 @app.route('/api/products/<int:product_id>/recipe/<int:recipe_id>', methods=['PUT'])
 def update_recipe_item(product_id, recipe_id):
@@ -968,10 +1302,10 @@ def update_recipe_item(product_id, recipe_id):
         c = conn.cursor()
         c.execute('''UPDATE product_materials SET quantity = ? WHERE id = ?''',
                   (data['quantity'], recipe_id))
-        conn.commit()
 
         # 원가 재계산
-        update_product_cost(product_id, conn)
+        recompute_product_costs(conn, [product_id])
+        conn.commit()
 
         conn.close()
         return jsonify({'success': True})
@@ -983,112 +1317,220 @@ def update_recipe_item(product_id, recipe_id):
 def delete_recipe_item(product_id, recipe_id):
     conn = get_db()
     conn.execute('DELETE FROM product_materials WHERE id = ?', (recipe_id,))
-    conn.commit()
 
     # 원가 재계산
-    update_product_cost(product_id, conn)
+    recompute_product_costs(conn, [product_id])
+    conn.commit()
 
     conn.close()
     return jsonify({'success': True})
 
-# 제품 원가 자동 계산 및 업데이트 함수
-def update_product_cost(product_id, conn=None):
-    should_close = False
-    if conn is None:
-        conn = get_db()
-        should_close = True
-
-    c = conn.cursor()
-
-    # 제품의 모든 자재 비용 합계 계산 (price_per_unit 사용, 없으면 price_per_gram)
-    result = c.execute('''SELECT SUM(pm.quantity * COALESCE(m.price_per_unit, m.price_per_gram)) as total_cost
-                         FROM product_materials pm
-                         JOIN materials m ON pm.material_id = m.id
-                         WHERE pm.product_id = ?''', (product_id,)).fetchone()
-
-    total_cost = result['total_cost'] if result['total_cost'] else 0
+# 제품 정보 조회 (레시피 포함)
+@app.route('/api/products/<int:product_id>/detail', methods=['GET'])
+def get_product_detail(product_id):
+    conn = get_db(readonly=True)
 
-    # 제품의 원가 업데이트
-    c.execute('UPDATE products SET cost = ? WHERE id = ?', (total_cost, product_id))
-    conn.commit()
+    # 제품 정보
+    product = conn.execute('SELECT * FROM products WHERE id = ?', (product_id,)).fetchone()
 
-    if should_close:
+    if not product:
         conn.close()
+        return jsonify({'success': False, 'error': '제품을 찾을 수 없습니다'}), 404
 
-    return total_cost
-
-# 프랩 자재 원가 자동 계산 및 업데이트 함수
-def update_prep_material_cost(material_id, conn=None):
-    should_close = False
-    if conn is None:
-        conn = get_db()
-        should_close = True
+    # 레시피 정보 (자재 단가는 원가 계산과 같은 규칙, 프랩 자재는 원가 재계산 시 갱신된 단가)
+    recipe = conn.execute(f'''SELECT pm.id, pm.quantity, m.*,
+                                     {unit_price_sql('m')} as unit_price,
+                                     (pm.quantity * {unit_price_sql('m')}) as item_cost
+                              FROM product_materials pm
+                              JOIN materials m ON pm.material_id = m.id
+                              WHERE pm.product_id = ?
+                              ORDER BY m.name''', (product_id,)).fetchall()
+
+    # 원재료별 원가 구성 (프랩 자재를 원재료까지 펼친 값, 원가 재계산 시 미리 계산해 둔 값)
+    breakdown = conn.execute('''SELECT b.material_id, m.name, m.type, m.unit,
+                                       b.quantity, b.unit_price, b.cost, b.cost_share
+                                FROM product_cost_breakdown b
+                                JOIN materials m ON b.material_id = m.id
+                                WHERE b.product_id = ?
+                                ORDER BY b.cost DESC''', (product_id,)).fetchall()
 
-    c = conn.cursor()
+    conn.close()
 
-    # 자재 정보 가져오기
-    material = c.execute('SELECT weight FROM materials WHERE id = ?', (material_id,)).fetchone()
-    if not material:
-        if should_close:
-            conn.close()
-        return 0
+    recipe = [dict(r) for r in recipe]
+    total_cost = sum(r['item_cost'] for r in recipe)
+    for r in recipe:
+        r['cost_share'] = r['item_cost'] / total_cost * 100 if total_cost else 0
 
-    # 레시피 기반 원가 계산
-    recipe = c.execute('''SELECT mr.quantity, ing.price_per_unit
-                         FROM material_recipes mr
-                         JOIN materials ing ON mr.ingredient_material_id = ing.id
-                         WHERE mr.prep_material_id = ?''', (material_id,)).fetchall()
+    return jsonify({
+        'product': dict(product),
+        'recipe': recipe,
+        'cost_breakdown': [dict(b) for b in breakdown]
+    })
 
-    total_cost = sum(r['quantity'] * (r['price_per_unit'] or 0) for r in recipe)
+# ==================== 원가 시뮬레이션 API ====================
+
+# 원재료 가격 변동 시 전 제품 원가/마진 시뮬레이션 (실제 데이터는 변경하지 않음)
+@app.route('/api/costs/simulate', methods=['POST'])
+def simulate_product_costs():
+    """요청 예: {"scenarios": [{"name": "버터 +12%, 밀가루 -3%", "shocks": {"5": 12, "2": -3}}]}"""
+    import numpy as np
+
+    data = request.json or {}
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'error': '요청 본문은 JSON 객체여야 합니다.'}), 400
+    scenarios = data.get('scenarios')
+    if scenarios is None:
+        scenarios = [{'name': data.get('name', '시나리오'), 'shocks': data.get('shocks', {})}]
+    if not scenarios:
+        return jsonify({'success': False, 'error': '시나리오가 없습니다.'}), 400
+    if not isinstance(scenarios, list) or not all(isinstance(s, dict) for s in scenarios):
+        return jsonify({'success': False, 'error': 'scenarios는 {"name", "shocks"} 객체 목록이어야 합니다.'}), 400
+
+    # 시나리오별 {원재료 ID: 변동률(%)}, ID나 변동률이 숫자가 아니면 400
+    shocks = []
+    for scenario in scenarios:
+        values = scenario.get('shocks') or {}
+        try:
+            values = {int(mid): float(pct) for mid, pct in values.items()} if isinstance(values, dict) else None
+        except (TypeError, ValueError):
+            values = None
+        if values is None or not all(math.isfinite(pct) for pct in values.values()):
+            return jsonify({'success': False, 'error': 'shocks는 {원재료 ID: 변동률(%)} 형식이어야 합니다.'}), 400
+        shocks.append(values)
+
+    conn = get_db(readonly=True)
+    try:
+        graph = CostGraph.load(conn)
+        products = conn.execute('''SELECT id, name, category, price, cost FROM products
+                                   ORDER BY display_order, name''').fetchall()
+    finally:
+        conn.close()
 
-    # 단위당 가격 계산
-    weight = material['weight']
-    price_per_unit = total_cost / weight if weight > 0 else 0
+    try:
+        bom_ids, bom_base_costs, bom_costs = simulate_costs(graph, shocks)
+    except CostCycleError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
 
-    # 프랩 자재의 입고 단가 및 단위당 가격 업데이트
-    c.execute('''UPDATE materials
-                SET purchase_price = ?, price_per_unit = ?, price_per_gram = ?
-                WHERE id = ?''',
-             (total_cost, price_per_unit, price_per_unit, material_id))
-    conn.commit()
+    # 레시피가 없는 제품은 입력된 원가를 그대로 사용
+    product_ids = [p['id'] for p in products]
+    prices = np.array([p['price'] or 0 for p in products], dtype=float)
+    base_costs = np.array([p['cost'] or 0 for p in products], dtype=float)
+    bom_index = {pid: i for i, pid in enumerate(bom_ids)}
+    columns = [i for i, pid in enumerate(product_ids) if pid in bom_index]
+    bom_columns = [bom_index[product_ids[i]] for i in columns]
+    base_costs[columns] = bom_base_costs[bom_columns]
 
-    # 이 프랩 자재를 사용하는 제품들의 원가도 재계산
-    products = c.execute('''SELECT DISTINCT product_id
-                           FROM product_materials
-                           WHERE material_id = ?''', (material_id,)).fetchall()
-    for p in products:
-        update_product_cost(p['product_id'], conn)
+    costs = np.tile(base_costs, (len(scenarios), 1))
+    costs[:, columns] = bom_costs[:, bom_columns]
+    margins = prices - costs
+    margin_rates = np.divide(margins * 100, prices, out=np.zeros_like(margins), where=prices > 0)
 
-    if should_close:
-        conn.close()
+    results = []
+    for row, scenario in enumerate(scenarios):
+        results.append({
+            'name': scenario.get('name', f'시나리오 {row + 1}'),
+            'total_cost_change': float((costs[row] - base_costs).sum()),
+            'products': [
+                {
+                    'id': p['id'],
+                    'name': p['name'],
+                    'category': p['category'],
+                    'price': float(prices[col]),
+                    'base_cost': float(base_costs[col]),
+                    'cost': float(costs[row, col]),
+                    'cost_change': float(costs[row, col] - base_costs[col]),
+                    'margin': float(margins[row, col]),
+                    'margin_rate': float(margin_rates[row, col])
+                }
+                for col, p in enumerate(products)
+            ]
+        })
 
-    return total_cost
+    return jsonify({'success': True, 'scenarios': results})
 
-# 제품 정보 조회 (레시피 포함)
-@app.route('/api/products/<int:product_id>/detail', methods=['GET'])
-def get_product_detail(product_id):
-    conn = get_db()
+# 기간별 원재료 소요량 (MRP): 목표 생산량(source=target) 또는 생산 기록(source=production)을 BOM으로 전개
+MRP_MAX_DAYS = 366
 
-    # 제품 정보
-    product = conn.execute('SELECT * FROM products WHERE id = ?', (product_id,)).fetchone()
+@app.route('/api/mrp', methods=['GET'])
+def get_material_requirements():
+    import numpy as np
 
-    if not product:
+    source = request.args.get('source', 'target')
+    if source not in ('target', 'production'):
+        return jsonify({'success': False, 'error': 'source는 target 또는 production이어야 합니다.'}), 400
+    try:
+        start = datetime.strptime(request.args['start_date'], '%Y-%m-%d')
+        end = datetime.strptime(request.args.get('end_date', request.args['start_date']), '%Y-%m-%d')
+    except (KeyError, ValueError):
+        return jsonify({'success': False, 'error': 'start_date/end_date(YYYY-MM-DD)가 필요합니다.'}), 400
+    days = (end - start).days + 1
+    if days < 1 or days > MRP_MAX_DAYS:
+        return jsonify({'success': False, 'error': f'기간은 1~{MRP_MAX_DAYS}일이어야 합니다.'}), 400
+    dates = [(start + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(days)]
+
+    conn = get_db(replica=True)
+    try:
+        graph = CostGraph.load(conn)
+        materials = {r['id']: r for r in conn.execute('SELECT id, name, type, unit FROM materials').fetchall()}
+
+        if source == 'target':
+            # 토/일요일은 주말 목표량 사용
+            targets = conn.execute('SELECT product_id, weekday_target, weekend_target FROM target_production').fetchall()
+            weekday = {t['product_id']: t['weekday_target'] for t in targets}
+            weekend = {t['product_id']: t['weekend_target'] for t in targets}
+            daily_plans = [weekend if (start + timedelta(days=i)).weekday() >= 5 else weekday for i in range(days)]
+        else:
+            daily_plans = [{} for _ in dates]
+            day_index = {d: i for i, d in enumerate(dates)}
+            for r in conn.execute('''SELECT production_date, product_id, SUM(quantity) as quantity
+                                     FROM production_records
+                                     WHERE production_date >= ? AND production_date <= ?
+                                     GROUP BY production_date, product_id''', (dates[0], dates[-1])).fetchall():
+                daily_plans[day_index[str(r['production_date'])[:10]]][r['product_id']] = r['quantity']
+    finally:
         conn.close()
-        return jsonify({'success': False, 'error': '제품을 찾을 수 없습니다'}), 404
 
-    # 레시피 정보
-    recipe = conn.execute('''SELECT pm.id, pm.quantity, m.*,
-                                    (pm.quantity * m.price_per_gram) as item_cost
-                            FROM product_materials pm
-                            JOIN materials m ON pm.material_id = m.id
-                            WHERE pm.product_id = ?
-                            ORDER BY m.name''', (product_id,)).fetchall()
+    try:
+        raw_ids, quantities, prices = explode_requirements(graph, daily_plans)
+    except CostCycleError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
 
-    conn.close()
+    costs = quantities * prices
+    total_quantities = quantities.sum(axis=0)
+    total_costs = costs.sum(axis=0)
+    used = np.flatnonzero(total_quantities)
 
     return jsonify({
-        'product': dict(product),
-        'recipe': [dict(r) for r in recipe]
+        'success': True,
+        'source': source,
+        'start_date': dates[0],
+        'end_date': dates[-1],
+        'total_cost': float(total_costs.sum()),
+        'materials': [
+            {
+                'id': raw_ids[j],
+                'name': materials[raw_ids[j]]['name'],
+                'type': materials[raw_ids[j]]['type'],
+                'unit': materials[raw_ids[j]]['unit'],
+                'price_per_unit': float(prices[j]),
+                'quantity': float(total_quantities[j]),
+                'cost': float(total_costs[j])
+            }
+            for j in used
+        ],
+        'daily': [
+            {
+                'date': date,
+                'total_cost': float(costs[i].sum()),
+                'materials': [
+                    {'id': raw_ids[j], 'quantity': float(quantities[i, j]), 'cost': float(costs[i, j])}
+                    for j in used if quantities[i, j]
+                ]
+            }
+            for i, date in enumerate(dates)
+        ]
     })
 
 # ==================== 목표 생산량 API ====================
@@ -1096,7 +1538,13 @@ def get_product_detail(product_id):
 # 목표 생산량 조회
 @app.route('/api/target-production', methods=['GET'])
 def get_target_production():
-    conn = get_db()
+    conn = get_db(readonly=True)
+    etag = data_etag(conn, ['products', 'target_production'])
+    not_modified = not_modified_response(etag)
+    if not_modified:
+        conn.close()
+        return not_modified
+
     # 정기 제품과 목표 생산량을 함께 조회 (비정기 제품 제외)
     query = '''SELECT p.id, p.name, p.unit, p.category, p.price,
                       COALESCE(tp.weekday_target, 0) as weekday_target,
@@ -1108,7 +1556,7 @@ def get_target_production():
 
     results = conn.execute(query).fetchall()
     conn.close()
-    return jsonify([dict(r) for r in results])
+    return etag_response([dict(r) for r in results], etag)
 
 # 목표 생산량 일괄 저장
 @app.route('/api/target-production/bulk', methods=['POST'])
@@ -1120,27 +1568,13 @@ def bulk_save_target_production():
     c = conn.cursor()
 
     try:
-        for item in targets:
-            product_id = item['product_id']
-            weekday_target = item.get('weekday_target', 0)
-            weekend_target = item.get('weekend_target', 0)
-
-            # 기존 레코드가 있는지 확인
-            existing = c.execute('''SELECT id FROM target_production
-                                   WHERE product_id = ?''', (product_id,)).fetchone()
-
-            if existing:
-                # 업데이트
-                c.execute('''UPDATE target_production
-                            SET weekday_target = ?, weekend_target = ?
-                            WHERE product_id = ?''',
-                         (weekday_target, weekend_target, product_id))
-            else:
-                # 새로 추가
-                c.execute('''INSERT INTO target_production
-                            (product_id, weekday_target, weekend_target)
-                            VALUES (?, ?, ?)''',
-                         (product_id, weekday_target, weekend_target))
+        # 제품별 마지막 입력값만 한 번에 저장
+        latest = {item['product_id']: (item.get('weekday_target', 0), item.get('weekend_target', 0))
+                  for item in targets}
+        upsert_rows(c, 'target_production', ['product_id', 'weekday_target', 'weekend_target'],
+                    [(pid, *values) for pid, values in latest.items()],
+                    ['product_id'], ['weekday_target', 'weekend_target'])
+        bump_data_version(c, 'target_production')
 
         conn.commit()
         conn.close()
@@ -1156,7 +1590,13 @@ def bulk_save_target_production():
 def get_inventory_grid():
     inventory_date = request.args.get('date')
 
-    conn = get_db()
+    conn = get_db(readonly=True)
+    etag = data_etag(conn, ['products', 'inventory_records'])
+    not_modified = not_modified_response(etag)
+    if not_modified:
+        conn.close()
+        return not_modified
+
     # 정기 제품과 해당 날짜의 재고량을 함께 조회 (비정기 제품 제외)
     query = '''SELECT p.id, p.name, p.unit, p.category, p.price, p.cost, p.stock_type,
                       ir.quantity, ir.id as record_id
@@ -1168,7 +1608,7 @@ def get_inventory_grid():
 
     results = conn.execute(query, [inventory_date]).fetchall()
     conn.close()
-    return jsonify([dict(r) for r in results])
+    return etag_response([dict(r) for r in results], etag)
 
 # 일괄 재고량 저장/수정
 @app.route('/api/inventory/bulk', methods=['POST'])
@@ -1181,33 +1621,22 @@ def bulk_save_inventory():
     c = conn.cursor()
 
     try:
-        for item in products:
-            product_id = item['product_id']
-            quantity = item.get('quantity')
-
-            # 빈 값이거나 0이면 기존 레코드 삭제
-            if quantity is None or quantity == '' or float(quantity) == 0:
-                c.execute('''DELETE FROM inventory_records
-                            WHERE product_id = ? AND inventory_date = ?''',
-                         (product_id, inventory_date))
-            else:
-                # 해당 날짜의 레코드가 있는지 확인
-                existing = c.execute('''SELECT id FROM inventory_records
-                                       WHERE product_id = ? AND inventory_date = ?''',
-                                    (product_id, inventory_date)).fetchone()
-
-                if existing:
-                    # 업데이트
-                    c.execute('''UPDATE inventory_records
-                                SET quantity = ?
-                                WHERE product_id = ? AND inventory_date = ?''',
-                             (quantity, product_id, inventory_date))
-                else:
-                    # 새로 추가
-                    c.execute('''INSERT INTO inventory_records
-                                (product_id, quantity, inventory_date, note)
-                                VALUES (?, ?, ?, ?)''',
-                             (product_id, quantity, inventory_date, ''))
+        # 제품별 마지막 입력값 기준으로 삭제 대상과 저장 대상을 나눔
+        latest = {item['product_id']: item.get('quantity') for item in products}
+        delete_ids = [pid for pid, quantity in latest.items() if is_empty_quantity(quantity)]
+        rows = [(pid, quantity, inventory_date, '')
+                for pid, quantity in latest.items() if not is_empty_quantity(quantity)]
+
+        # 빈 값이거나 0이면 기존 레코드 삭제
+        delete_rows(c, 'inventory_records', 'product_id', delete_ids,
+                    'inventory_date = ?', [inventory_date])
+        upsert_rows(c, 'inventory_records', ['product_id', 'quantity', 'inventory_date', 'note'], rows,
+                    ['product_id', 'inventory_date'], ['quantity'])
+
+        # 당일 재고는 다음 날 기초재고이기도 하므로 이틀치 집계 갱신
+        next_date = (datetime.strptime(inventory_date, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+        refresh_facts(c, inventory_date, next_date, latest)
+        bump_data_version(c, 'inventory_records', 'daily_product_facts')
 
         conn.commit()
         conn.close()
@@ -1223,7 +1652,7 @@ def get_inventory():
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
 
-    conn = get_db()
+    conn = get_db(replica=True)
     query = '''SELECT ir.*, p.name as product_name, p.unit
                FROM inventory_records ir
                JOIN products p ON ir.product_id = p.id
@@ -1242,11 +1671,7 @@ def get_inventory():
         query += ' AND ir.inventory_date <= ?'
         params.append(end_date)
 
-    query += ' ORDER BY ir.inventory_date DESC, ir.created_at DESC'
-
-    records = conn.execute(query, params).fetchall()
-    conn.close()
-    return jsonify([dict(r) for r in records])
+    return list_response(conn, query, params, 'ir.inventory_date', 'ir.id')
 
 # ==================== 비정기 제품 관리 API ====================
 
@@ -1260,7 +1685,13 @@ def get_irregular_product_grid():
     current_date = datetime.strptime(record_date, '%Y-%m-%d')
     prev_date = (current_date - timedelta(days=1)).strftime('%Y-%m-%d')
 
-    conn = get_db()
+    conn = get_db(readonly=True)
+    etag = data_etag(conn, ['products', 'irregular_product_records'])
+    not_modified = not_modified_response(etag)
+    if not_modified:
+        conn.close()
+        return not_modified
+
     # 비정기 제품 카테고리에 속하는 제품과 해당 날짜의 데이터, 전날 기말재고를 함께 조회
     query = '''SELECT p.id, p.name, p.unit, p.category, p.price,
                       ir.opening_inventory, ir.production, ir.donation, ir.closing_inventory,
@@ -1276,7 +1707,7 @@ def get_irregular_product_grid():
 
     results = conn.execute(query, [record_date, prev_date]).fetchall()
     conn.close()
-    return jsonify([dict(r) for r in results])
+    return etag_response([dict(r) for r in results], etag)
 
 # 일괄 비정기 제품 데이터 저장/수정
 @app.route('/api/irregular-product/bulk', methods=['POST'])
@@ -1289,40 +1720,35 @@ def bulk_save_irregular_product():
     c = conn.cursor()
 
     try:
+        # 제품별 마지막 입력값 기준으로 삭제 대상과 저장 대상을 나눔
+        latest = {}
         for item in products:
-            product_id = item['product_id']
-            opening_inventory = item.get('opening_inventory', 0) or 0
-            production = item.get('production', 0) or 0
-            donation = item.get('donation', 0) or 0
-            closing_inventory = item.get('closing_inventory', 0) or 0
-
-            # 모든 값이 0이면 기존 레코드 삭제
-            if all(float(v) == 0 for v in [opening_inventory, production, donation, closing_inventory]):
-                c.execute('''DELETE FROM irregular_product_records
-                            WHERE product_id = ? AND record_date = ?''',
-                         (product_id, record_date))
-            else:
-                # 해당 날짜의 레코드가 있는지 확인
-                existing = c.execute('''SELECT id FROM irregular_product_records
-                                       WHERE product_id = ? AND record_date = ?''',
-                                    (product_id, record_date)).fetchone()
-
-                if existing:
-                    # 업데이트
-                    c.execute('''UPDATE irregular_product_records
-                                SET opening_inventory = ?, production = ?,
-                                    donation = ?, closing_inventory = ?
-                                WHERE product_id = ? AND record_date = ?''',
-                             (opening_inventory, production, donation, closing_inventory,
-                              product_id, record_date))
-                else:
-                    # 새로 추가
-                    c.execute('''INSERT INTO irregular_product_records
-                                (product_id, opening_inventory, production, donation,
-                                 closing_inventory, record_date, note)
-                                VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                             (product_id, opening_inventory, production, donation,
-                              closing_inventory, record_date, ''))
+            latest[item['product_id']] = (item.get('opening_inventory', 0) or 0,
+                                          item.get('production', 0) or 0,
+                                          item.get('donation', 0) or 0,
+                                          item.get('closing_inventory', 0) or 0)
+
+        # 모든 값이 0이면 기존 레코드 삭제
+        delete_ids = [pid for pid, values in latest.items() if all(float(v) == 0 for v in values)]
+        rows = [(pid, *values, record_date, '')
+                for pid, values in latest.items() if not all(float(v) == 0 for v in values)]
+        previous = {r['product_id']: r['production'] or 0 for r in c.execute(
+            'SELECT product_id, production FROM irregular_product_records WHERE record_date = ?',
+            [record_date]).fetchall()}
+
+        delete_rows(c, 'irregular_product_records', 'product_id', delete_ids,
+                    'record_date = ?', [record_date])
+        upsert_rows(c, 'irregular_product_records',
+                    ['product_id', 'opening_inventory', 'production', 'donation',
+                     'closing_inventory', 'record_date', 'note'], rows,
+                    ['product_id', 'record_date'],
+                    ['opening_inventory', 'production', 'donation', 'closing_inventory'])
+
+        # 생산량 증감분만큼 자재 로트 차감 (FIFO 모드)
+        apply_production_change(conn, {pid: (0 if pid in delete_ids else float(values[1])) - previous.get(pid, 0)
+                                       for pid, values in latest.items()})
+        refresh_facts(c, record_date, record_date, latest)
+        bump_data_version(c, 'irregular_product_records', 'daily_product_facts')
 
         conn.commit()
         conn.close()
@@ -1338,42 +1764,32 @@ def bulk_save_irregular_product():
 def get_sales_grid():
     sales_date = request.args.get('date')
 
-    # 전날 날짜 계산
-    from datetime import datetime, timedelta
-    current_date = datetime.strptime(sales_date, '%Y-%m-%d')
-    prev_date = (current_date - timedelta(days=1)).strftime('%Y-%m-%d')
-
-    conn = get_db()
+    conn = get_db(replica=True)
+    etag = data_etag(conn, ['products', 'daily_product_facts'])
+    not_modified = not_modified_response(etag)
+    if not_modified:
+        conn.close()
+        return not_modified
 
-    # 1. 정기 제품 조회 (생산량, 재고 기반)
-    regular_query = '''SELECT p.id, p.name, p.unit, p.category, p.price, p.cost, p.stock_type,
-                      COALESCE(prev_inv.quantity, 0) as opening_inventory,
-                      COALESCE(prod.quantity, 0) as production,
-                      COALESCE(curr_inv.quantity, 0) as closing_inventory,
-                      0 as donation
+    # 정기/비정기 제품의 기초재고, 생산, 기말재고, 기부 (일별 집계)
+    query = '''SELECT p.id, p.name, p.unit, p.category, p.price, p.cost, p.stock_type,
+                      COALESCE(f.opening_inventory, 0) as opening_inventory,
+                      COALESCE(f.production, 0) as production,
+                      COALESCE(f.closing_inventory, 0) as closing_inventory,
+                      {donation} as donation
                FROM products p
-               LEFT JOIN inventory_records prev_inv
-                   ON p.id = prev_inv.product_id AND prev_inv.inventory_date = ?
-               LEFT JOIN production_records prod
-                   ON p.id = prod.product_id AND prod.production_date = ?
-               LEFT JOIN inventory_records curr_inv
-                   ON p.id = curr_inv.product_id AND curr_inv.inventory_date = ?
-               WHERE p.category != '비정기 제품'
+               LEFT JOIN daily_product_facts f
+                   ON p.id = f.product_id AND f.fact_date = ?
+               WHERE p.category {category} '비정기 제품'
                ORDER BY p.display_order, p.name'''
 
-    # 2. 비정기 제품 조회 (irregular_product_records 기반)
-    irregular_query = '''SELECT p.id, p.name, p.unit, p.category, p.price, p.cost, p.stock_type,
-                      COALESCE(ir.opening_inventory, 0) as opening_inventory,
-                      COALESCE(ir.production, 0) as production,
-                      COALESCE(ir.closing_inventory, 0) as closing_inventory,
-                      COALESCE(ir.donation, 0) as donation
-               FROM products p
-               LEFT JOIN irregular_product_records ir
-                   ON p.id = ir.product_id AND ir.record_date = ?
-               WHERE p.category = '비정기 제품'
-               ORDER BY p.display_order, p.name'''
+    # 1. 정기 제품 (생산량, 재고 기반)
+    regular_query = query.format(donation='0', category='!=')
+
+    # 2. 비정기 제품 (irregular_product_records 기반)
+    irregular_query = query.format(donation='COALESCE(f.donation, 0)', category='=')
 
-    regular_results = conn.execute(regular_query, [prev_date, sales_date, sales_date]).fetchall()
+    regular_results = conn.execute(regular_query, [sales_date]).fetchall()
     irregular_results = conn.execute(irregular_query, [sales_date]).fetchall()
     conn.close()
 
@@ -1392,7 +1808,68 @@ def get_sales_grid():
         data['sales'] = data['opening_inventory'] + data['production'] - data['donation'] - data['closing_inventory']
         sales_data.append(data)
 
-    return jsonify(sales_data)
+    return etag_response(sales_data, etag)
+
+# 기간별 판매량 최대 조회 일수
+SALES_RANGE_MAX_DAYS = 366
+
+# 기간별 제품 판매량 (차트용: 날짜 축과 날짜 순서에 맞춘 제품별 판매량/판매금액 시리즈)
+@app.route('/api/sales/range', methods=['GET'])
+def get_sales_range():
+    try:
+        start = datetime.strptime(request.args['start_date'], '%Y-%m-%d')
+        end = datetime.strptime(request.args['end_date'], '%Y-%m-%d')
+    except (KeyError, ValueError):
+        return jsonify({'success': False, 'error': 'start_date/end_date(YYYY-MM-DD)가 필요합니다.'}), 400
+    days = (end - start).days + 1
+    if days < 1 or days > SALES_RANGE_MAX_DAYS:
+        return jsonify({'success': False, 'error': f'기간은 1~{SALES_RANGE_MAX_DAYS}일이어야 합니다.'}), 400
+    dates = [(start + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(days)]
+    day_index = {d: i for i, d in enumerate(dates)}
+
+    conn = get_db(replica=True)
+    etag = data_etag(conn, ['products', 'daily_product_facts'])
+    not_modified = not_modified_response(etag)
+    if not_modified:
+        conn.close()
+        return not_modified
+
+    # 제품과 기간 내 일별 집계를 한 번에 조회 (판매량 계산식은 일별 집계와 같음, 기록이 없는 날은 0)
+    rows = conn.execute('''SELECT p.id, p.name, p.unit, p.category, p.price as current_price, p.stock_type,
+                                  f.fact_date, COALESCE(f.sales, 0) as sales, f.price
+                           FROM products p
+                           LEFT JOIN daily_product_facts f
+                               ON p.id = f.product_id AND f.fact_date >= ? AND f.fact_date <= ?
+                           ORDER BY p.display_order, p.name''', [dates[0], dates[-1]]).fetchall()
+    conn.close()
+
+    products = {}
+    daily_sales_amount = [0] * days
+    for row in rows:
+        product = products.get(row['id'])
+        if product is None:
+            product = products[row['id']] = {
+                'id': row['id'], 'name': row['name'], 'unit': row['unit'], 'category': row['category'],
+                'price': row['current_price'], 'stock_type': row['stock_type'],
+                'sales': [0] * days, 'sales_amount': [0] * days
+            }
+        if row['fact_date'] is None:
+            continue
+        i = day_index[str(row['fact_date'])[:10]]
+        amount = row['sales'] * (row['price'] or 0)
+        product['sales'][i] = row['sales']
+        product['sales_amount'][i] = amount
+        daily_sales_amount[i] += amount
+
+    for product in products.values():
+        product['total_sales'] = sum(product['sales'])
+        product['total_sales_amount'] = sum(product['sales_amount'])
+
+    return etag_response({
+        'dates': dates,
+        'products': list(products.values()),
+        'daily_sales_amount': daily_sales_amount
+    }, etag)
 
 # 판매량은 생산 - 재고로 자동 계산되므로 별도 저장 API 불필요
 
@@ -1403,26 +1880,31 @@ def get_sales_grid():
 def get_donation_grid():
     donation_date = request.args.get('date')
 
-    conn = get_db()
+    conn = get_db(readonly=True)
+    etag = data_etag(conn, ['products', 'daily_product_facts'])
+    not_modified = not_modified_response(etag)
+    if not_modified:
+        conn.close()
+        return not_modified
 
-    # 1. 정기 제품 중 재고 방식이 '일반'인 제품의 재고량 (기부량)
+    # 1. 정기 제품 중 재고 방식이 '일반'인 제품의 재고량 (기부량, 일별 집계)
     regular_query = '''SELECT p.id, p.name, p.unit, p.category, p.price, p.cost, p.stock_type,
-                      COALESCE(ir.quantity, 0) as donation_quantity,
+                      COALESCE(f.donation, 0) as donation_quantity,
                       '정기' as product_type
                FROM products p
-               LEFT JOIN inventory_records ir
-                   ON p.id = ir.product_id AND ir.inventory_date = ?
+               LEFT JOIN daily_product_facts f
+                   ON p.id = f.product_id AND f.fact_date = ?
                WHERE p.category != '비정기 제품' AND p.stock_type = '일반'
                ORDER BY p.display_order, p.name'''
 
     # 2. 비정기 제품 중 기부량이 1 이상인 제품
     irregular_query = '''SELECT p.id, p.name, p.unit, p.category, p.price, p.cost, p.stock_type,
-                      COALESCE(ir.donation, 0) as donation_quantity,
+                      COALESCE(f.donation, 0) as donation_quantity,
                       '비정기' as product_type
                FROM products p
-               LEFT JOIN irregular_product_records ir
-                   ON p.id = ir.product_id AND ir.record_date = ?
-               WHERE p.category = '비정기 제품' AND COALESCE(ir.donation, 0) >= 1
+               LEFT JOIN daily_product_facts f
+                   ON p.id = f.product_id AND f.fact_date = ?
+               WHERE p.category = '비정기 제품' AND COALESCE(f.donation, 0) >= 1
                ORDER BY p.display_order, p.name'''
 
     regular_results = conn.execute(regular_query, [donation_date]).fetchall()
@@ -1436,7 +1918,7 @@ def get_donation_grid():
     for row in irregular_results:
         donation_data.append(dict(row))
 
-    return jsonify(donation_data)
+    return etag_response(donation_data, etag)
 
 # ==================== 자재 입고 관리 API ====================
 
@@ -1447,7 +1929,7 @@ def get_material_receipts():
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
 
-    conn = get_db()
+    conn = get_db(replica=True)
     query = '''SELECT mr.*, m.name as material_name, m.unit, m.type
                FROM material_receipts mr
                JOIN materials m ON mr.material_id = m.id
@@ -1466,11 +1948,7 @@ def get_material_receipts():
         query += ' AND mr.receipt_date <= ?'
         params.append(end_date)
 
-    query += ' ORDER BY mr.receipt_date DESC, mr.created_at DESC'
-
-    receipts = conn.execute(query, params).fetchall()
-    conn.close()
-    return jsonify([dict(r) for r in receipts])
+    return list_response(conn, query, params, 'mr.receipt_date', 'mr.id')
 
 # 자재 입고 등록
 @app.route('/api/material-receipts', methods=['POST'])
@@ -1487,16 +1965,19 @@ def add_material_receipt():
     c = conn.cursor()
 
     try:
-        c.execute('''INSERT INTO material_receipts
-                    (material_id, receipt_date, quantity, unit_price, supplier, note)
-                    VALUES (?, ?, ?, ?, ?, ?)''',
-                 (material_id, receipt_date, quantity, unit_price, supplier, note))
-
-        # 자재의 평균 단가 업데이트
-        update_material_average_price(c, material_id)
+        receipt_id = insert_returning_id(c, '''INSERT INTO material_receipts
+                                               (material_id, receipt_date, quantity, unit_price, supplier, note,
+                                                remaining_quantity)
+                                               VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                                         (material_id, receipt_date, quantity, unit_price, supplier, note, quantity))
+
+        # 자재의 평균 단가(FIFO 모드면 로트 재분배 후 로트 단가) 업데이트 후 이 자재를 쓰는 프랩 자재/제품 원가 재계산
+        update_material_average_price(c, material_id, quantity, quantity * unit_price, 1)
+        reallocate_lots(conn, [material_id])
+        recompute_costs(conn, material_ids=[material_id])
+        bump_data_version(c, 'materials')
 
         conn.commit()
-        receipt_id = c.lastrowid
         conn.close()
         return jsonify({'success': True, 'id': receipt_id})
     except Exception as e:
@@ -1517,20 +1998,27 @@ def update_material_receipt(receipt_id):
 
     try:
         # 해당 입고 기록의 자재 ID 조회
-        receipt = c.execute('SELECT material_id FROM material_receipts WHERE id = ?', [receipt_id]).fetchone()
+        receipt = c.execute('''SELECT material_id, quantity, unit_price, remaining_quantity
+                               FROM material_receipts WHERE id = ?''', [receipt_id]).fetchone()
         if not receipt:
             conn.close()
             return jsonify({'success': False, 'error': '입고 기록을 찾을 수 없습니다'}), 404
 
         material_id = receipt['material_id']
+        # 입고 수량이 바뀐 만큼 로트 남은 수량도 조정
+        remaining = max(0, (receipt['remaining_quantity'] or 0) + quantity - receipt['quantity'])
 
         c.execute('''UPDATE material_receipts
-                    SET quantity = ?, unit_price = ?, supplier = ?, note = ?
+                    SET quantity = ?, unit_price = ?, supplier = ?, note = ?, remaining_quantity = ?
                     WHERE id = ?''',
-                 (quantity, unit_price, supplier, note, receipt_id))
+                 (quantity, unit_price, supplier, note, remaining, receipt_id))
 
-        # 자재의 평균 단가 업데이트
-        update_material_average_price(c, material_id)
+        # 자재의 평균 단가(FIFO 모드면 로트 재분배 후 로트 단가) 업데이트 후 이 자재를 쓰는 프랩 자재/제품 원가 재계산
+        update_material_average_price(c, material_id, quantity - receipt['quantity'],
+                                      quantity * unit_price - receipt['quantity'] * receipt['unit_price'], 0)
+        reallocate_lots(conn, [material_id])
+        recompute_costs(conn, material_ids=[material_id])
+        bump_data_version(c, 'materials')
 
         conn.commit()
         conn.close()
@@ -1547,7 +2035,8 @@ def delete_material_receipt(receipt_id):
 
     try:
         # 해당 입고 기록의 자재 ID 조회
-        receipt = c.execute('SELECT material_id FROM material_receipts WHERE id = ?', [receipt_id]).fetchone()
+        receipt = c.execute('SELECT material_id, quantity, unit_price FROM material_receipts WHERE id = ?',
+                            [receipt_id]).fetchone()
         if not receipt:
             conn.close()
             return jsonify({'success': False, 'error': '입고 기록을 찾을 수 없습니다'}), 404
@@ -1556,8 +2045,12 @@ def delete_material_receipt(receipt_id):
 
         c.execute('DELETE FROM material_receipts WHERE id = ?', [receipt_id])
 
-        # 자재의 평균 단가 업데이트
-        update_material_average_price(c, material_id)
+        # 자재의 평균 단가(FIFO 모드면 로트 재분배 후 로트 단가) 업데이트 후 이 자재를 쓰는 프랩 자재/제품 원가 재계산
+        update_material_average_price(c, material_id, -receipt['quantity'],
+                                      -receipt['quantity'] * receipt['unit_price'], -1)
+        reallocate_lots(conn, [material_id])
+        recompute_costs(conn, material_ids=[material_id])
+        bump_data_version(c, 'materials')
 
         conn.commit()
         conn.close()
@@ -1567,41 +2060,48 @@ def delete_material_receipt(receipt_id):
         return jsonify({'success': False, 'error': str(e)}), 400
 
 # 자재별 평균 단가 계산 및 업데이트 (가중평균법)
-def update_material_average_price(cursor, material_id):
-    # 모든 입고 이력의 가중평균 계산
-    result = cursor.execute('''
-        SELECT SUM(quantity * unit_price) / SUM(quantity) as avg_price
-        FROM material_receipts
-        WHERE material_id = ?
-    ''', [material_id]).fetchone()
-
-    avg_price = result['avg_price'] if result['avg_price'] else 0
-
-    # materials 테이블의 unit_price 업데이트
-    cursor.execute('UPDATE materials SET unit_price = ? WHERE id = ?', (avg_price, material_id))
+# 입고 이력 전체를 다시 합산하지 않고 material_price_totals 누계에 이번 변경분만 더함
+def update_material_average_price(cursor, material_id, quantity_delta, amount_delta, count_delta):
+    cursor.execute('''INSERT INTO material_price_totals (material_id, total_quantity, total_amount, receipt_count)
+                      VALUES (?, ?, ?, ?)
+                      ON CONFLICT (material_id) DO UPDATE SET
+                          total_quantity = material_price_totals.total_quantity + excluded.total_quantity,
+                          total_amount = material_price_totals.total_amount + excluded.total_amount,
+                          receipt_count = material_price_totals.receipt_count + excluded.receipt_count''',
+                   (material_id, quantity_delta, amount_delta, count_delta))
+    apply_material_average_price(cursor, material_id)
+
+# 입고 수량이 남아 있을 때만 원자재 단위당 가격을 입고 누계의 평균 단가로 맞춤 (프랩 자재는 레시피로 계산)
+def apply_material_average_price(cursor, material_id):
+    cursor.execute('''UPDATE materials
+                      SET price_per_unit = (SELECT total_amount / total_quantity FROM material_price_totals
+                                            WHERE material_id = ?),
+                          price_per_gram = (SELECT total_amount / total_quantity FROM material_price_totals
+                                            WHERE material_id = ?)
+                      WHERE id = ? AND type != '프랩'
+                        AND EXISTS (SELECT 1 FROM material_price_totals
+                                    WHERE material_id = ? AND receipt_count > 0 AND total_quantity > 0)''',
+                   (material_id, material_id, material_id, material_id))
 
 # 자재별 현재 평균 단가 조회
 @app.route('/api/materials/<int:material_id>/average-price', methods=['GET'])
 def get_material_average_price(material_id):
-    conn = get_db()
+    conn = get_db(readonly=True)
 
-    # 입고 이력 기반 가중평균 계산
+    # 입고 누계에서 바로 조회
     result = conn.execute('''
-        SELECT
-            SUM(quantity * unit_price) / SUM(quantity) as avg_price,
-            SUM(quantity) as total_quantity,
-            COUNT(*) as receipt_count
-        FROM material_receipts
+        SELECT total_quantity, total_amount, receipt_count
+        FROM material_price_totals
         WHERE material_id = ?
     ''', [material_id]).fetchone()
 
     conn.close()
 
-    if result and result['receipt_count'] > 0:
+    if result and result['receipt_count'] > 0 and result['total_quantity']:
         return jsonify({
             'success': True,
-            'avg_price': float(result['avg_price']) if result['avg_price'] else 0,
-            'total_quantity': float(result['total_quantity']) if result['total_quantity'] else 0,
+            'avg_price': float(result['total_amount'] / result['total_quantity']),
+            'total_quantity': float(result['total_quantity']),
             'receipt_count': result['receipt_count']
         })
     else:
@@ -1612,153 +2112,83 @@ def get_material_average_price(material_id):
             'receipt_count': 0
         })
 
+# 자재별 남아 있는 입고 로트 조회 (선입선출 순서)
+@app.route('/api/materials/<int:material_id>/lots', methods=['GET'])
+def get_material_lots(material_id):
+    conn = get_db(readonly=True)
+    lots = conn.execute('''SELECT id, receipt_date, quantity, remaining_quantity, unit_price, supplier
+                           FROM material_receipts
+                           WHERE material_id = ? AND remaining_quantity > 0
+                           ORDER BY receipt_date, id''', [material_id]).fetchall()
+    conn.close()
+    return jsonify([dict(lot) for lot in lots])
+
+# 대시보드 응답 캐시 {days: (캐시 키, 응답)}, 키는 오늘 날짜와 일별 집계/제품 데이터 버전
+DASHBOARD_CACHE_MAX = 32
+_dashboard_cache = {}
+
 @app.route('/api/dashboard/data')
 def get_dashboard_data():
     days = request.args.get('days', 30, type=int)
 
-    conn = get_db()
+    conn = get_db(replica=True)
 
     # 기준 날짜 계산
     end_date = datetime.now().date()
     start_date = end_date - timedelta(days=days-1)
 
-    # 1. 일별 판매 추이 데이터 - 정기 제품
-    regular_daily_query = '''
-        SELECT
-            pr.production_date as date,
-            SUM(pr.quantity * p.price) as sales
-        FROM production_records pr
-        JOIN products p ON pr.product_id = p.id
-        WHERE pr.production_date >= ? AND pr.production_date <= ?
-            AND p.category != '비정기 제품'
-        GROUP BY pr.production_date
-        ORDER BY pr.production_date
-    '''
-
-    # 일별 판매 추이 데이터 - 비정기 제품
-    irregular_daily_query = '''
-        SELECT
-            ir.record_date as date,
-            SUM((ir.opening_inventory + ir.production - ir.donation - ir.closing_inventory) * p.price) as sales
-        FROM irregular_product_records ir
-        JOIN products p ON ir.product_id = p.id
-        WHERE ir.record_date >= ? AND ir.record_date <= ?
-            AND p.category = '비정기 제품'
-        GROUP BY ir.record_date
-        ORDER BY ir.record_date
-    '''
-
-    regular_daily = conn.execute(regular_daily_query, [start_date, end_date]).fetchall()
-    irregular_daily = conn.execute(irregular_daily_query, [start_date, end_date]).fetchall()
-
-    # 날짜별로 데이터 병합
-    daily_sales_dict = {}
-    for row in regular_daily:
-        date_str = row['date']
-        daily_sales_dict[date_str] = {
-            'date': date_str,
-            'regular_sales': float(row['sales']) if row['sales'] else 0,
-            'irregular_sales': 0
-        }
+    # 날짜와 데이터 버전이 그대로면 이전에 계산한 결과 사용
+    versions = get_data_versions(conn, ['daily_product_facts', 'products'])
+    cache_key = (end_date, versions['daily_product_facts'], versions['products'])
+    cached = _dashboard_cache.get(days)
+    if cached and cached[0] == cache_key:
+        conn.close()
+        return jsonify(cached[1])
+
+    # 기간 내 일별 집계를 한 번 읽어 모든 항목을 계산
+    rows = conn.execute('''SELECT f.fact_date, f.product_id, p.name, p.category, p.stock_type,
+                                  f.recorded_quantity, f.revenue, f.cost, f.sales, f.donation, f.price
+                           FROM daily_product_facts f
+                           JOIN products p ON f.product_id = p.id
+                           WHERE f.fact_date >= ? AND f.fact_date <= ?''', [start_date, end_date]).fetchall()
+    conn.close()
 
-    for row in irregular_daily:
-        date_str = row['date']
-        if date_str in daily_sales_dict:
-            daily_sales_dict[date_str]['irregular_sales'] = float(row['sales']) if row['sales'] else 0
-        else:
-            daily_sales_dict[date_str] = {
-                'date': date_str,
-                'regular_sales': 0,
-                'irregular_sales': float(row['sales']) if row['sales'] else 0
-            }
+    daily_sales_dict = {}
+    category_sales = {}
+    product_sales = {}
+    total_sales = total_cost = total_donation = 0
+
+    for row in rows:
+        irregular = row['category'] == '비정기 제품'
+
+        # 매출/원가는 생산 기록 기준 (정기 제품 일별 추이, 카테고리, 제품 순위, 전체 통계)
+        if row['recorded_quantity'] is not None:
+            if not irregular:
+                day = daily_sales_dict.setdefault(row['fact_date'], {'date': row['fact_date'],
+                                                                     'regular_sales': 0, 'irregular_sales': 0})
+                day['regular_sales'] += row['revenue']
+            category = row['category'] or '기타'
+            category_sales[category] = category_sales.get(category, 0) + row['revenue']
+            product = product_sales.setdefault(row['product_id'], {'name': row['name'],
+                                                                   'total_quantity': 0, 'total_sales': 0})
+            product['total_quantity'] += row['recorded_quantity']
+            product['total_sales'] += row['revenue']
+            total_sales += row['revenue']
+            total_cost += row['cost']
+
+        # 비정기 제품 일별 추이는 판매량 * 가격
+        if irregular and row['sales'] is not None:
+            day = daily_sales_dict.setdefault(row['fact_date'], {'date': row['fact_date'],
+                                                                 'regular_sales': 0, 'irregular_sales': 0})
+            day['irregular_sales'] += row['sales'] * row['price']
+
+        # 기부: 정기 제품 중 재고 방식이 '일반'인 제품의 재고량, 비정기 제품의 기부량
+        if irregular or row['stock_type'] == '일반':
+            total_donation += row['donation'] * row['price']
 
     daily_sales = sorted(daily_sales_dict.values(), key=lambda x: x['date'])
-
-    # 2. 카테고리별 판매 분포
-    category_sales_query = '''
-        SELECT
-            COALESCE(p.category, '기타') as category,
-            SUM(pr.quantity * p.price) as total_sales
-        FROM production_records pr
-        JOIN products p ON pr.product_id = p.id
-        WHERE pr.production_date >= ? AND pr.production_date <= ?
-        GROUP BY p.category
-        ORDER BY total_sales DESC
-    '''
-
-    category_sales = conn.execute(category_sales_query, [start_date, end_date]).fetchall()
-
-    # 3. 상위 제품 판매 (TOP 5)
-    top_products_query = '''
-        SELECT
-            p.name,
-            SUM(pr.quantity) as total_quantity,
-            SUM(pr.quantity * p.price) as total_sales
-        FROM production_records pr
-        JOIN products p ON pr.product_id = p.id
-        WHERE pr.production_date >= ? AND pr.production_date <= ?
-        GROUP BY p.id, p.name
-        ORDER BY total_sales DESC
-        LIMIT 5
-    '''
-
-    top_products = conn.execute(top_products_query, [start_date, end_date]).fetchall()
-
-    # 4. 하위 제품 판매 (WORST 5)
-    worst_products_query = '''
-        SELECT
-            p.name,
-            SUM(pr.quantity) as total_quantity,
-            SUM(pr.quantity * p.price) as total_sales
-        FROM production_records pr
-        JOIN products p ON pr.product_id = p.id
-        WHERE pr.production_date >= ? AND pr.production_date <= ?
-        GROUP BY p.id, p.name
-        ORDER BY total_sales ASC
-        LIMIT 5
-    '''
-
-    worst_products = conn.execute(worst_products_query, [start_date, end_date]).fetchall()
-
-    # 5. 전체 통계
-    stats_query = '''
-        SELECT
-            SUM(pr.quantity * p.price) as total_sales,
-            SUM(pr.quantity * p.cost) as total_cost,
-            SUM(pr.quantity * (p.price - p.cost)) as total_margin
-        FROM production_records pr
-        JOIN products p ON pr.product_id = p.id
-        WHERE pr.production_date >= ? AND pr.production_date <= ?
-    '''
-
-    stats = conn.execute(stats_query, [start_date, end_date]).fetchone()
-
-    # 6. 기부 금액 계산
-    # 정기 제품 중 재고 방식이 '일반'인 제품의 재고량 * 가격
-    regular_donation_query = '''
-        SELECT SUM(ir.quantity * p.price) as total_donation
-        FROM inventory_records ir
-        JOIN products p ON ir.product_id = p.id
-        WHERE ir.inventory_date >= ? AND ir.inventory_date <= ?
-            AND p.category != '비정기 제품' AND p.stock_type = '일반'
-    '''
-
-    # 비정기 제품의 기부량 * 가격
-    irregular_donation_query = '''
-        SELECT SUM(ir.donation * p.price) as total_donation
-        FROM irregular_product_records ir
-        JOIN products p ON ir.product_id = p.id
-        WHERE ir.record_date >= ? AND ir.record_date <= ?
-            AND p.category = '비정기 제품'
-    '''
-
-    regular_donation = conn.execute(regular_donation_query, [start_date, end_date]).fetchone()
-    irregular_donation = conn.execute(irregular_donation_query, [start_date, end_date]).fetchone()
-
-    total_donation = (float(regular_donation['total_donation']) if regular_donation['total_donation'] else 0) + \
-                     (float(irregular_donation['total_donation']) if irregular_donation['total_donation'] else 0)
-
-    conn.close()
+    products_by_sales = sorted(product_sales.values(), key=lambda x: x['total_sales'], reverse=True)
+    total_margin = total_sales - total_cost
 
     # 결과 포맷팅
     dashboard_data = {
@@ -1772,38 +2202,24 @@ def get_dashboard_data():
             for row in daily_sales
         ],
         'category_sales': [
-            {
-                'category': row['category'],
-                'total_sales': float(row['total_sales']) if row['total_sales'] else 0
-            }
-            for row in category_sales
-        ],
-        'top_products': [
-            {
-                'name': row['name'],
-                'total_quantity': float(row['total_quantity']) if row['total_quantity'] else 0,
-                'total_sales': float(row['total_sales']) if row['total_sales'] else 0
-            }
-            for row in top_products
-        ],
-        'worst_products': [
-            {
-                'name': row['name'],
-                'total_quantity': float(row['total_quantity']) if row['total_quantity'] else 0,
-                'total_sales': float(row['total_sales']) if row['total_sales'] else 0
-            }
-            for row in worst_products
+            {'category': category, 'total_sales': sales}
+            for category, sales in sorted(category_sales.items(), key=lambda x: x[1], reverse=True)
         ],
+        'top_products': products_by_sales[:5],
+        'worst_products': products_by_sales[::-1][:5],
         'stats': {
-            'total_sales': float(stats['total_sales']) if stats['total_sales'] else 0,
-            'total_cost': float(stats['total_cost']) if stats['total_cost'] else 0,
-            'total_margin': float(stats['total_margin']) if stats['total_margin'] else 0,
+            'total_sales': total_sales,
+            'total_cost': total_cost,
+            'total_margin': total_margin,
             'total_donation': total_donation,
-            'avg_margin_rate': ((float(stats['total_margin']) / float(stats['total_sales']) * 100)
-                               if stats['total_sales'] and stats['total_sales'] > 0 else 0)
+            'avg_margin_rate': (total_margin / total_sales * 100) if total_sales > 0 else 0
         }
     }
 
+    if len(_dashboard_cache) >= DASHBOARD_CACHE_MAX:
+        _dashboard_cache.clear()
+    _dashboard_cache[days] = (cache_key, dashboard_data)
+
     return jsonify(dashboard_data)
 
 # ===== Ecount API 엔드포인트 =====
@@ -1917,25 +2333,21 @@ def get_ecount_sync_logs():
     limit = request.args.get('limit', 100, type=int)
     sync_type = request.args.get('type')
 
-    conn = get_db()
+    conn = get_db(replica=True)
+
+    query = 'SELECT * FROM ecount_sync_logs WHERE 1=1'
+    params = []
 
     if sync_type:
-        logs = conn.execute('''SELECT * FROM ecount_sync_logs
-                              WHERE sync_type = ?
-                              ORDER BY created_at DESC LIMIT ?''',
-                           (sync_type, limit)).fetchall()
-    else:
-        logs = conn.execute('''SELECT * FROM ecount_sync_logs
-                              ORDER BY created_at DESC LIMIT ?''',
-                           (limit,)).fetchall()
+        query += ' AND sync_type = ?'
+        params.append(sync_type)
 
-    conn.close()
-    return jsonify([dict(log) for log in logs])
+    return list_response(conn, query, params, 'created_at', 'id', limit=limit)
 
 # 동기화 통계
 @app.route('/api/ecount/sync-stats', methods=['GET'])
 def get_ecount_sync_stats():
-    conn = get_db()
+    conn = get_db(replica=True)
 
     stats = {
         'total': conn.execute('SELECT COUNT(*) as count FROM ecount_sync_logs').fetchone()['count'],
@@ -2033,20 +2445,15 @@ def apply_ecount_matches():
         conn = get_db()
         c = conn.cursor()
 
-        updated_products = 0
-        updated_materials = 0
+        product_updates = [(m['ecount_code'], m['id']) for m in matches if m['type'] == 'product']
+        material_updates = [(m['ecount_code'], m['id']) for m in matches if m['type'] == 'material']
 
-        for match in matches:
-            item_id = match['id']
-            item_type = match['type']
-            ecount_code = match['ecount_code']
+        execute_many(c, 'UPDATE products SET ecount_code = ? WHERE id = ?', product_updates)
+        execute_many(c, 'UPDATE materials SET ecount_code = ? WHERE id = ?', material_updates)
+        bump_data_version(c, 'products', 'materials')
 
-            if item_type == 'product':
-                c.execute('UPDATE products SET ecount_code = ? WHERE id = ?', (ecount_code, item_id))
-                updated_products += 1
-            elif item_type == 'material':
-                c.execute('UPDATE materials SET ecount_code = ? WHERE id = ?', (ecount_code, item_id))
-                updated_materials += 1
+        updated_products = len(product_updates)
+        updated_materials = len(material_updates)
 
         conn.commit()
         conn.close()
@@ -2090,14 +2497,18 @@ def upload_excel():
             if h:
                 col_map[h] = i
 
-        products_added = 0
-        materials_added = 0
         skipped = 0
         errors = []
 
         conn = get_db()
         c = conn.cursor()
 
+        # 이미 등록된 이름은 한 번에 조회해두고 새 항목만 모아서 일괄 등록
+        material_names = {r['name'] for r in c.execute('SELECT name FROM materials').fetchall()}
+        product_names = {r['name'] for r in c.execute('SELECT name FROM products').fetchall()}
+        new_materials = []
+        new_products = []
+
         for row in ws.iter_rows(min_row=2, values_only=True):
             try:
                 name_idx = col_map.get('품목명', 1)
@@ -2114,28 +2525,31 @@ def upload_excel():
 
                 if item_type == '원자재':
                     # 이미 존재하는지 확인
-                    existing = c.execute('SELECT id FROM materials WHERE name = ?', (name,)).fetchone()
-                    if existing:
+                    if name in material_names:
                         skipped += 1
                         continue
-                    c.execute('''INSERT INTO materials (name, type, weight, unit, purchase_price, price_per_gram, price_per_unit, ecount_code)
-                                 VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
-                             (name, '원자재', 1, spec or 'g', purchase_price, purchase_price, purchase_price, ecount_code))
-                    materials_added += 1
+                    material_names.add(name)
+                    new_materials.append((name, '원자재', 1, spec or 'g', purchase_price, purchase_price, purchase_price, ecount_code))
                 else:
                     # 이미 존재하는지 확인
-                    existing = c.execute('SELECT id FROM products WHERE name = ?', (name,)).fetchone()
-                    if existing:
+                    if name in product_names:
                         skipped += 1
                         continue
-                    c.execute('''INSERT INTO products (name, unit, price, cost, category, ecount_code, display_order)
-                                 VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                             (name, spec or '개', selling_price, purchase_price, group1 if group1 != 'None' else '기타', ecount_code, 999))
-                    products_added += 1
+                    product_names.add(name)
+                    new_products.append((name, spec or '개', selling_price, purchase_price, group1 if group1 != 'None' else '기타', ecount_code, 999))
 
             except Exception as e:
                 errors.append(f'{name}: {str(e)}')
 
+        execute_many(c, '''INSERT INTO materials (name, type, weight, unit, purchase_price, price_per_gram, price_per_unit, ecount_code)
+                           VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', new_materials)
+        execute_many(c, '''INSERT INTO products (name, unit, price, cost, category, ecount_code, display_order)
+                           VALUES (?, ?, ?, ?, ?, ?, ?)''', new_products)
+        record_cost_history(conn)
+        bump_data_version(c, 'materials', 'products')
+        materials_added = len(new_materials)
+        products_added = len(new_products)
+
         conn.commit()
         conn.close()
 
@@ -2150,6 +2564,38 @@ def upload_excel():
     except Exception as e:
         return jsonify({'success': False, 'error': f'파일 처리 오류: {str(e)}'}), 400
 
+# ==================== 관리 명령 ====================
+
+# 입고/생산 기록 전체로 자재 로트 남은 수량 재계산: flask --app app rebuild-lots
+@app.cli.command('rebuild-lots')
+def rebuild_lots_command():
+    conn = open_db()
+    try:
+        rebuild_lots(conn)
+        conn.commit()
+    finally:
+        conn.close()
+    click.echo('자재 로트 남은 수량을 다시 계산했습니다.')
+
+# 원본 기록으로 제품 일별/월별 집계 전체 재계산: flask --app app rebuild-facts
+@app.cli.command('rebuild-facts')
+def rebuild_facts_command():
+    conn = open_db()
+    try:
+        rebuild_facts(conn)
+        bump_data_version(conn, 'daily_product_facts')
+        conn.commit()
+    finally:
+        conn.close()
+    click.echo('제품 일별/월별 집계를 다시 계산했습니다.')
+
+# ==================== 진단 API ====================
+
+# DB 커넥션 풀 통계
+@app.route('/api/db/pool-stats', methods=['GET'])
+def get_db_pool_stats():
+    return jsonify(get_pool_stats())
+
 init_db()
 
 if __name__ == '__main__':
@@ -0,0 +1,372 @@
+"""자재/프랩/제품 원가 계산 그래프 (BOM).
+
+materials, material_recipes, product_materials를 한 번에 읽어 프랩 자재를 위상 정렬한 뒤
+프랩 속 프랩까지 포함해 모든 프랩 자재 원가를 한 번에 계산합니다. 제품 원가는 집계 UPDATE 한
+문장으로 갱신합니다 (recompute_product_costs).
+"""
+import math
+from collections import defaultdict, deque
+from datetime import datetime
+
+from db import DATABASE_URL, DATE_PARAM, HISTORY_START_DATE, bump_data_version, delete_rows, execute_many
+from facts import refresh_product_facts
+
+
+def unit_price(material):
+    """자재 단위당 가격 (price_per_unit, 없으면 price_per_gram, 둘 다 없으면 0)."""
+    price = material['price_per_unit']
+    if price is None:
+        price = material['price_per_gram']
+    return price or 0
+
+
+def unit_price_sql(alias='m'):
+    """unit_price와 같은 규칙의 SQL 식 (alias는 materials 별칭)."""
+    return f'COALESCE({alias}.price_per_unit, {alias}.price_per_gram, 0)'
+
+
+class CostCycleError(ValueError):
+    """프랩 자재 레시피가 순환 참조를 이룰 때 발생합니다."""
+
+    def __init__(self, material_ids):
+        self.material_ids = sorted(material_ids)
+        super().__init__(f'프랩 자재 레시피에 순환 참조가 있습니다 (자재 ID: {", ".join(map(str, self.material_ids))})')
+
+
+class CostGraph:
+    def __init__(self, materials, recipes, product_materials):
+        # materials: {id: {'type', 'weight', 'purchase_price', 'price_per_unit', 'price_per_gram'}}
+        # recipes: {prep_material_id: [(ingredient_material_id, quantity), ...]}
+        # product_materials: {product_id: [(material_id, quantity), ...]}
+        self.materials = materials
+        self.recipes = recipes
+        self.product_materials = product_materials
+
+    @classmethod
+    def load(cls, conn):
+        materials = {r['id']: dict(r) for r in conn.execute(
+            '''SELECT id, type, weight, purchase_price, price_per_unit, price_per_gram
+               FROM materials''').fetchall()}
+
+        recipes = defaultdict(list)
+        for r in conn.execute('''SELECT prep_material_id, ingredient_material_id, quantity
+                                 FROM material_recipes''').fetchall():
+            recipes[r['prep_material_id']].append((r['ingredient_material_id'], r['quantity']))
+
+        product_materials = defaultdict(list)
+        for r in conn.execute('SELECT product_id, material_id, quantity FROM product_materials').fetchall():
+            product_materials[r['product_id']].append((r['material_id'], r['quantity']))
+
+        return cls(materials, dict(recipes), dict(product_materials))
+
+    def prep_ids(self):
+        return [mid for mid, m in self.materials.items() if m['type'] == '프랩']
+
+    def prep_order(self):
+        """재료 프랩이 항상 먼저 오도록 프랩 자재를 정렬합니다 (순환 시 CostCycleError)."""
+        preps = set(self.prep_ids())
+        pending = {mid: 0 for mid in preps}
+        users = defaultdict(list)
+        for prep_id in preps:
+            for ingredient_id, _ in self.recipes.get(prep_id, []):
+                if ingredient_id in preps:
+                    pending[prep_id] += 1
+                    users[ingredient_id].append(prep_id)
+
+        queue = deque(sorted(mid for mid, count in pending.items() if count == 0))
+        order = []
+        while queue:
+            mid = queue.popleft()
+            order.append(mid)
+            for user_id in users[mid]:
+                pending[user_id] -= 1
+                if pending[user_id] == 0:
+                    queue.append(user_id)
+
+        if len(order) < len(preps):
+            raise CostCycleError(mid for mid, count in pending.items() if count > 0)
+        return order
+
+    def compute_preps(self):
+        """프랩 자재별 (원가, 단위당 가격)과 전체 자재의 단위당 가격을 계산합니다."""
+        prices = {mid: unit_price(m) for mid, m in self.materials.items()}
+        prep_costs = {}
+        for prep_id in self.prep_order():
+            total_cost = sum(quantity * prices.get(ingredient_id, 0)
+                             for ingredient_id, quantity in self.recipes.get(prep_id, []))
+            weight = self.materials[prep_id]['weight']
+            price_per_unit = total_cost / weight if weight and weight > 0 else 0
+            prep_costs[prep_id] = (total_cost, price_per_unit)
+            prices[prep_id] = price_per_unit
+        return prep_costs, prices
+
+    def raw_price(self, material_id):
+        return unit_price(self.materials[material_id])
+
+    def _expand(self, material_id, quantity, compositions):
+        # 자재 quantity만큼을 원재료별 소요량 [(원재료 ID, 양), ...]으로 펼침
+        material = self.materials.get(material_id)
+        if material is None:
+            return []
+        if material['type'] == '프랩':
+            return [(raw_id, quantity * amount) for raw_id, amount in compositions.get(material_id, {}).items()]
+        return [(material_id, quantity)]
+
+    def prep_compositions(self):
+        """프랩 자재 1단위에 들어가는 원재료별 양 {프랩 ID: {원재료 ID: 양}}을 계산합니다."""
+        compositions = {}
+        for prep_id in self.prep_order():
+            weight = self.materials[prep_id]['weight']
+            composition = defaultdict(float)
+            if weight and weight > 0:
+                for ingredient_id, quantity in self.recipes.get(prep_id, []):
+                    for raw_id, amount in self._expand(ingredient_id, quantity / weight, compositions):
+                        composition[raw_id] += amount
+            compositions[prep_id] = composition
+        return compositions
+
+    def raw_usage(self, product_quantities, compositions=None):
+        """{제품 ID: 생산량}을 다단계 BOM으로 펼쳐 {원재료 ID: 소요량}을 계산합니다."""
+        if compositions is None:
+            compositions = self.prep_compositions()
+        usage = defaultdict(float)
+        for product_id, quantity in product_quantities.items():
+            for material_id, per_unit in self.product_materials.get(product_id, []):
+                for raw_id, amount in self._expand(material_id, per_unit * quantity, compositions):
+                    usage[raw_id] += amount
+        return dict(usage)
+
+    def flatten(self):
+        """(제품 ID 목록, 원재료 ID 목록, 제품 × 원재료 소요량 행렬)을 반환합니다."""
+        import numpy as np
+
+        compositions = self.prep_compositions()
+        raw_ids = sorted(mid for mid, m in self.materials.items() if m['type'] != '프랩')
+        column = {mid: i for i, mid in enumerate(raw_ids)}
+        product_ids = sorted(self.product_materials)
+
+        matrix = np.zeros((len(product_ids), len(raw_ids)))
+        for row, product_id in enumerate(product_ids):
+            for material_id, quantity in self.product_materials[product_id]:
+                for raw_id, amount in self._expand(material_id, quantity, compositions):
+                    matrix[row, column[raw_id]] += amount
+        return product_ids, raw_ids, matrix
+
+
+def simulate_costs(graph, scenarios):
+    """원재료 가격 변동 시나리오별 제품 원가를 행렬 곱 한 번으로 계산합니다.
+
+    scenarios는 [{원재료 ID: 변동률(%)}, ...]이며 (제품 ID 목록, 현재 원가 벡터,
+    시나리오 × 제품 원가 행렬)을 반환합니다.
+    """
+    import numpy as np
+
+    product_ids, raw_ids, matrix = graph.flatten()
+    column = {mid: i for i, mid in enumerate(raw_ids)}
+    base_prices = np.array([graph.raw_price(mid) for mid in raw_ids])
+
+    multipliers = np.ones((len(scenarios), len(raw_ids)))
+    for row, shocks in enumerate(scenarios):
+        for material_id, change_pct in shocks.items():
+            if material_id not in column:
+                raise ValueError(f'원재료가 아닌 자재입니다 (자재 ID: {material_id})')
+            multipliers[row, column[material_id]] = 1 + change_pct / 100
+
+    base_costs = matrix @ base_prices
+    costs = (multipliers * base_prices) @ matrix.T
+    return product_ids, base_costs, costs
+
+
+def explode_requirements(graph, daily_plans):
+    """일자별 생산 계획 [{제품 ID: 수량}, ...]을 다단계 BOM으로 펼쳐 원재료 소요량을 계산합니다.
+
+    (원재료 ID 목록, 일자 × 원재료 소요량 행렬, 원재료 단가 벡터)를 반환하며
+    레시피가 없는 제품은 소요량에서 제외됩니다.
+    """
+    import numpy as np
+
+    product_ids, raw_ids, matrix = graph.flatten()
+    column = {pid: i for i, pid in enumerate(product_ids)}
+    plan = np.zeros((len(daily_plans), len(product_ids)))
+    for row, quantities in enumerate(daily_plans):
+        for product_id, quantity in quantities.items():
+            if product_id in column:
+                plan[row, column[product_id]] += quantity or 0
+
+    prices = np.array([graph.raw_price(mid) for mid in raw_ids])
+    return raw_ids, plan @ matrix, prices
+
+
+def _changed(old, new):
+    return old is None or not math.isclose(old, new, rel_tol=1e-12, abs_tol=1e-12)
+
+
+def record_cost_history(conn, condition='1=1', params=()):
+    """condition(제품 별칭 p)에 맞는 제품의 가격/원가 변경을 이력에 기록합니다 (커밋은 호출한 쪽에서).
+
+    이력이 없는 제품은 HISTORY_START_DATE부터 적용되는 첫 이력을 남기고, 마지막 이력이 오늘
+    기록된 것이면 그 행을 고치며, 그 밖에 값이 바뀐 제품은 오늘부터 적용되는 이력을 추가합니다.
+    """
+    params = list(params)
+    today = datetime.now().strftime('%Y-%m-%d')
+
+    # 이력이 없거나 마지막 이력과 가격/원가가 다른 제품만 기록 대상
+    rows = conn.execute(f'''SELECT p.id FROM products p
+                            LEFT JOIN product_cost_history h
+                                ON h.product_id = p.id
+                               AND h.effective_date = (SELECT MAX(effective_date) FROM product_cost_history
+                                                       WHERE product_id = p.id)
+                            WHERE ({condition})
+                              AND (h.product_id IS NULL
+                                   OR COALESCE(h.price, 0) <> COALESCE(p.price, 0)
+                                   OR COALESCE(h.cost, 0) <> COALESCE(p.cost, 0))''', params).fetchall()
+    if not rows:
+        return
+    params = [r['id'] for r in rows]
+    condition = f'p.id IN ({", ".join(["?"] * len(params))})'
+
+    conn.execute(f'''INSERT INTO product_cost_history (product_id, effective_date, price, cost, recorded_on)
+                      SELECT p.id, {DATE_PARAM}, p.price, p.cost, {DATE_PARAM} FROM products p
+                      WHERE ({condition})
+                        AND NOT EXISTS (SELECT 1 FROM product_cost_history h WHERE h.product_id = p.id)''',
+                 [HISTORY_START_DATE, today] + params)
+    conn.execute(f'''UPDATE product_cost_history
+                      SET price = (SELECT price FROM products WHERE id = product_cost_history.product_id),
+                          cost = (SELECT cost FROM products WHERE id = product_cost_history.product_id)
+                      WHERE recorded_on = ?
+                        AND effective_date = (SELECT MAX(effective_date) FROM product_cost_history h
+                                              WHERE h.product_id = product_cost_history.product_id)
+                        AND product_id IN (SELECT p.id FROM products p WHERE {condition})''',
+                 [today] + params)
+    conn.execute(f'''INSERT INTO product_cost_history (product_id, effective_date, price, cost, recorded_on)
+                      SELECT p.id, {DATE_PARAM}, p.price, p.cost, {DATE_PARAM} FROM products p
+                      WHERE ({condition})
+                        AND EXISTS (SELECT 1 FROM product_cost_history h
+                                    WHERE h.product_id = p.id
+                                      AND h.effective_date = (SELECT MAX(effective_date) FROM product_cost_history
+                                                              WHERE product_id = p.id)
+                                      AND (COALESCE(h.price, 0) <> COALESCE(p.price, 0)
+                                           OR COALESCE(h.cost, 0) <> COALESCE(p.cost, 0)))
+                      ON CONFLICT (product_id, effective_date)
+                      DO UPDATE SET price = excluded.price, cost = excluded.cost, recorded_on = excluded.recorded_on''',
+                 [today, today] + params)
+
+    # 바뀐 이력이 적용되는 날짜부터 일별 집계 갱신
+    changed = defaultdict(list)
+    for r in conn.execute(f'''SELECT product_id, MAX(effective_date) as effective_date FROM product_cost_history
+                               WHERE recorded_on = ? AND product_id IN (SELECT p.id FROM products p WHERE {condition})
+                               GROUP BY product_id''', [today] + params).fetchall():
+        changed[str(r['effective_date'])[:10]].append(r['product_id'])
+    for effective_date, ids in changed.items():
+        refresh_product_facts(conn, ids, effective_date)
+    bump_data_version(conn, 'products', 'daily_product_facts')
+
+
+def refresh_cost_breakdown(c, condition='1=1', params=(), graph=None):
+    """condition(제품 별칭 p)에 맞는 제품의 원재료별 원가 구성을 다시 만듭니다 (커밋은 호출한 쪽에서).
+
+    프랩 자재는 원재료까지 펼쳐 제품 1개당 원재료별 양/원가/비중(%)을 product_cost_breakdown에 저장합니다.
+    graph를 넘기면 이미 읽어 둔 원가 그래프를 그대로 사용합니다.
+    """
+    product_ids = [r['id'] for r in c.execute(f'SELECT p.id FROM products p WHERE {condition}',
+                                              list(params)).fetchall()]
+    if not product_ids:
+        return
+
+    graph = graph or CostGraph.load(c)
+    compositions = graph.prep_compositions()
+    rows = []
+    for product_id in product_ids:
+        usage = graph.raw_usage({product_id: 1}, compositions)
+        costs = {mid: quantity * graph.raw_price(mid) for mid, quantity in usage.items()}
+        total_cost = sum(costs.values())
+        for mid, quantity in usage.items():
+            share = costs[mid] / total_cost * 100 if total_cost else 0
+            rows.append((product_id, mid, quantity, graph.raw_price(mid), costs[mid], share))
+
+    delete_rows(c, 'product_cost_breakdown', 'product_id', product_ids)
+    execute_many(c, '''INSERT INTO product_cost_breakdown
+                        (product_id, material_id, quantity, unit_price, cost, cost_share)
+                        VALUES (?, ?, ?, ?, ?, ?)''', rows)
+
+
+def recompute_product_costs(conn, product_ids=(), material_ids=(), all_products=False, graph=None):
+    """제품 원가를 집계 UPDATE 한 문장으로 다시 계산합니다 (커밋은 호출한 쪽에서).
+
+    대상은 product_ids의 제품과 material_ids의 자재를 쓰는 제품이며,
+    all_products=True면 레시피가 있는 모든 제품입니다. graph는 원가 구성 갱신에 사용합니다.
+    """
+    product_ids = list(product_ids)
+    material_ids = list(material_ids)
+    if not (product_ids or material_ids or all_products):
+        return
+
+    conditions = []
+    params = []
+    if all_products:
+        conditions.append('p.id IN (SELECT product_id FROM product_materials)')
+    if product_ids:
+        conditions.append(f'p.id IN ({", ".join(["?"] * len(product_ids))})')
+        params += product_ids
+    if material_ids:
+        conditions.append(f'''p.id IN (SELECT product_id FROM product_materials
+                                   WHERE material_id IN ({", ".join(["?"] * len(material_ids))}))''')
+        params += material_ids
+    target = ' OR '.join(conditions)
+
+    # 자재 단가는 unit_price와 같은 규칙 (price_per_unit, 없으면 price_per_gram)
+    price = unit_price_sql('m')
+    if DATABASE_URL:
+        conn.execute(f'''UPDATE products SET cost = agg.total_cost
+                          FROM (SELECT p.id,
+                                       COALESCE(SUM(pm.quantity * {price}), 0) AS total_cost
+                                FROM products p
+                                LEFT JOIN product_materials pm ON pm.product_id = p.id
+                                LEFT JOIN materials m ON pm.material_id = m.id
+                                WHERE {target}
+                                GROUP BY p.id) agg
+                          WHERE products.id = agg.id''', params)
+    else:
+        conn.execute(f'''UPDATE products
+                          SET cost = COALESCE((SELECT SUM(pm.quantity * {price})
+                                               FROM product_materials pm
+                                               JOIN materials m ON pm.material_id = m.id
+                                               WHERE pm.product_id = products.id), 0)
+                          WHERE id IN (SELECT p.id FROM products p WHERE {target})''', params)
+
+    # 원가가 바뀐 제품은 이력에 기록하고 원가 구성 캐시 갱신
+    record_cost_history(conn, target, params)
+    refresh_cost_breakdown(conn, target, params, graph)
+
+
+def recompute_costs(conn, product_ids=(), material_ids=None, graph=None):
+    """프랩 자재 원가를 다시 계산하고 영향받는 제품 원가를 갱신합니다 (커밋은 호출한 쪽에서).
+
+    material_ids를 넘기면 해당 자재와 원가가 바뀐 프랩 자재를 쓰는 제품만, 생략하면 레시피가 있는
+    모든 제품을 갱신합니다. 레시피가 없는 제품은 직접 입력한 원가를 유지하며 product_ids로 넘긴
+    제품만 0으로 맞춥니다. 원가가 바뀐 프랩 자재 ID 집합을 반환합니다.
+    graph를 넘기면 이미 읽어 둔 원가 그래프(현재 자재 단가 반영)를 사용합니다.
+    """
+    graph = graph or CostGraph.load(conn)
+    prep_costs, _ = graph.compute_preps()
+
+    material_updates = []
+    for mid, (total_cost, price_per_unit) in prep_costs.items():
+        m = graph.materials[mid]
+        if (_changed(m['purchase_price'], total_cost) or _changed(m['price_per_unit'], price_per_unit)
+                or _changed(m['price_per_gram'], price_per_unit)):
+            material_updates.append((total_cost, price_per_unit, price_per_unit, mid))
+
+    execute_many(conn.cursor(), '''UPDATE materials
+                                   SET purchase_price = ?, price_per_unit = ?, price_per_gram = ?
+                                   WHERE id = ?''', material_updates)
+    for total_cost, price_per_unit, _, mid in material_updates:
+        graph.materials[mid].update(purchase_price=total_cost, price_per_unit=price_per_unit,
+                                    price_per_gram=price_per_unit)
+
+    changed_preps = {mid for _, _, _, mid in material_updates}
+    if material_ids is None:
+        recompute_product_costs(conn, product_ids, all_products=True, graph=graph)
+    else:
+        recompute_product_costs(conn, product_ids, set(material_ids) | changed_preps, graph=graph)
+    return changed_preps
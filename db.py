@@ -1,26 +1,100 @@
+import functools
+import itertools
 import os
+import re
 import sqlite3
+import threading
+import time
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
+# 조회 전용 복제본 (없으면 조회도 기본 DB 사용)
+DATABASE_READ_URL = os.environ.get('DATABASE_READ_URL')
+SQLITE_PATH = os.environ.get('SQLITE_PATH', 'production.db')
+
+# SQLite 성능 설정 (빈 값이면 해당 PRAGMA를 적용하지 않음)
+SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', '5000'))  # ms
+SQLITE_CACHE_SIZE = os.environ.get('SQLITE_CACHE_SIZE', '-20000')  # 음수는 KiB 단위
+SQLITE_MMAP_SIZE = os.environ.get('SQLITE_MMAP_SIZE', '268435456')
+SQLITE_TEMP_STORE = os.environ.get('SQLITE_TEMP_STORE', 'MEMORY')
+# 조회 전용 라우트에 mode=ro 연결 사용 여부
+SQLITE_READONLY = os.environ.get('SQLITE_READONLY', '1') != '0'
+
+# 커넥션 풀 설정 (DB_POOL=0 이면 요청마다 새 연결)
+DB_POOL_ENABLED = os.environ.get('DB_POOL', '1') != '0'
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '10'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '30'))
+DB_POOL_CHECK_INTERVAL = float(os.environ.get('DB_POOL_CHECK_INTERVAL', '30'))
+
+# executemany 한 번의 왕복에 보내는 행 수
+DB_BATCH_PAGE_SIZE = int(os.environ.get('DB_BATCH_PAGE_SIZE', '500'))
+# 스트리밍 조회 시 서버 측 커서에서 한 번에 가져오는 행 수
+DB_STREAM_ITERSIZE = int(os.environ.get('DB_STREAM_ITERSIZE', '1000'))
 
 if DATABASE_URL:
     import psycopg2
+    import psycopg2.extensions
     import psycopg2.extras
-    if DATABASE_URL.startswith('postgres://'):
-        DATABASE_URL = DATABASE_URL.replace('postgres://', 'postgresql://', 1)
+    import psycopg2.pool
+    def _normalize_url(url):
+        if url and url.startswith('postgres://'):
+            return url.replace('postgres://', 'postgresql://', 1)
+        return url
+
+    DATABASE_URL = _normalize_url(DATABASE_URL)
+    DATABASE_READ_URL = _normalize_url(DATABASE_READ_URL)
+
+    @functools.lru_cache(maxsize=512)
+    def _translate(query):
+        # SQLite 문법(?, last_insert_rowid())을 psycopg2 문법으로 변환 (쿼리 문자열별로 한 번만)
+        query = query.replace('?', '%s')
+        if 'last_insert_rowid()' in query:
+            query = query.replace('last_insert_rowid()', 'lastval()')
+        return query, query.lstrip().upper().startswith('INSERT')
+
+    _VALUES_RE = re.compile(r'\bVALUES\s*(\((?:\s*%s\s*,)*\s*%s\s*\))', re.IGNORECASE)
+
+    @functools.lru_cache(maxsize=128)
+    def _translate_many(query):
+        # INSERT ... VALUES (%s, ...) 형태면 execute_values용 쿼리와 템플릿으로 분리
+        query, is_insert = _translate(query)
+        match = _VALUES_RE.search(query)
+        if not is_insert or not match:
+            return query, None
+        return query[:match.start(1)] + '%s' + query[match.end(1):], match.group(1)
 
     class PgCursor:
         def __init__(self, cur, conn):
             self._cur = cur
             self._conn = conn
             self._lastrowid = None
+            self._inserted = False
 
         def execute(self, query, params=None):
-            query = query.replace('?', '%s')
-            if 'last_insert_rowid()' in query:
-                query = query.replace('last_insert_rowid()', 'lastval()')
+            query, is_insert = _translate(query)
             self._cur.execute(query, tuple(params) if params else None)
-            if query.strip().upper().startswith('INSERT'):
+            self._lastrowid = None
+            self._inserted = is_insert
+            return self
+
+        def executemany(self, query, seq_of_params, page_size=None):
+            page_size = page_size or DB_BATCH_PAGE_SIZE
+            query, template = _translate_many(query)
+            rows = [tuple(params) for params in seq_of_params]
+            if template:
+                psycopg2.extras.execute_values(self._cur, query, rows, template=template, page_size=page_size)
+            else:
+                psycopg2.extras.execute_batch(self._cur, query, rows, page_size=page_size)
+            self._lastrowid = None
+            self._inserted = False
+            return self
+
+        @property
+        def lastrowid(self):
+            # 실제로 필요할 때만 lastval() 조회 (새 코드는 insert_returning_id 사용)
+            if self._lastrowid is None and self._inserted:
                 try:
                     temp = self._conn.cursor()
                     temp.execute("SELECT lastval()")
@@ -28,10 +102,6 @@ if DATABASE_URL:
                     temp.close()
                 except Exception:
                     self._lastrowid = None
-            return self
-
-        @property
-        def lastrowid(self):
             return self._lastrowid
 
         def fetchone(self):
@@ -40,54 +110,448 @@ if DATABASE_URL:
         def fetchall(self):
             return self._cur.fetchall()
 
+    class PgPool:
+        """스레드 안전한 PostgreSQL 커넥션 풀 (최대 maxconn개, 체크아웃 시 헬스체크)."""
+
+        def __init__(self, dsn, minconn, maxconn, timeout, check_interval):
+            self._dsn = dsn
+            self._minconn = minconn
+            self._maxconn = max(maxconn, 1)
+            self._timeout = timeout
+            self._check_interval = check_interval
+            self._cond = threading.Condition()
+            self._idle = []  # [(raw_conn, 마지막 반납 시각)]
+            self._in_use = 0
+            self._warmed = False
+            self._stats = {'created': 0, 'closed': 0, 'checkouts': 0, 'waits': 0,
+                           'timeouts': 0, 'health_check_failures': 0}
+
+        def _connect(self):
+            raw = psycopg2.connect(self._dsn, cursor_factory=psycopg2.extras.RealDictCursor)
+            with self._cond:
+                self._stats['created'] += 1
+            return raw
+
+        def _discard(self, raw):
+            try:
+                raw.close()
+            except Exception:
+                pass
+            with self._cond:
+                self._stats['closed'] += 1
+
+        def _is_healthy(self, raw, last_used):
+            if raw.closed:
+                return False
+            if time.monotonic() - last_used < self._check_interval:
+                return True
+            # 오래 쉬고 있던 연결은 서버가 끊었을 수 있으므로 실제로 확인
+            try:
+                cur = raw.cursor()
+                cur.execute('SELECT 1')
+                cur.close()
+                raw.rollback()
+                return True
+            except Exception:
+                return False
+
+        def _warm(self):
+            # 최소 연결 수만큼 미리 열어둠 (첫 체크아웃 시 한 번)
+            for _ in range(self._minconn - 1):
+                try:
+                    raw = self._connect()
+                except Exception:
+                    break
+                with self._cond:
+                    if self._in_use + len(self._idle) >= self._maxconn:
+                        self._discard(raw)
+                        break
+                    self._idle.append((raw, time.monotonic()))
+                    self._cond.notify()
+
+        def getconn(self):
+            deadline = time.monotonic() + self._timeout
+            with self._cond:
+                warm = not self._warmed
+                self._warmed = True
+                while True:
+                    if self._idle:
+                        raw, last_used = self._idle.pop()
+                        break
+                    if self._in_use < self._maxconn:
+                        raw, last_used = None, None
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise psycopg2.pool.PoolError('커넥션 풀이 가득 찼습니다')
+                    self._stats['waits'] += 1
+                    self._cond.wait(remaining)
+                self._in_use += 1
+                self._stats['checkouts'] += 1
+
+            try:
+                if raw is not None and not self._is_healthy(raw, last_used):
+                    with self._cond:
+                        self._stats['health_check_failures'] += 1
+                    self._discard(raw)
+                    raw = None
+                if raw is None:
+                    raw = self._connect()
+            except Exception:
+                with self._cond:
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+
+            if warm:
+                self._warm()
+            return raw
+
+        def putconn(self, raw):
+            # 커밋되지 않은 트랜잭션은 close()와 동일하게 버림
+            try:
+                if not raw.closed and raw.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    raw.rollback()
+            except Exception:
+                self._discard(raw)
+            with self._cond:
+                self._in_use -= 1
+                if not raw.closed:
+                    self._idle.append((raw, time.monotonic()))
+                self._cond.notify()
+
+        def closeall(self):
+            with self._cond:
+                idle, self._idle = self._idle, []
+            for raw, _ in idle:
+                self._discard(raw)
+
+        def stats(self):
+            with self._cond:
+                stats = dict(self._stats)
+                stats.update(in_use=self._in_use, idle=len(self._idle),
+                             min=self._minconn, max=self._maxconn)
+            return stats
+
+    _stream_ids = itertools.count(1)
+
+    _pg_pool = PgPool(DATABASE_URL, DB_POOL_MIN, DB_POOL_MAX,
+                      DB_POOL_TIMEOUT, DB_POOL_CHECK_INTERVAL)
+    _pg_read_pool = None
+    if DATABASE_READ_URL:
+        _pg_read_pool = PgPool(DATABASE_READ_URL, DB_POOL_MIN, DB_POOL_MAX,
+                               DB_POOL_TIMEOUT, DB_POOL_CHECK_INTERVAL)
+
     class PgConnection:
-        def __init__(self):
-            self._conn = psycopg2.connect(
-                DATABASE_URL,
-                cursor_factory=psycopg2.extras.RealDictCursor
-            )
+        def __init__(self, pool=None, dsn=None):
+            self._pool = pool
+            if pool is not None:
+                self._conn = pool.getconn()
+            else:
+                self._conn = psycopg2.connect(
+                    dsn or DATABASE_URL,
+                    cursor_factory=psycopg2.extras.RealDictCursor
+                )
 
         def execute(self, query, params=None):
             cur = PgCursor(self._conn.cursor(), self._conn)
             cur.execute(query, params)
             return cur
 
+        def executemany(self, query, seq_of_params, page_size=None):
+            cur = PgCursor(self._conn.cursor(), self._conn)
+            cur.executemany(query, seq_of_params, page_size)
+            return cur
+
         def cursor(self):
             return PgCursor(self._conn.cursor(), self._conn)
 
+        def iterate(self, query, params=None, itersize=None):
+            # 이름 있는 커서(서버 측 커서)로 itersize 행씩 가져옴
+            cur = self._conn.cursor(name=f'stream_{next(_stream_ids)}')
+            cur.itersize = itersize or DB_STREAM_ITERSIZE
+            try:
+                cur.execute(_translate(query)[0], tuple(params) if params else None)
+                yield from cur
+            finally:
+                cur.close()
+
         def commit(self):
             self._conn.commit()
 
+        def rollback(self):
+            self._conn.rollback()
+
         def close(self):
-            self._conn.close()
+            if self._conn is None:
+                return
+            conn, self._conn = self._conn, None
+            if self._pool is not None:
+                self._pool.putconn(conn)
+            else:
+                conn.close()
+
+        def __del__(self):
+            # 예외 경로에서 close()가 빠진 연결도 풀로 돌려보냄
+            try:
+                self.close()
+            except Exception:
+                pass
+
+
+# SQLite는 스레드마다 연결 하나를 재사용
+_sqlite_local = threading.local()
+_sqlite_stats_lock = threading.Lock()
+_sqlite_stats = {'created': 0, 'closed': 0, 'checkouts': 0, 'reused': 0,
+                 'health_check_failures': 0}
+
+
+def _count_sqlite(key):
+    with _sqlite_stats_lock:
+        _sqlite_stats[key] += 1
+
+
+class SqliteConnection(sqlite3.Connection):
+    _slot = 'conn'
+
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+        if DB_POOL_ENABLED:
+            idle = getattr(_sqlite_local, self._slot, None)
+            if idle is self:
+                return
+            if idle is None:
+                setattr(_sqlite_local, self._slot, self)
+                return
+        _count_sqlite('closed')
+        super().close()
+
+
+_sqlite_journal_mode_set = False
+
+
+def _apply_sqlite_profile(conn, readonly):
+    global _sqlite_journal_mode_set
+    # journal_mode는 DB 파일에 저장되므로 프로세스당 한 번만 설정
+    if SQLITE_JOURNAL_MODE and not readonly and not _sqlite_journal_mode_set:
+        conn.execute(f'PRAGMA journal_mode={SQLITE_JOURNAL_MODE}')
+        _sqlite_journal_mode_set = True
+    for pragma, value in (('synchronous', SQLITE_SYNCHRONOUS),
+                          ('cache_size', SQLITE_CACHE_SIZE),
+                          ('mmap_size', SQLITE_MMAP_SIZE),
+                          ('temp_store', SQLITE_TEMP_STORE)):
+        if value:
+            conn.execute(f'PRAGMA {pragma}={value}')
+
+
+def _sqlite_connect(readonly=False):
+    if readonly:
+        conn = sqlite3.connect(f'file:{SQLITE_PATH}?mode=ro', uri=True,
+                               timeout=SQLITE_BUSY_TIMEOUT / 1000, factory=SqliteConnection)
+        conn._slot = 'ro_conn'
+    else:
+        conn = sqlite3.connect(SQLITE_PATH, timeout=SQLITE_BUSY_TIMEOUT / 1000, factory=SqliteConnection)
+    conn.row_factory = sqlite3.Row
+    _apply_sqlite_profile(conn, readonly)
+    _count_sqlite('created')
+    return conn
+
+
+def _get_sqlite(readonly=False):
+    _count_sqlite('checkouts')
+    slot = 'ro_conn' if readonly else 'conn'
+    conn = getattr(_sqlite_local, slot, None)
+    if conn is not None:
+        setattr(_sqlite_local, slot, None)
+        try:
+            conn.execute('SELECT 1')
+            _count_sqlite('reused')
+            return conn
+        except sqlite3.Error:
+            _count_sqlite('health_check_failures')
+    return _sqlite_connect(readonly)
+
+
+def get_db(readonly=False, replica=False):
+    """DB 연결을 반환합니다.
+
+    readonly=True면 조회 전용 연결 (SQLite mode=ro), replica=True면 조회 전용이면서
+    DATABASE_READ_URL 복제본으로 보냅니다 (복제 지연이 허용되는 통계/이력 조회용).
+    """
+    if DATABASE_URL:
+        if replica and DATABASE_READ_URL:
+            return PgConnection(_pg_read_pool if DB_POOL_ENABLED else None, DATABASE_READ_URL)
+        return PgConnection(_pg_pool if DB_POOL_ENABLED else None)
+    readonly = (readonly or replica) and SQLITE_READONLY
+    if DB_POOL_ENABLED:
+        return _get_sqlite(readonly)
+    return _sqlite_connect(readonly)
 
 
-def get_db():
+def get_pool_stats():
+    """커넥션 풀 통계를 반환합니다."""
     if DATABASE_URL:
-        return PgConnection()
+        stats = _pg_pool.stats()
+        stats['backend'] = 'postgresql'
+        if _pg_read_pool is not None:
+            stats['read_replica'] = _pg_read_pool.stats()
     else:
-        conn = sqlite3.connect('production.db')
-        conn.row_factory = sqlite3.Row
-        return conn
+        with _sqlite_stats_lock:
+            stats = dict(_sqlite_stats)
+        stats['backend'] = 'sqlite'
+    stats['enabled'] = DB_POOL_ENABLED
+    return stats
+
+
+# 한 문장에 넣는 바인딩 파라미터 최대 개수 (구버전 SQLite 한도 999 이하)
+SQL_MAX_PARAMS = 900
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def insert_returning_id(c, query, params=()):
+    """INSERT를 실행하고 새 행의 id를 반환합니다 (PostgreSQL은 RETURNING id로 한 번에 조회)."""
+    if DATABASE_URL:
+        return c.execute(query + ' RETURNING id', params).fetchone()['id']
+    return c.execute(query, params).lastrowid
+
+
+def execute_many(c, query, rows, page_size=None):
+    """같은 쿼리를 여러 파라미터로 실행합니다.
+
+    PostgreSQL은 execute_values/execute_batch로 page_size 행씩 묶어 보내고,
+    SQLite는 기본 executemany를 사용합니다.
+    """
+    page_size = page_size or DB_BATCH_PAGE_SIZE
+    if DATABASE_URL:
+        return c.executemany(query, rows, page_size)
+    rows = list(rows)
+    for chunk in _chunks(rows, page_size):
+        c.executemany(query, chunk)
+    return c
+
+
+def iter_rows(conn, query, params=(), itersize=None):
+    """조회 결과를 한꺼번에 메모리에 올리지 않고 한 행씩 반환합니다."""
+    if DATABASE_URL:
+        yield from conn.iterate(query, params, itersize)
+    else:
+        yield from conn.execute(query, params)
+
+
+def upsert_rows(c, table, columns, rows, conflict_columns, update_columns):
+    """여러 행을 INSERT ... ON CONFLICT DO UPDATE 한 문장으로 저장합니다."""
+    rows = list(rows)
+    if not rows:
+        return
+    placeholder = '(' + ', '.join(['?'] * len(columns)) + ')'
+    updates = ', '.join(f'{col} = excluded.{col}' for col in update_columns)
+    for chunk in _chunks(rows, max(1, SQL_MAX_PARAMS // len(columns))):
+        c.execute(f'''INSERT INTO {table} ({', '.join(columns)})
+                     VALUES {', '.join([placeholder] * len(chunk))}
+                     ON CONFLICT ({', '.join(conflict_columns)}) DO UPDATE SET {updates}''',
+                  [value for row in chunk for value in row])
+
+
+def delete_rows(c, table, column, values, condition='1=1', params=()):
+    """condition을 만족하고 column 값이 values에 포함된 행을 한 문장으로 삭제합니다."""
+    values = list(values)
+    for chunk in _chunks(values, SQL_MAX_PARAMS - len(params)):
+        c.execute(f'''DELETE FROM {table}
+                     WHERE {condition} AND {column} IN ({', '.join(['?'] * len(chunk))})''',
+                  list(params) + chunk)
+
+
+def bump_data_version(c, *names):
+    """names 데이터(보통 테이블 이름)의 버전을 1씩 올립니다 (캐시/ETag 무효화용, 커밋은 호출한 쪽에서)."""
+    execute_many(c, '''INSERT INTO data_versions (name, version) VALUES (?, 1)
+                        ON CONFLICT (name) DO UPDATE SET version = data_versions.version + 1''',
+                 [(name,) for name in sorted(set(names))])
+
+
+def get_data_versions(c, names):
+    """{이름: 버전}을 반환합니다 (한 번도 바뀐 적 없으면 0)."""
+    names = list(names)
+    rows = c.execute(f'''SELECT name, version FROM data_versions
+                          WHERE name IN ({', '.join(['?'] * len(names))})''', names).fetchall()
+    versions = {name: 0 for name in names}
+    versions.update({r['name']: r['version'] for r in rows})
+    return versions
+
+
+def column_exists(c, table, column):
+    if DATABASE_URL:
+        row = c.execute('''SELECT 1 AS found FROM information_schema.columns
+                           WHERE table_name = ? AND column_name = ?''', (table, column)).fetchone()
+        return row is not None
+    return any(r['name'] == column for r in c.execute(f'PRAGMA table_info({table})').fetchall())
 
 
 def safe_add_column(c, table, column, col_type):
+    if not column_exists(c, table, column):
+        c.execute(f'ALTER TABLE {table} ADD COLUMN {column} {col_type}')
+
+
+def index_exists(c, name):
     if DATABASE_URL:
-        c.execute(f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {col_type}')
+        row = c.execute('SELECT 1 AS found FROM pg_indexes WHERE indexname = ?', (name,)).fetchone()
     else:
-        try:
-            c.execute(f'ALTER TABLE {table} ADD COLUMN {column} {col_type}')
-        except Exception:
-            pass
+        row = c.execute("SELECT 1 AS found FROM sqlite_master WHERE type = 'index' AND name = ?",
+                        (name,)).fetchone()
+    return row is not None
 
 
-def init_db():
-    conn = get_db()
-    c = conn.cursor()
-    auto_id = "SERIAL PRIMARY KEY" if DATABASE_URL else "INTEGER PRIMARY KEY AUTOINCREMENT"
+def safe_create_index(c, name, table, columns, unique=False, where=None, sum_columns=()):
+    if unique and not index_exists(c, name):
+        # 유니크 키 적용 전 중복 행 정리 (가장 최근에 입력된 행만 남김)
+        # sum_columns를 주면 남길 행에 중복 행들의 합계를 먼저 옮김 (누적 입력 기록용)
+        if sum_columns:
+            match = ' AND '.join(f'd.{col} = {table}.{col}' for col in (col.strip() for col in columns.split(',')))
+            totals = ', '.join(f'{col} = (SELECT SUM(d.{col}) FROM {table} d WHERE {match})' for col in sum_columns)
+            c.execute(f'''UPDATE {table}
+                         SET {totals}
+                         WHERE id IN (SELECT MAX(id) FROM {table} GROUP BY {columns} HAVING COUNT(*) > 1)''')
+        c.execute(f'''DELETE FROM {table}
+                     WHERE id NOT IN (SELECT MAX(id) FROM {table} GROUP BY {columns})''')
+    c.execute(f'CREATE {"UNIQUE " if unique else ""}INDEX IF NOT EXISTS {name} ON {table} ({columns})'
+              + (f' WHERE {where}' if where else ''))
+
 
+# ==================== 스키마 마이그레이션 ====================
+
+AUTO_ID = "SERIAL PRIMARY KEY" if DATABASE_URL else "INTEGER PRIMARY KEY AUTOINCREMENT"
+
+# INSERT ... SELECT 등에서 문자열 파라미터를 DATE 컬럼 값으로 쓸 때 (PostgreSQL은 text로 추론)
+DATE_PARAM = "CAST(? AS DATE)" if DATABASE_URL else "?"
+
+# 제품 원가/가격 이력의 최초 적용일 (이력 도입 전 기록에도 적용)
+HISTORY_START_DATE = '1900-01-01'
+
+
+# 마이그레이션 SQL용 날짜 계산 (PostgreSQL은 DATE 연산, SQLite는 'YYYY-MM-DD' 문자열 날짜 함수)
+def _day_offset_sql(column, days):
+    if DATABASE_URL:
+        return f'({column} + {days})'
+    return f"date({column}, '{days:+d} day')"
+
+
+def _month_start_sql(column):
+    if DATABASE_URL:
+        return f"CAST(date_trunc('month', {column}) AS DATE)"
+    return f"date({column}, 'start of month')"
+
+# 여러 워커가 동시에 시작할 때 마이그레이션을 한 곳에서만 실행하기 위한 PostgreSQL advisory lock 키
+SCHEMA_LOCK_ID = 72120001
+
+
+def _migrate_base_tables(c):
     c.execute(f'''CREATE TABLE IF NOT EXISTS products
-                 (id {auto_id},
+                 (id {AUTO_ID},
                   name TEXT NOT NULL UNIQUE,
                   unit TEXT NOT NULL,
                   price REAL DEFAULT 0,
@@ -99,7 +563,7 @@ def init_db():
                   created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
 
     c.execute(f'''CREATE TABLE IF NOT EXISTS production_records
-                 (id {auto_id},
+                 (id {AUTO_ID},
                   product_id INTEGER NOT NULL,
                   quantity REAL NOT NULL,
                   production_date DATE NOT NULL,
@@ -107,7 +571,7 @@ def init_db():
                   created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
 
     c.execute(f'''CREATE TABLE IF NOT EXISTS materials
-                 (id {auto_id},
+                 (id {AUTO_ID},
                   name TEXT NOT NULL UNIQUE,
                   type TEXT DEFAULT '원자재',
                   weight REAL NOT NULL,
@@ -121,28 +585,28 @@ def init_db():
                   created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
 
     c.execute(f'''CREATE TABLE IF NOT EXISTS product_materials
-                 (id {auto_id},
+                 (id {AUTO_ID},
                   product_id INTEGER NOT NULL,
                   material_id INTEGER NOT NULL,
                   quantity REAL NOT NULL,
                   created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
 
     c.execute(f'''CREATE TABLE IF NOT EXISTS target_production
-                 (id {auto_id},
+                 (id {AUTO_ID},
                   product_id INTEGER NOT NULL UNIQUE,
                   weekday_target REAL DEFAULT 0,
                   weekend_target REAL DEFAULT 0,
                   created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
 
     c.execute(f'''CREATE TABLE IF NOT EXISTS material_recipes
-                 (id {auto_id},
+                 (id {AUTO_ID},
                   prep_material_id INTEGER NOT NULL,
                   ingredient_material_id INTEGER NOT NULL,
                   quantity REAL NOT NULL,
                   created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
 
     c.execute(f'''CREATE TABLE IF NOT EXISTS inventory_records
-                 (id {auto_id},
+                 (id {AUTO_ID},
                   product_id INTEGER NOT NULL,
                   quantity REAL NOT NULL,
                   inventory_date DATE NOT NULL,
@@ -150,7 +614,7 @@ def init_db():
                   created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
 
     c.execute(f'''CREATE TABLE IF NOT EXISTS irregular_product_records
-                 (id {auto_id},
+                 (id {AUTO_ID},
                   product_id INTEGER NOT NULL,
                   opening_inventory REAL NOT NULL DEFAULT 0,
                   production REAL NOT NULL DEFAULT 0,
@@ -161,7 +625,7 @@ def init_db():
                   created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
 
     c.execute(f'''CREATE TABLE IF NOT EXISTS sales_records
-                 (id {auto_id},
+                 (id {AUTO_ID},
                   product_id INTEGER NOT NULL,
                   quantity REAL NOT NULL,
                   sales_date DATE NOT NULL,
@@ -169,7 +633,7 @@ def init_db():
                   created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
 
     c.execute(f'''CREATE TABLE IF NOT EXISTS material_receipts
-                 (id {auto_id},
+                 (id {AUTO_ID},
                   material_id INTEGER NOT NULL,
                   receipt_date DATE NOT NULL,
                   quantity REAL NOT NULL,
@@ -179,7 +643,7 @@ def init_db():
                   created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
 
     c.execute(f'''CREATE TABLE IF NOT EXISTS ecount_settings
-                 (id {auto_id},
+                 (id {AUTO_ID},
                   com_code TEXT NOT NULL,
                   user_id TEXT NOT NULL,
                   zone TEXT NOT NULL,
@@ -190,7 +654,7 @@ def init_db():
                   updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
 
     c.execute(f'''CREATE TABLE IF NOT EXISTS ecount_sync_logs
-                 (id {auto_id},
+                 (id {AUTO_ID},
                   sync_type TEXT NOT NULL,
                   record_id INTEGER,
                   record_type TEXT,
@@ -209,5 +673,288 @@ def init_db():
     safe_add_column(c, 'materials', 'price_per_unit', 'REAL DEFAULT 0')
     safe_add_column(c, 'materials', 'ecount_code', 'TEXT')
 
-    conn.commit()
-    conn.close()
+
+def _migrate_record_indexes(c):
+    # 제품×날짜 기록 테이블은 하루에 한 행 (그리드 조회/저장 키)
+    # 생산 기록은 같은 날 여러 번 추가된 수량과 입력 건수(entry_count, 통계의 기록 수)를 합쳐 한 행으로,
+    # 재고/비정기 기록은 최근 입력값만 남김
+    safe_add_column(c, 'production_records', 'entry_count', 'INTEGER DEFAULT 1')
+    safe_create_index(c, 'ux_production_records_product_date', 'production_records',
+                      'product_id, production_date', unique=True, sum_columns=('quantity', 'entry_count'))
+    safe_create_index(c, 'ux_inventory_records_product_date', 'inventory_records',
+                      'product_id, inventory_date', unique=True)
+    safe_create_index(c, 'ux_irregular_product_records_product_date', 'irregular_product_records',
+                      'product_id, record_date', unique=True)
+
+    # 대시보드/통계의 기간 조회용
+    safe_create_index(c, 'ix_production_records_date', 'production_records', 'production_date')
+    safe_create_index(c, 'ix_inventory_records_date', 'inventory_records', 'inventory_date')
+    safe_create_index(c, 'ix_irregular_product_records_date', 'irregular_product_records', 'record_date')
+
+    # 자재 입고 이력 및 레시피(BOM) 조회용
+    safe_create_index(c, 'ix_material_receipts_material_date', 'material_receipts', 'material_id, receipt_date')
+    safe_create_index(c, 'ix_material_receipts_date', 'material_receipts', 'receipt_date')
+    safe_create_index(c, 'ix_product_materials_product', 'product_materials', 'product_id')
+    safe_create_index(c, 'ix_product_materials_material', 'product_materials', 'material_id')
+    safe_create_index(c, 'ix_material_recipes_prep', 'material_recipes', 'prep_material_id')
+    safe_create_index(c, 'ix_material_recipes_ingredient', 'material_recipes', 'ingredient_material_id')
+
+    # 이카운트 동기화 로그 최신순 조회용
+    safe_create_index(c, 'ix_ecount_sync_logs_created', 'ecount_sync_logs', 'created_at')
+    safe_create_index(c, 'ix_ecount_sync_logs_type_created', 'ecount_sync_logs', 'sync_type, created_at')
+
+
+def _migrate_material_price_totals(c):
+    # 자재별 입고 누계 (가중평균 단가 = total_amount / total_quantity), 입고 등록/수정/삭제 시 증감분만 반영
+    c.execute('''CREATE TABLE IF NOT EXISTS material_price_totals
+                 (material_id INTEGER PRIMARY KEY,
+                  total_quantity REAL NOT NULL DEFAULT 0,
+                  total_amount REAL NOT NULL DEFAULT 0,
+                  receipt_count INTEGER NOT NULL DEFAULT 0)''')
+    c.execute('''INSERT INTO material_price_totals (material_id, total_quantity, total_amount, receipt_count)
+                 SELECT material_id, SUM(quantity), SUM(quantity * unit_price), COUNT(*)
+                 FROM material_receipts
+                 GROUP BY material_id
+                 ON CONFLICT (material_id) DO NOTHING''')
+
+
+def _migrate_receipt_lots(c):
+    # 입고 기록별 남은 수량 (선입선출 로트), 기존 입고는 모두 미사용 상태로 시작
+    safe_add_column(c, 'material_receipts', 'remaining_quantity', 'REAL')
+    c.execute('UPDATE material_receipts SET remaining_quantity = quantity WHERE remaining_quantity IS NULL')
+    # 자재별로 남아 있는 로트를 오래된 순으로 찾기 위한 부분 인덱스
+    safe_create_index(c, 'ix_material_receipts_open_lots', 'material_receipts',
+                      'material_id, receipt_date, id', where='remaining_quantity > 0')
+
+
+def _migrate_product_cost_history(c):
+    # 제품 가격/원가 변경 이력 (기록 날짜 기준 가장 최근 적용일의 값을 통계에 사용)
+    # recorded_on: 이력을 남긴 날짜 (같은 날 다시 바뀌면 새 행 대신 그 행을 고침)
+    c.execute(f'''CREATE TABLE IF NOT EXISTS product_cost_history
+                 (id {AUTO_ID},
+                  product_id INTEGER NOT NULL,
+                  effective_date DATE NOT NULL,
+                  price REAL DEFAULT 0,
+                  cost REAL DEFAULT 0,
+                  recorded_on DATE,
+                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    safe_create_index(c, 'ux_product_cost_history_product_date', 'product_cost_history',
+                      'product_id, effective_date', unique=True)
+    c.execute(f'''INSERT INTO product_cost_history (product_id, effective_date, price, cost)
+                  SELECT id, {DATE_PARAM}, price, cost FROM products p
+                  WHERE NOT EXISTS (SELECT 1 FROM product_cost_history h WHERE h.product_id = p.id)''',
+              (HISTORY_START_DATE,))
+
+
+def _migrate_product_cost_breakdown(c):
+    # 제품 1개당 원재료별 원가 구성 (프랩 자재는 원재료까지 펼침), 레시피/단가 변경 시 원가 재계산과 함께 갱신
+    c.execute('''CREATE TABLE IF NOT EXISTS product_cost_breakdown
+                 (product_id INTEGER NOT NULL,
+                  material_id INTEGER NOT NULL,
+                  quantity REAL NOT NULL,
+                  unit_price REAL NOT NULL,
+                  cost REAL NOT NULL,
+                  cost_share REAL NOT NULL,
+                  PRIMARY KEY (product_id, material_id))''')
+
+    # 백필: 제품 레시피를 프랩 자재 레시피를 따라 원재료까지 펼침 (프랩 1단위 = 재료 양 / 프랩 중량),
+    # 원재료 단가는 cost_graph.unit_price와 같은 규칙 (price_per_unit, 없으면 price_per_gram, 둘 다 없으면 0)
+    c.execute('''INSERT INTO product_cost_breakdown (product_id, material_id, quantity, unit_price, cost, cost_share)
+                 WITH RECURSIVE expanded (product_id, material_id, quantity, depth) AS (
+                     SELECT pm.product_id, pm.material_id, pm.quantity, 0
+                     FROM product_materials pm
+                     JOIN products p ON p.id = pm.product_id
+                     UNION ALL
+                     SELECT e.product_id, mr.ingredient_material_id, e.quantity * mr.quantity / m.weight, e.depth + 1
+                     FROM expanded e
+                     JOIN materials m ON m.id = e.material_id AND m.type = '프랩' AND m.weight > 0
+                     JOIN material_recipes mr ON mr.prep_material_id = m.id
+                     WHERE e.depth < 32
+                 ),
+                 raw_usage (product_id, material_id, quantity, unit_price) AS (
+                     SELECT e.product_id, e.material_id, SUM(e.quantity),
+                            COALESCE(m.price_per_unit, m.price_per_gram, 0)
+                     FROM expanded e
+                     JOIN materials m ON m.id = e.material_id AND COALESCE(m.type, '') != '프랩'
+                     GROUP BY e.product_id, e.material_id, m.price_per_unit, m.price_per_gram
+                 ),
+                 totals (product_id, total_cost) AS (
+                     SELECT product_id, SUM(quantity * unit_price) FROM raw_usage GROUP BY product_id
+                 )
+                 SELECT u.product_id, u.material_id, u.quantity, u.unit_price, u.quantity * u.unit_price,
+                        CASE WHEN t.total_cost <> 0 THEN u.quantity * u.unit_price / t.total_cost * 100 ELSE 0 END
+                 FROM raw_usage u
+                 JOIN totals t ON t.product_id = u.product_id''')
+
+
+def _migrate_daily_product_facts(c):
+    # 제품 × 날짜 일별 집계 (facts.py), 기록 저장 시 바뀐 날짜만 갱신
+    c.execute('''CREATE TABLE IF NOT EXISTS daily_product_facts
+                 (product_id INTEGER NOT NULL,
+                  fact_date DATE NOT NULL,
+                  opening_inventory REAL DEFAULT 0,
+                  production REAL DEFAULT 0,
+                  closing_inventory REAL DEFAULT 0,
+                  donation REAL DEFAULT 0,
+                  sales REAL,
+                  recorded_quantity REAL,
+                  price REAL DEFAULT 0,
+                  unit_cost REAL DEFAULT 0,
+                  revenue REAL DEFAULT 0,
+                  cost REAL DEFAULT 0,
+                  PRIMARY KEY (product_id, fact_date))''')
+    safe_create_index(c, 'ix_daily_product_facts_date', 'daily_product_facts', 'fact_date')
+
+    # 백필: 원본 기록이 있는 제품 × 날짜 (재고는 다음 날 기초재고이므로 다음 날도 포함),
+    # 가격/원가는 그 날짜에 적용되던 이력 (없으면 현재 값)
+    c.execute(f'''INSERT INTO daily_product_facts
+                  (product_id, fact_date, opening_inventory, production, closing_inventory, donation, sales,
+                   recorded_quantity, price, unit_cost, revenue, cost)
+                  WITH fact_keys (product_id, fact_date) AS (
+                      SELECT product_id, production_date FROM production_records
+                      UNION SELECT product_id, record_date FROM irregular_product_records
+                      UNION SELECT product_id, inventory_date FROM inventory_records
+                      UNION SELECT product_id, {_day_offset_sql('inventory_date', 1)} FROM inventory_records
+                  ),
+                  base AS (
+                      SELECT k.product_id, k.fact_date, p.category, p.stock_type, pr.quantity AS recorded,
+                             COALESCE(prev_inv.quantity, 0) AS prev_closing, COALESCE(inv.quantity, 0) AS closing,
+                             ir.id AS irregular_id,
+                             COALESCE(ir.opening_inventory, 0) AS ir_opening, COALESCE(ir.production, 0) AS ir_production,
+                             COALESCE(ir.donation, 0) AS ir_donation, COALESCE(ir.closing_inventory, 0) AS ir_closing,
+                             COALESCE(CASE WHEN h.product_id IS NULL THEN p.price ELSE h.price END, 0) AS price,
+                             COALESCE(CASE WHEN h.product_id IS NULL THEN p.cost ELSE h.cost END, 0) AS unit_cost
+                      FROM fact_keys k
+                      JOIN products p ON p.id = k.product_id
+                      LEFT JOIN production_records pr
+                          ON pr.product_id = k.product_id AND pr.production_date = k.fact_date
+                      LEFT JOIN inventory_records prev_inv
+                          ON prev_inv.product_id = k.product_id
+                         AND prev_inv.inventory_date = {_day_offset_sql('k.fact_date', -1)}
+                      LEFT JOIN inventory_records inv
+                          ON inv.product_id = k.product_id AND inv.inventory_date = k.fact_date
+                      LEFT JOIN irregular_product_records ir
+                          ON ir.product_id = k.product_id AND ir.record_date = k.fact_date
+                      LEFT JOIN product_cost_history h
+                          ON h.product_id = k.product_id
+                         AND h.effective_date = (SELECT MAX(effective_date) FROM product_cost_history
+                                                 WHERE product_id = k.product_id AND effective_date <= k.fact_date)
+                  )
+                  SELECT product_id, fact_date,
+                         CASE WHEN category = '비정기 제품' THEN ir_opening ELSE prev_closing END,
+                         CASE WHEN category = '비정기 제품' THEN ir_production ELSE COALESCE(recorded, 0) END,
+                         CASE WHEN category = '비정기 제품' THEN ir_closing ELSE closing END,
+                         CASE WHEN category = '비정기 제품' THEN ir_donation
+                              WHEN stock_type = '일반' THEN closing ELSE 0 END,
+                         CASE WHEN category != '비정기 제품' OR category IS NULL
+                                  THEN prev_closing + COALESCE(recorded, 0) - closing
+                              WHEN irregular_id IS NOT NULL
+                                  THEN ir_opening + ir_production - ir_donation - ir_closing END,
+                         recorded, price, unit_cost, COALESCE(recorded, 0) * price, COALESCE(recorded, 0) * unit_cost
+                  FROM base''')
+
+
+def _migrate_data_versions(c):
+    # 데이터 종류(테이블)별 변경 버전 (응답 캐시/ETag 무효화용)
+    c.execute('''CREATE TABLE IF NOT EXISTS data_versions
+                 (name TEXT PRIMARY KEY,
+                  version INTEGER NOT NULL DEFAULT 0)''')
+
+
+def _migrate_monthly_product_facts(c):
+    # 제품 × 월 통계 집계 (facts.py), 일별 집계를 갱신할 때 해당 월도 함께 갱신
+    c.execute('''CREATE TABLE IF NOT EXISTS monthly_product_facts
+                 (product_id INTEGER NOT NULL,
+                  month_start DATE NOT NULL,
+                  quantity REAL DEFAULT 0,
+                  record_count INTEGER DEFAULT 0,
+                  revenue REAL DEFAULT 0,
+                  cost REAL DEFAULT 0,
+                  PRIMARY KEY (product_id, month_start))''')
+    safe_create_index(c, 'ix_monthly_product_facts_month', 'monthly_product_facts', 'month_start')
+
+    # 백필: 생산 기록이 있는 날의 일별 집계를 제품 × 월로 합산
+    month_start = _month_start_sql('fact_date')
+    c.execute(f'''INSERT INTO monthly_product_facts (product_id, month_start, quantity, record_count, revenue, cost)
+                  SELECT product_id, {month_start}, SUM(recorded_quantity), COUNT(*),
+                         SUM(COALESCE(revenue, 0)), SUM(COALESCE(cost, 0))
+                  FROM daily_product_facts
+                  WHERE recorded_quantity IS NOT NULL
+                  GROUP BY product_id, {month_start}''')
+
+
+def _migrate_production_entry_counts(c):
+    # 생산 기록 행별 입력 건수 (같은 날 추가 입력은 한 행에 합쳐지므로 통계의 기록 수는 이 값의 합)
+    # 2번 마이그레이션을 이 컬럼이 생기기 전에 적용한 DB는 행마다 1건으로 시작
+    safe_add_column(c, 'production_records', 'entry_count', 'INTEGER DEFAULT 1')
+    safe_add_column(c, 'daily_product_facts', 'record_count', 'INTEGER')
+
+    # 백필: 일별 집계는 그날 생산 기록의 입력 건수, 월별 집계는 그 달 일별 입력 건수의 합
+    c.execute('''UPDATE daily_product_facts
+                 SET record_count = (SELECT pr.entry_count FROM production_records pr
+                                     WHERE pr.product_id = daily_product_facts.product_id
+                                       AND pr.production_date = daily_product_facts.fact_date)
+                 WHERE recorded_quantity IS NOT NULL''')
+    month_start = _month_start_sql('f.fact_date')
+    c.execute(f'''UPDATE monthly_product_facts
+                  SET record_count = COALESCE((SELECT SUM(f.record_count) FROM daily_product_facts f
+                                               WHERE f.product_id = monthly_product_facts.product_id
+                                                 AND f.recorded_quantity IS NOT NULL
+                                                 AND {month_start} = monthly_product_facts.month_start), 0)''')
+
+
+# (버전, 설명, 적용 함수) - 새 마이그레이션은 항상 끝에 추가
+MIGRATIONS = [
+    (1, '기본 테이블', _migrate_base_tables),
+    (2, '기록 테이블 인덱스 및 유니크 키', _migrate_record_indexes),
+    (3, '자재 입고 누계 (가중평균 단가)', _migrate_material_price_totals),
+    (4, '자재 입고 로트 남은 수량 (선입선출)', _migrate_receipt_lots),
+    (5, '제품 가격/원가 이력', _migrate_product_cost_history),
+    (6, '제품 원가 구성 캐시', _migrate_product_cost_breakdown),
+    (7, '제품 일별 집계', _migrate_daily_product_facts),
+    (8, '데이터 변경 버전', _migrate_data_versions),
+    (9, '제품 월별 통계 집계', _migrate_monthly_product_facts),
+    (10, '생산 기록 입력 건수', _migrate_production_entry_counts),
+]
+
+LATEST_SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn):
+    try:
+        row = conn.execute('SELECT MAX(version) AS version FROM schema_version').fetchone()
+        return row['version'] or 0
+    except Exception:
+        # schema_version 테이블이 아직 없음
+        conn.rollback()
+        return 0
+
+
+def init_db():
+    conn = get_db()
+    try:
+        # 스키마가 최신이면 버전 조회 한 번으로 끝
+        if get_schema_version(conn) >= LATEST_SCHEMA_VERSION:
+            return
+
+        c = conn.cursor()
+        if DATABASE_URL:
+            c.execute('SELECT pg_advisory_xact_lock(?)', (SCHEMA_LOCK_ID,))
+        else:
+            c.execute('BEGIN IMMEDIATE')
+
+        c.execute('''CREATE TABLE IF NOT EXISTS schema_version
+                     (version INTEGER PRIMARY KEY,
+                      description TEXT,
+                      applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+
+        # 잠금을 기다리는 동안 다른 워커가 적용했을 수 있으므로 다시 확인
+        current = get_schema_version(conn)
+        for version, description, migrate in MIGRATIONS:
+            if version > current:
+                migrate(c)
+                c.execute('INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                          (version, description))
+        conn.commit()
+    finally:
+        conn.close()
@@ -0,0 +1,291 @@
+"""제품 × 날짜 일별 집계 (daily_product_facts).
+
+생산/재고/비정기 제품 기록을 제품별 하루 한 행으로 모아 두고, 통계/대시보드/판매·기부 그리드는
+이 표만 읽습니다. 기록을 저장하는 라우트는 바뀐 제품과 날짜만 refresh_facts로 다시 계산합니다.
+
+- 정기 제품: 기초재고 = 전날 재고, 생산 = 생산 기록, 기말재고 = 당일 재고,
+  기부 = 재고 방식이 '일반'이면 당일 재고, 판매 = 기초재고 + 생산 - 기말재고
+- 비정기 제품: 비정기 기록 값, 판매 = 기초재고 + 생산 - 기부 - 기말재고 (기록이 없으면 NULL)
+- recorded_quantity: 생산 기록 수량 (없으면 NULL), record_count: 그 기록에 합쳐진 입력 건수,
+  revenue/cost: 이 수량에 그 날짜에 적용되던 가격/원가(product_cost_history)를 곱한 값 (통계의 매출/원가 기준)
+
+monthly_product_facts는 생산 기록이 있는 날의 수량/기록 수/매출/원가를 제품 × 월로 미리 합친 표로,
+일별 집계를 다시 만들 때 해당 월도 함께 갱신합니다. 월/연 단위 통계는 기간에 온전히 포함되는 달을
+이 표에서, 앞뒤로 걸친 부분만 일별 집계에서 읽습니다.
+"""
+import bisect
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from db import delete_rows, execute_many
+
+IRREGULAR_CATEGORY = '비정기 제품'
+
+# 전체 재계산 시 한 번에 처리하는 기간 (일)
+REBUILD_CHUNK_DAYS = 92
+
+# 통계 구간 단위: 일, 주(일요일 시작), ISO 주(월요일 시작), 월, 연
+GRANULARITIES = ('day', 'week', 'isoweek', 'month', 'year')
+
+
+def _day(value):
+    return str(value)[:10]
+
+
+def _shift(day, days):
+    return (datetime.strptime(day, '%Y-%m-%d') + timedelta(days=days)).strftime('%Y-%m-%d')
+
+
+def _month_start(day):
+    return day[:8] + '01'
+
+
+def _next_month(day):
+    year, month = int(day[:4]), int(day[5:7])
+    return f'{year + month // 12:04d}-{month % 12 + 1:02d}-01'
+
+
+def _month_end(day):
+    return _shift(_next_month(day), -1)
+
+
+def _id_filter(column, product_ids):
+    if product_ids is None:
+        return '', []
+    return f' AND {column} IN ({", ".join(["?"] * len(product_ids))})', list(product_ids)
+
+
+def _price_at(history, day, product):
+    # 해당 날짜에 적용되던 (가격, 원가), 이력이 없으면 현재 값
+    dates, values = history.get(product['id'], ((), ()))
+    i = bisect.bisect_right(dates, day) - 1
+    price, cost = values[i] if i >= 0 else (product['price'], product['cost'])
+    return price or 0, cost or 0
+
+
+def refresh_facts(c, start_date, end_date, product_ids=None):
+    """[start_date, end_date] 기간의 일별 집계와 그 기간이 걸친 달의 월별 집계를 다시 만듭니다 (커밋은 호출한 쪽에서)."""
+    start_date, end_date = _day(start_date), _day(end_date)
+    if product_ids is not None:
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+
+    id_sql, id_params = _id_filter('id', product_ids)
+    products = {r['id']: r for r in c.execute(
+        f'SELECT id, category, stock_type, price, cost FROM products WHERE 1=1{id_sql}', id_params).fetchall()}
+
+    id_sql, id_params = _id_filter('product_id', product_ids)
+    production = {(r['product_id'], _day(r['production_date'])): (r['quantity'], r['entry_count']) for r in c.execute(
+        f'''SELECT product_id, production_date, quantity, entry_count FROM production_records
+            WHERE production_date >= ? AND production_date <= ?{id_sql}''',
+        [start_date, end_date] + id_params).fetchall()}
+    inventory = {(r['product_id'], _day(r['inventory_date'])): r['quantity'] or 0 for r in c.execute(
+        f'''SELECT product_id, inventory_date, quantity FROM inventory_records
+            WHERE inventory_date >= ? AND inventory_date <= ?{id_sql}''',
+        [_shift(start_date, -1), end_date] + id_params).fetchall()}
+    irregular = {(r['product_id'], _day(r['record_date'])): r for r in c.execute(
+        f'''SELECT product_id, record_date, opening_inventory, production, donation, closing_inventory
+            FROM irregular_product_records
+            WHERE record_date >= ? AND record_date <= ?{id_sql}''',
+        [start_date, end_date] + id_params).fetchall()}
+
+    history = defaultdict(lambda: ([], []))
+    for r in c.execute(f'''SELECT product_id, effective_date, price, cost FROM product_cost_history
+                           WHERE effective_date <= ?{id_sql}
+                           ORDER BY product_id, effective_date''', [end_date] + id_params).fetchall():
+        dates, values = history[r['product_id']]
+        dates.append(_day(r['effective_date']))
+        values.append((r['price'], r['cost']))
+
+    # 전날 재고가 있으면 당일 기초재고가 생기므로 다음 날도 집계 대상
+    keys = set(production) | set(irregular)
+    for product_id, day in inventory:
+        if day >= start_date:
+            keys.add((product_id, day))
+        if _shift(day, 1) <= end_date:
+            keys.add((product_id, _shift(day, 1)))
+
+    rows = []
+    for product_id, day in sorted(keys):
+        product = products.get(product_id)
+        if product is None:
+            continue
+        price, unit_cost = _price_at(history, day, product)
+        recorded, entries = production.get((product_id, day), (None, None))
+
+        if product['category'] == IRREGULAR_CATEGORY:
+            record = irregular.get((product_id, day))
+            opening, produced, donation, closing = (
+                (record['opening_inventory'] or 0, record['production'] or 0,
+                 record['donation'] or 0, record['closing_inventory'] or 0) if record else (0, 0, 0, 0))
+            sales = opening + produced - donation - closing if record else None
+        else:
+            opening = inventory.get((product_id, _shift(day, -1)), 0)
+            produced = recorded or 0
+            closing = inventory.get((product_id, day), 0)
+            donation = closing if product['stock_type'] == '일반' else 0
+            sales = opening + produced - closing
+
+        quantity = recorded or 0
+        rows.append((product_id, day, opening, produced, closing, donation, sales,
+                     recorded, entries, price, unit_cost, quantity * price, quantity * unit_cost))
+
+    if product_ids is None:
+        c.execute('DELETE FROM daily_product_facts WHERE fact_date >= ? AND fact_date <= ?', [start_date, end_date])
+    else:
+        delete_rows(c, 'daily_product_facts', 'product_id', product_ids,
+                    'fact_date >= ? AND fact_date <= ?', [start_date, end_date])
+    execute_many(c, '''INSERT INTO daily_product_facts
+                       (product_id, fact_date, opening_inventory, production, closing_inventory, donation, sales,
+                        recorded_quantity, record_count, price, unit_cost, revenue, cost)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+    refresh_monthly_facts(c, start_date, end_date, product_ids)
+
+
+def refresh_monthly_facts(c, start_date, end_date, product_ids=None):
+    """start_date~end_date가 걸친 달의 월별 집계를 일별 집계로 다시 만듭니다 (커밋은 호출한 쪽에서)."""
+    first_day, last_day = _month_start(_day(start_date)), _month_end(_day(end_date))
+    if product_ids is not None:
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+
+    id_sql, id_params = _id_filter('product_id', product_ids)
+    buckets = defaultdict(lambda: [0, 0, 0, 0])
+    for r in c.execute(f'''SELECT product_id, fact_date, recorded_quantity, record_count, revenue, cost
+                           FROM daily_product_facts
+                           WHERE recorded_quantity IS NOT NULL AND fact_date >= ? AND fact_date <= ?{id_sql}''',
+                       [first_day, last_day] + id_params).fetchall():
+        bucket = buckets[(r['product_id'], _month_start(_day(r['fact_date'])))]
+        bucket[0] += r['recorded_quantity']
+        bucket[1] += r['record_count'] or 0
+        bucket[2] += r['revenue'] or 0
+        bucket[3] += r['cost'] or 0
+
+    if product_ids is None:
+        c.execute('DELETE FROM monthly_product_facts WHERE month_start >= ? AND month_start <= ?',
+                  [first_day, last_day])
+    else:
+        delete_rows(c, 'monthly_product_facts', 'product_id', product_ids,
+                    'month_start >= ? AND month_start <= ?', [first_day, last_day])
+    execute_many(c, '''INSERT INTO monthly_product_facts
+                       (product_id, month_start, quantity, record_count, revenue, cost)
+                       VALUES (?, ?, ?, ?, ?, ?)''',
+                 [(product_id, month, *values) for (product_id, month), values in sorted(buckets.items())])
+
+
+def period_of(day, granularity):
+    """날짜(YYYY-MM-DD)가 속한 통계 구간의 (라벨, 시작일)."""
+    if granularity == 'day':
+        return day, day
+    if granularity == 'month':
+        return day[:7], _month_start(day)
+    if granularity == 'year':
+        return day[:4], day[:4] + '-01-01'
+    d = datetime.strptime(day, '%Y-%m-%d')
+    if granularity == 'isoweek':
+        year, week, weekday = d.isocalendar()
+        return f'{year}-W{week:02d}', (d - timedelta(days=weekday - 1)).strftime('%Y-%m-%d')
+    start = (d - timedelta(days=(d.weekday() + 1) % 7)).strftime('%Y-%m-%d')
+    return start, start
+
+
+def bucketed_facts(c, start_date, end_date, granularity):
+    """생산 기록 기준 {(구간 라벨, 구간 시작일, 제품 ID): [수량, 기록 수, 매출, 원가]} (날짜는 생략 가능).
+
+    월/연 단위는 기간에 온전히 포함되는 달을 월별 집계에서 읽고 나머지 날만 일별 집계에서 읽습니다.
+    """
+    start_date = _day(start_date) if start_date else None
+    end_date = _day(end_date) if end_date else None
+    buckets = defaultdict(lambda: [0, 0, 0, 0])
+    daily_ranges = [(start_date, end_date)]
+
+    if granularity in ('month', 'year'):
+        month_from, month_to = start_date, end_date
+        if start_date and start_date != _month_start(start_date):
+            month_from = _next_month(start_date)
+        if end_date and end_date != _month_end(end_date):
+            month_to = _shift(_month_start(end_date), -1)
+        if month_from is None or month_to is None or month_from <= month_to:
+            query = '''SELECT product_id, month_start, quantity, record_count, revenue, cost
+                       FROM monthly_product_facts WHERE 1=1'''
+            params = []
+            if month_from:
+                query += ' AND month_start >= ?'
+                params.append(month_from)
+            if month_to:
+                query += ' AND month_start <= ?'
+                params.append(month_to)
+            for r in c.execute(query, params).fetchall():
+                bucket = buckets[(*period_of(_day(r['month_start']), granularity), r['product_id'])]
+                bucket[0] += r['quantity'] or 0
+                bucket[1] += r['record_count'] or 0
+                bucket[2] += r['revenue'] or 0
+                bucket[3] += r['cost'] or 0
+            daily_ranges = []
+            if start_date and start_date < month_from:
+                daily_ranges.append((start_date, _shift(month_from, -1)))
+            if end_date and month_to < end_date:
+                daily_ranges.append((_shift(month_to, 1), end_date))
+
+    for first_day, last_day in daily_ranges:
+        query, params = '''SELECT product_id, fact_date, recorded_quantity, record_count, revenue, cost
+                           FROM daily_product_facts
+                           WHERE recorded_quantity IS NOT NULL''', []
+        if first_day:
+            query += ' AND fact_date >= ?'
+            params.append(first_day)
+        if last_day:
+            query += ' AND fact_date <= ?'
+            params.append(last_day)
+        for r in c.execute(query, params).fetchall():
+            bucket = buckets[(*period_of(_day(r['fact_date']), granularity), r['product_id'])]
+            bucket[0] += r['recorded_quantity']
+            bucket[1] += r['record_count'] or 0
+            bucket[2] += r['revenue'] or 0
+            bucket[3] += r['cost'] or 0
+    return buckets
+
+
+def _record_date_range(c, product_ids=None):
+    # 원본 기록이 있는 전체 기간 (재고는 다음 날 기초재고까지)
+    id_sql, id_params = _id_filter('product_id', product_ids)
+    bounds = []
+    for table, column, extra_days in (('production_records', 'production_date', 0),
+                                      ('inventory_records', 'inventory_date', 1),
+                                      ('irregular_product_records', 'record_date', 0)):
+        r = c.execute(f'SELECT MIN({column}) as first_day, MAX({column}) as last_day FROM {table} WHERE 1=1{id_sql}',
+                      id_params).fetchone()
+        if r['first_day'] is not None:
+            bounds.append((_day(r['first_day']), _shift(_day(r['last_day']), extra_days)))
+    if not bounds:
+        return None, None
+    return min(b[0] for b in bounds), max(b[1] for b in bounds)
+
+
+def refresh_product_facts(c, product_ids, start_date=None):
+    """제품들의 start_date 이후(생략하면 전체 기간) 일별 집계를 다시 만듭니다 (커밋은 호출한 쪽에서)."""
+    product_ids = list(product_ids)
+    if not product_ids:
+        return
+    first_day, last_day = _record_date_range(c, product_ids)
+    if first_day is None:
+        return
+    start_date = max(first_day, _day(start_date)) if start_date else first_day
+    if start_date <= last_day:
+        refresh_facts(c, start_date, last_day, product_ids)
+
+
+def rebuild_facts(c):
+    """일별/월별 집계 전체를 원본 기록으로 다시 만듭니다 (커밋은 호출한 쪽에서)."""
+    c.execute('DELETE FROM daily_product_facts')
+    c.execute('DELETE FROM monthly_product_facts')
+    first_day, last_day = _record_date_range(c)
+    if first_day is None:
+        return
+    start_date = first_day
+    while start_date <= last_day:
+        end_date = min(_shift(start_date, REBUILD_CHUNK_DAYS - 1), last_day)
+        refresh_facts(c, start_date, end_date)
+        start_date = _shift(end_date, 1)
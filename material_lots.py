@@ -0,0 +1,156 @@
+"""자재 입고 로트 기반 선입선출(FIFO) 원가 계산.
+
+material_receipts의 각 행을 남은 수량(remaining_quantity)을 가진 로트로 보고, 생산량이 바뀌면
+BOM으로 펼친 원재료 소요량만큼 오래된 로트부터 차감합니다 (로트보다 많이 쓴 양은 가장 최근 로트의
+남은 수량을 음수로 남김). 입고가 등록/수정/삭제되면 그 자재의 로트를 전체 생산 기록으로 다시 나눕니다.
+MATERIAL_COSTING=fifo일 때 원자재 단위당 가격은 남아 있는 가장 오래된 로트의 단가를 사용합니다
+(기본값 average는 가중평균).
+"""
+import os
+from collections import defaultdict
+
+from cost_graph import CostGraph, recompute_costs
+from db import bump_data_version, execute_many
+
+MATERIAL_COSTING = os.environ.get('MATERIAL_COSTING', 'average')
+FIFO_ENABLED = MATERIAL_COSTING == 'fifo'
+
+
+def _draw_down(c, material_id, quantity):
+    # 오래된 로트부터 차감, 남은 로트보다 많이 쓴 양은 가장 최근 로트의 남은 수량을 음수로 남김
+    # (입고 기록이 하나도 없으면 남길 곳이 없으며, 첫 입고 때 reallocate_lots로 다시 나눔)
+    remaining = {}
+    for lot in c.execute('''SELECT id, remaining_quantity FROM material_receipts
+                            WHERE material_id = ? AND remaining_quantity > 0
+                            ORDER BY receipt_date, id''', (material_id,)).fetchall():
+        if quantity <= 0:
+            break
+        used = min(lot['remaining_quantity'], quantity)
+        remaining[lot['id']] = lot['remaining_quantity'] - used
+        quantity -= used
+    if quantity > 0:
+        newest = c.execute('''SELECT id, remaining_quantity FROM material_receipts
+                               WHERE material_id = ?
+                               ORDER BY receipt_date DESC, id DESC LIMIT 1''', (material_id,)).fetchone()
+        if newest is not None:
+            remaining[newest['id']] = remaining.get(newest['id'], newest['remaining_quantity']) - quantity
+    execute_many(c, 'UPDATE material_receipts SET remaining_quantity = ? WHERE id = ?',
+                 [(quantity, lot_id) for lot_id, quantity in remaining.items()])
+
+
+def _restore(c, material_id, quantity):
+    # 생산 취소분은 가장 최근에 차감된 로트부터 되돌림 (음수로 남은 부족분이 먼저 채워짐)
+    updates = []
+    for lot in c.execute('''SELECT id, quantity, remaining_quantity FROM material_receipts
+                            WHERE material_id = ? AND remaining_quantity < quantity
+                            ORDER BY receipt_date DESC, id DESC''', (material_id,)).fetchall():
+        if quantity <= 0:
+            break
+        returned = min(lot['quantity'] - lot['remaining_quantity'], quantity)
+        updates.append((lot['remaining_quantity'] + returned, lot['id']))
+        quantity -= returned
+    execute_many(c, 'UPDATE material_receipts SET remaining_quantity = ? WHERE id = ?', updates)
+
+
+def post_consumption(conn, product_quantities, graph=None):
+    """{제품 ID: 생산량 증감}을 로트에 반영하고 소요량이 바뀐 원재료 ID 목록을 반환합니다."""
+    product_quantities = {pid: quantity for pid, quantity in product_quantities.items() if quantity}
+    if not product_quantities:
+        return []
+
+    graph = graph or CostGraph.load(conn)
+    usage = graph.raw_usage(product_quantities)
+    c = conn.cursor()
+    for material_id, quantity in usage.items():
+        if quantity > 0:
+            _draw_down(c, material_id, quantity)
+        elif quantity < 0:
+            _restore(c, material_id, -quantity)
+    return [mid for mid, quantity in usage.items() if quantity]
+
+
+def refresh_lot_prices(c, material_ids, graph=None):
+    """FIFO 모드에서 원자재 단위당 가격을 가장 오래된 잔여 로트 단가로 맞춥니다 (다 쓰면 최근 입고 단가).
+
+    graph를 넘기면 읽어 둔 원가 그래프의 단가도 같이 맞춥니다.
+    """
+    if not FIFO_ENABLED:
+        return
+    updates = []
+    for material_id in material_ids:
+        lot = c.execute('''SELECT unit_price FROM material_receipts
+                           WHERE material_id = ? AND remaining_quantity > 0
+                           ORDER BY receipt_date, id LIMIT 1''', (material_id,)).fetchone()
+        if lot is None:
+            lot = c.execute('''SELECT unit_price FROM material_receipts
+                               WHERE material_id = ?
+                               ORDER BY receipt_date DESC, id DESC LIMIT 1''', (material_id,)).fetchone()
+        if lot is not None:
+            updates.append((lot['unit_price'], material_id))
+    execute_many(c, "UPDATE materials SET price_per_unit = ?, price_per_gram = ? WHERE id = ? AND type != '프랩'",
+                 [(price, price, material_id) for price, material_id in updates])
+    if graph is not None:
+        for price, material_id in updates:
+            material = graph.materials.get(material_id)
+            if material and material['type'] != '프랩':
+                material.update(price_per_unit=price, price_per_gram=price)
+
+
+def apply_production_change(conn, product_quantities):
+    """FIFO 모드에서 생산량 증감을 로트에 반영하고 단가/원가를 갱신합니다 (커밋은 호출한 쪽에서)."""
+    if not FIFO_ENABLED or not any(product_quantities.values()):
+        return
+    graph = CostGraph.load(conn)
+    material_ids = post_consumption(conn, product_quantities, graph)
+    if material_ids:
+        refresh_lot_prices(conn.cursor(), material_ids, graph)
+        recompute_costs(conn, material_ids=material_ids, graph=graph)
+        bump_data_version(conn, 'materials')
+
+
+def _allocate(conn, graph, material_ids=None):
+    # 로트를 모두 미사용으로 되돌린 뒤 전체 생산 기록의 소요량을 오래된 로트부터 차감
+    # (material_ids를 넘기면 그 자재만, 정기 제품 생산 기록과 비정기 제품 생산량 모두 소비로 반영)
+    c = conn.cursor()
+    if material_ids is None:
+        c.execute('UPDATE material_receipts SET remaining_quantity = quantity')
+        material_ids = [r['material_id'] for r in c.execute(
+            'SELECT DISTINCT material_id FROM material_receipts').fetchall()]
+    else:
+        c.execute(f'''UPDATE material_receipts SET remaining_quantity = quantity
+                      WHERE material_id IN ({', '.join(['?'] * len(material_ids))})''', material_ids)
+    totals = defaultdict(float)
+    for r in c.execute('''SELECT product_id, SUM(quantity) as quantity FROM production_records GROUP BY product_id
+                          UNION ALL
+                          SELECT product_id, SUM(production) as quantity FROM irregular_product_records
+                          GROUP BY product_id''').fetchall():
+        totals[r['product_id']] += r['quantity'] or 0
+    usage = graph.raw_usage(totals)
+    for material_id in material_ids:
+        if usage.get(material_id, 0) > 0:
+            _draw_down(c, material_id, usage[material_id])
+    return material_ids
+
+
+def reallocate_lots(conn, material_ids, graph=None):
+    """FIFO 모드에서 입고가 등록/수정/삭제된 자재의 로트 잔량을 다시 나누고 단가를 맞춥니다.
+
+    이미 일부 소진된 입고를 고치거나 지워도 소비량이 사라지거나 다른 로트에 잘못 돌아가지 않도록
+    전체 생산 기록으로 다시 차감합니다. 원가 재계산과 커밋은 호출한 쪽에서 합니다.
+    """
+    material_ids = list(material_ids)
+    if not FIFO_ENABLED or not material_ids:
+        return
+    graph = graph or CostGraph.load(conn)
+    _allocate(conn, graph, material_ids)
+    refresh_lot_prices(conn.cursor(), material_ids, graph)
+
+
+def rebuild_lots(conn):
+    """전체 입고/생산 기록으로 로트 잔량을 다시 계산합니다 (FIFO 모드 전환 시, 커밋은 호출한 쪽에서)."""
+    graph = CostGraph.load(conn)
+    material_ids = _allocate(conn, graph)
+    refresh_lot_prices(conn.cursor(), material_ids, graph)
+    if FIFO_ENABLED and material_ids:
+        recompute_costs(conn, material_ids=material_ids, graph=graph)
+    bump_data_version(conn, 'materials')
@@ -0,0 +1,63 @@
+"""테스트마다 빈 SQLite DB 파일로 앱을 실행합니다."""
+import os
+import sys
+import tempfile
+
+# app을 import하면 init_db()가 바로 실행되므로 그 전에 임시 DB 경로와 풀 비활성화를 설정
+os.environ['DB_POOL'] = '0'
+os.environ['SQLITE_PATH'] = os.path.join(tempfile.mkdtemp(), 'production.db')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import app as app_module
+import db
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    path = str(tmp_path / 'production.db')
+    monkeypatch.setattr(db, 'SQLITE_PATH', path)
+    return path
+
+
+@pytest.fixture
+def client(db_path):
+    db.init_db()
+    app_module._dashboard_cache.clear()
+    return app_module.app.test_client()
+
+
+def call(client, method, url, **kwargs):
+    response = getattr(client, method)(url, **kwargs)
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return response.get_json()
+
+
+@pytest.fixture
+def bakery(client):
+    """원재료 2개, 프랩 속 프랩을 포함한 프랩 2개, 제품 3개 (비정기 제품 1개)."""
+    ids = {}
+    for name, weight, price in (('밀가루', 1000, 2000), ('버터', 1000, 10000)):
+        ids[name] = call(client, 'post', '/api/materials',
+                         json={'name': name, 'weight': weight, 'purchase_price': price})['id']
+    ids['반죽'] = call(client, 'post', '/api/materials', json={'name': '반죽', 'type': '프랩', 'weight': 500})['id']
+    call(client, 'post', f"/api/materials/{ids['반죽']}/recipe", json={'material_id': ids['밀가루'], 'quantity': 400})
+    call(client, 'post', f"/api/materials/{ids['반죽']}/recipe", json={'material_id': ids['버터'], 'quantity': 100})
+    ids['크림반죽'] = call(client, 'post', '/api/materials', json={'name': '크림반죽', 'type': '프랩', 'weight': 100})['id']
+    call(client, 'post', f"/api/materials/{ids['크림반죽']}/recipe", json={'material_id': ids['반죽'], 'quantity': 100})
+    call(client, 'post', f"/api/materials/{ids['크림반죽']}/recipe", json={'material_id': ids['밀가루'], 'quantity': 10})
+
+    for name, category, price, recipe in (('식빵', '빵', 3000, [('크림반죽', 50)]),
+                                          ('버터롤', '빵', 2000, [('반죽', 30), ('버터', 5)]),
+                                          ('케이크', '비정기 제품', 20000, [('버터', 10)])):
+        ids[name] = call(client, 'post', '/api/products',
+                         json={'name': name, 'unit': '개', 'price': price, 'category': category})['id']
+        for material, quantity in recipe:
+            call(client, 'post', f'/api/products/{ids[name]}/recipe',
+                 json={'material_id': ids[material], 'quantity': quantity})
+    return ids
+
+
+def table_rows(conn, table, order_by):
+    return [tuple(r) for r in conn.execute(f'SELECT * FROM {table} ORDER BY {order_by}').fetchall()]
@@ -0,0 +1,76 @@
+"""조건부 GET (ETag/If-None-Match) 테스트."""
+import pytest
+
+from conftest import call
+
+
+def fetch(client, url, etag=None, **kwargs):
+    headers = {'If-None-Match': etag} if etag else {}
+    return client.get(url, headers=headers, **kwargs)
+
+
+def assert_not_modified(client, url, **kwargs):
+    response = fetch(client, url, **kwargs)
+    assert response.status_code == 200
+    etag = response.headers['ETag'].strip('"')
+    assert response.headers['Cache-Control'] == 'no-cache'
+
+    again = fetch(client, url, etag, **kwargs)
+    assert again.status_code == 304
+    assert again.get_data() == b''
+    assert again.headers['ETag'].strip('"') == etag
+    return etag
+
+
+@pytest.mark.parametrize('url', ['/api/products', '/api/materials', '/api/target-production',
+                                 '/api/production/grid?date=2026-01-05', '/api/inventory/grid?date=2026-01-05',
+                                 '/api/irregular-product/grid?date=2026-01-05', '/api/sales/grid?date=2026-01-05',
+                                 '/api/donation/grid?date=2026-01-05'])
+def test_matching_etag_returns_304(client, bakery, url):
+    assert_not_modified(client, url)
+
+
+def test_products_etag_changes_after_write(client, bakery):
+    etag = assert_not_modified(client, '/api/products')
+    call(client, 'put', f"/api/products/{bakery['식빵']}",
+         json={'name': '우유식빵', 'unit': '개', 'price': 3500, 'category': '빵'})
+
+    response = fetch(client, '/api/products', etag)
+    assert response.status_code == 200
+    assert response.headers['ETag'].strip('"') != etag
+    assert '우유식빵' in [p['name'] for p in response.get_json()]
+
+
+def test_materials_etag_changes_after_receipt(client, bakery):
+    etag = assert_not_modified(client, '/api/materials')
+    call(client, 'post', '/api/material-receipts',
+         json={'material_id': bakery['버터'], 'receipt_date': '2026-01-02', 'quantity': 1000, 'unit_price': 12})
+
+    response = fetch(client, '/api/materials', etag)
+    assert response.status_code == 200
+    assert response.headers['ETag'].strip('"') != etag
+
+
+def test_grid_etag_follows_its_own_tables(client, bakery):
+    url = '/api/production/grid?date=2026-01-05'
+    etag = assert_not_modified(client, url)
+    assert assert_not_modified(client, '/api/production/grid?date=2026-01-06') != etag
+
+    # 다른 테이블 변경은 생산 그리드 ETag에 영향 없음
+    call(client, 'post', '/api/inventory/bulk',
+         json={'date': '2026-01-05', 'products': [{'product_id': bakery['식빵'], 'quantity': 3}]})
+    assert fetch(client, url, etag).status_code == 304
+
+    call(client, 'post', '/api/production/bulk',
+         json={'date': '2026-01-05', 'products': [{'product_id': bakery['식빵'], 'quantity': 10}]})
+    response = fetch(client, url, etag)
+    assert response.status_code == 200
+    assert response.headers['ETag'].strip('"') != etag
+
+
+def test_sales_grid_etag_changes_when_facts_change(client, bakery):
+    url = '/api/sales/grid?date=2026-01-05'
+    etag = assert_not_modified(client, url)
+    call(client, 'post', '/api/production/bulk',
+         json={'date': '2026-01-05', 'products': [{'product_id': bakery['식빵'], 'quantity': 10}]})
+    assert fetch(client, url, etag).status_code == 200
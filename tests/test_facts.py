@@ -0,0 +1,81 @@
+"""기록 저장 후 증분 갱신한 일별/월별 집계가 전체 재계산 결과와 같은지 확인합니다."""
+import pytest
+
+import db
+from conftest import call, table_rows
+from facts import rebuild_facts
+
+
+def facts_tables(conn):
+    return (table_rows(conn, 'daily_product_facts', 'product_id, fact_date'),
+            table_rows(conn, 'monthly_product_facts', 'product_id, month_start'))
+
+
+def assert_facts_match_rebuild():
+    conn = db.get_db()
+    try:
+        daily, monthly = facts_tables(conn)
+        assert daily
+        rebuild_facts(conn)
+        rebuilt_daily, rebuilt_monthly = facts_tables(conn)
+        assert daily == [pytest.approx(row) for row in rebuilt_daily]
+        assert monthly == [pytest.approx(row) for row in rebuilt_monthly]
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def save_day(client, ids, day, production, inventory):
+    call(client, 'post', '/api/production/bulk',
+         json={'date': day, 'products': [{'product_id': ids[name], 'quantity': q} for name, q in production.items()]})
+    call(client, 'post', '/api/inventory/bulk',
+         json={'date': day, 'products': [{'product_id': ids[name], 'quantity': q} for name, q in inventory.items()]})
+
+
+@pytest.fixture
+def recorded(client, bakery):
+    # 월 경계를 걸치도록 기록 (전날 재고가 다음 달 첫날 기초재고가 됨)
+    save_day(client, bakery, '2026-01-30', {'식빵': 20, '버터롤': 30}, {'식빵': 2, '버터롤': 5})
+    save_day(client, bakery, '2026-01-31', {'식빵': 15}, {'식빵': 1, '버터롤': 3})
+    save_day(client, bakery, '2026-02-01', {'식빵': 18, '버터롤': 25}, {'식빵': 4, '버터롤': 2})
+    call(client, 'post', '/api/irregular-product/bulk',
+         json={'date': '2026-01-31', 'products': [{'product_id': bakery['케이크'], 'opening_inventory': 1,
+                                                   'production': 5, 'donation': 1, 'closing_inventory': 2}]})
+    return bakery
+
+
+def test_bulk_saves_match_rebuild(client, recorded):
+    assert_facts_match_rebuild()
+
+
+def test_overwrite_and_delete_match_rebuild(client, recorded):
+    # 지난 날짜 재고를 고치면 다음 날 기초재고/판매까지 갱신
+    save_day(client, recorded, '2026-01-30', {'식빵': 25}, {'식빵': 6})
+    assert_facts_match_rebuild()
+
+    record = next(r for r in call(client, 'get', '/api/production', query_string={'start_date': '2026-02-01'})
+                  if r['product_id'] == recorded['버터롤'])
+    call(client, 'delete', f"/api/production/{record['id']}")
+    call(client, 'post', '/api/production',
+         json={'product_id': recorded['식빵'], 'quantity': 3, 'production_date': '2026-02-01'})
+    assert_facts_match_rebuild()
+
+
+def test_price_change_keeps_past_facts(client, recorded):
+    # 같은 날 바꾼 가격은 그날 이력을 고치므로, 제품을 예전에 등록한 것으로 이력 기록일을 당겨 둠
+    conn = db.get_db()
+    try:
+        conn.execute("UPDATE product_cost_history SET recorded_on = '2026-01-01'")
+        conn.commit()
+        before = facts_tables(conn)
+    finally:
+        conn.close()
+
+    call(client, 'put', f"/api/products/{recorded['식빵']}",
+         json={'name': '식빵', 'unit': '개', 'price': 4000, 'category': '빵'})
+    conn = db.get_db()
+    try:
+        assert facts_tables(conn) == before
+    finally:
+        conn.close()
+    assert_facts_match_rebuild()
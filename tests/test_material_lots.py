@@ -0,0 +1,107 @@
+"""선입선출(FIFO) 로트 차감/복원 테스트."""
+import pytest
+
+import db
+import material_lots
+from conftest import call
+
+
+@pytest.fixture
+def fifo(monkeypatch, bakery):
+    monkeypatch.setattr(material_lots, 'FIFO_ENABLED', True)
+    return bakery
+
+
+def lots(material_id):
+    conn = db.get_db()
+    try:
+        return [(r['quantity'], r['remaining_quantity'], r['unit_price']) for r in conn.execute(
+            'SELECT quantity, remaining_quantity, unit_price FROM material_receipts WHERE material_id = ? ORDER BY id',
+            (material_id,)).fetchall()]
+    finally:
+        conn.close()
+
+
+def rebuilt_lots(material_id):
+    # 전체 입고/생산 기록으로 다시 계산한 로트 (되돌려서 DB는 그대로)
+    conn = db.get_db()
+    try:
+        material_lots.rebuild_lots(conn)
+        return [(r['quantity'], r['remaining_quantity'], r['unit_price']) for r in conn.execute(
+            'SELECT quantity, remaining_quantity, unit_price FROM material_receipts WHERE material_id = ? ORDER BY id',
+            (material_id,)).fetchall()]
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def material(client, material_id):
+    return next(m for m in call(client, 'get', '/api/materials') if m['id'] == material_id)
+
+
+def receive(client, material_id, day, quantity, unit_price):
+    return call(client, 'post', '/api/material-receipts',
+                json={'material_id': material_id, 'receipt_date': day, 'quantity': quantity, 'unit_price': unit_price})['id']
+
+
+def test_draw_down_and_restore(client, fifo):
+    butter = fifo['버터']
+    receive(client, butter, '2026-01-02', 100, 8)
+    receive(client, butter, '2026-01-03', 300, 12)
+    assert material(client, butter)['price_per_unit'] == 8
+
+    # 케이크 1개 = 버터 10, 오래된 로트부터 차감하고 다 쓰면 다음 로트 단가
+    record_id = call(client, 'post', '/api/production',
+                     json={'product_id': fifo['케이크'], 'quantity': 12, 'production_date': '2026-01-05'})['id']
+    assert lots(butter) == [(100, 0, 8), (300, 280, 12)]
+    assert material(client, butter)['price_per_unit'] == material(client, butter)['price_per_gram'] == 12
+
+    # 생산 취소는 가장 최근에 차감된 로트부터 되돌림
+    call(client, 'delete', f'/api/production/{record_id}')
+    assert lots(butter) == [(100, 100, 8), (300, 300, 12)]
+    assert material(client, butter)['price_per_unit'] == 8
+
+
+def test_shortfall_is_kept_and_settled_by_next_receipt(client, fifo):
+    butter = fifo['버터']
+    receive(client, butter, '2026-01-02', 100, 8)
+    call(client, 'post', '/api/production/bulk',
+         json={'date': '2026-01-05', 'products': [{'product_id': fifo['케이크'], 'quantity': 15}]})
+    assert lots(butter) == [(100, -50, 8)]
+
+    receive(client, butter, '2026-01-10', 200, 12)
+    assert lots(butter) == [(100, 0, 8), (200, 150, 12)]
+
+    # 생산량을 줄이면 부족분부터 채워짐
+    call(client, 'post', '/api/production/bulk',
+         json={'date': '2026-01-05', 'products': [{'product_id': fifo['케이크'], 'quantity': 5}]})
+    assert lots(butter) == [(100, 50, 8), (200, 200, 12)] == rebuilt_lots(butter)
+
+
+def test_receipt_edit_and_delete_reallocate_consumption(client, fifo):
+    butter = fifo['버터']
+    first = receive(client, butter, '2026-01-02', 100, 8)
+    second = receive(client, butter, '2026-01-03', 300, 12)
+    call(client, 'post', '/api/production/bulk',
+         json={'date': '2026-01-05', 'products': [{'product_id': fifo['케이크'], 'quantity': 15}]})
+    assert lots(butter) == [(100, 0, 8), (300, 250, 12)]
+
+    call(client, 'put', f'/api/material-receipts/{first}', json={'quantity': 50, 'unit_price': 8})
+    assert lots(butter) == [(50, 0, 8), (300, 200, 12)] == rebuilt_lots(butter)
+
+    call(client, 'delete', f'/api/material-receipts/{second}')
+    assert lots(butter) == [(50, -100, 8)] == rebuilt_lots(butter)
+
+    # 더 이른 날짜 입고는 가장 먼저 소진
+    receive(client, butter, '2025-12-01', 400, 5)
+    assert lots(butter) == [(50, 50, 8), (400, 250, 5)] == rebuilt_lots(butter)
+    assert material(client, butter)['price_per_unit'] == 5
+
+
+def test_prep_consumption_reaches_raw_lots(client, fifo):
+    flour = fifo['밀가루']
+    receive(client, flour, '2026-01-02', 1000, 2)
+    # 식빵 1개 = 크림반죽 50 = 반죽 50 + 밀가루 5 = 밀가루 40 + 버터 10 + 밀가루 5
+    call(client, 'post', '/api/production',
+         json={'product_id': fifo['식빵'], 'quantity': 2, 'production_date': '2026-01-05'})
+    assert lots(flour) == [(1000, pytest.approx(910), 2)]
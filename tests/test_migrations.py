@@ -0,0 +1,98 @@
+"""기존(버전 관리 전) DB를 최신 스키마로 올리는 마이그레이션 테스트."""
+import sqlite3
+
+import pytest
+
+import db
+from conftest import table_rows
+from cost_graph import refresh_cost_breakdown
+from facts import rebuild_facts
+
+
+@pytest.fixture
+def baseline_db(db_path):
+    # schema_version 없이 기본 테이블만 있는 DB (같은 날 생산 기록 중복, 프랩 속 프랩 포함)
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    db._migrate_base_tables(conn.cursor())
+    conn.executemany('''INSERT INTO products (id, name, unit, price, cost, stock_type, category)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                     [(1, '식빵', '개', 3000, 500, '일반', '빵'), (2, '버터롤', '개', 2000, 300, '냉동', '빵'),
+                      (3, '케이크', '개', 20000, 4000, '일반', '비정기 제품')])
+    conn.executemany('''INSERT INTO materials (id, name, type, weight, purchase_price, price_per_gram, price_per_unit)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                     [(1, '밀가루', '원자재', 1000, 2000, 2, 2), (2, '버터', '원자재', 1000, 10000, 10, None),
+                      (3, '반죽', '프랩', 500, 0, 0, 0), (4, '크림반죽', '프랩', 100, 0, 0, 0)])
+    conn.executemany('''INSERT INTO material_recipes (prep_material_id, ingredient_material_id, quantity)
+                        VALUES (?, ?, ?)''',
+                     [(3, 1, 400), (3, 2, 100), (4, 3, 100), (4, 1, 10)])
+    conn.executemany('INSERT INTO product_materials (product_id, material_id, quantity) VALUES (?, ?, ?)',
+                     [(1, 4, 50), (2, 3, 30), (2, 2, 5), (3, 2, 10)])
+    conn.executemany('INSERT INTO production_records (product_id, quantity, production_date) VALUES (?, ?, ?)',
+                     [(1, 10, '2025-12-30'), (1, 5, '2025-12-30'), (1, 7, '2026-01-02'), (2, 4, '2026-01-01')])
+    conn.executemany('INSERT INTO inventory_records (product_id, quantity, inventory_date) VALUES (?, ?, ?)',
+                     [(1, 3, '2025-12-30'), (1, 1, '2025-12-31'), (2, 2, '2026-01-01')])
+    conn.execute('''INSERT INTO irregular_product_records
+                    (product_id, opening_inventory, production, donation, closing_inventory, record_date)
+                    VALUES (3, 1, 5, 1, 2, '2026-01-01')''')
+    conn.execute('''INSERT INTO material_receipts (material_id, receipt_date, quantity, unit_price)
+                    VALUES (1, '2025-12-01', 1000, 2.5)''')
+    conn.commit()
+    conn.close()
+    return db_path
+
+
+def test_upgrade_from_baseline(baseline_db):
+    db.init_db()
+    conn = db.get_db()
+    try:
+        assert db.get_schema_version(conn) == db.LATEST_SCHEMA_VERSION
+
+        # 같은 날 생산 기록은 수량과 입력 건수를 합쳐 한 행
+        assert [tuple(r) for r in conn.execute('''SELECT product_id, production_date, quantity, entry_count
+                                                  FROM production_records ORDER BY product_id, production_date''')] == [
+            (1, '2025-12-30', 15, 2), (1, '2026-01-02', 7, 1), (2, '2026-01-01', 4, 1)]
+        assert conn.execute('SELECT remaining_quantity FROM material_receipts').fetchone()[0] == 1000
+
+        # 백필 결과는 앱의 갱신 함수로 다시 만든 결과와 같음
+        breakdown = table_rows(conn, 'product_cost_breakdown', 'product_id, material_id')
+        daily = table_rows(conn, 'daily_product_facts', 'product_id, fact_date')
+        monthly = table_rows(conn, 'monthly_product_facts', 'product_id, month_start')
+        assert breakdown and daily and monthly
+
+        refresh_cost_breakdown(conn, 'p.id IN (SELECT product_id FROM product_materials)')
+        rebuild_facts(conn)
+        assert table_rows(conn, 'product_cost_breakdown', 'product_id, material_id') == [
+            pytest.approx(row) for row in breakdown]
+        assert table_rows(conn, 'daily_product_facts', 'product_id, fact_date') == daily
+        assert table_rows(conn, 'monthly_product_facts', 'product_id, month_start') == monthly
+    finally:
+        conn.close()
+
+
+def test_upgrade_keeps_statistics_record_count(baseline_db):
+    import app as app_module
+
+    db.init_db()
+    stats = {s['id']: s for s in app_module.app.test_client().get('/api/statistics').get_json()}
+    assert (stats[1]['record_count'], stats[1]['total_quantity']) == (3, 22)
+    monthly = app_module.app.test_client().get('/api/statistics?granularity=month').get_json()
+    assert sum(s['record_count'] for s in monthly if s['id'] == 1) == 3
+
+
+def test_init_db_is_idempotent(baseline_db):
+    db.init_db()
+    conn = db.get_db()
+    try:
+        before = [table_rows(conn, table, 'rowid') for table in ('production_records', 'daily_product_facts',
+                                                                  'product_cost_breakdown', 'schema_version')]
+    finally:
+        conn.close()
+
+    db.init_db()
+    conn = db.get_db()
+    try:
+        assert [table_rows(conn, table, 'rowid') for table in ('production_records', 'daily_product_facts',
+                                                                'product_cost_breakdown', 'schema_version')] == before
+    finally:
+        conn.close()
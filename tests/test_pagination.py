@@ -0,0 +1,63 @@
+"""이력 조회 키셋 페이지(page_size/cursor) 테스트."""
+import pytest
+
+from conftest import call
+
+
+@pytest.fixture
+def history(client, bakery):
+    # 같은 날짜에 여러 행이 있어야 (날짜, id) 경계가 검증됨
+    for day in ('2026-01-01', '2026-01-02', '2026-01-03', '2026-01-04'):
+        call(client, 'post', '/api/production/bulk',
+             json={'date': day, 'products': [{'product_id': bakery['식빵'], 'quantity': 10},
+                                             {'product_id': bakery['버터롤'], 'quantity': 20}]})
+        call(client, 'post', '/api/inventory/bulk',
+             json={'date': day, 'products': [{'product_id': bakery['식빵'], 'quantity': 1},
+                                             {'product_id': bakery['버터롤'], 'quantity': 2}]})
+    return bakery
+
+
+def pages(client, url, page_size):
+    items, cursor, count = [], None, 0
+    while True:
+        query = {'page_size': page_size}
+        if cursor:
+            query['cursor'] = cursor
+        page = call(client, 'get', url, query_string=query)
+        assert len(page['items']) <= page_size
+        items += page['items']
+        count += 1
+        cursor = page['next_cursor']
+        if not cursor:
+            return items, count
+
+
+@pytest.mark.parametrize('url', ['/api/production', '/api/inventory'])
+@pytest.mark.parametrize('page_size', [1, 3, 8, 50])
+def test_cursor_round_trip_matches_full_list(client, history, url, page_size):
+    full = call(client, 'get', url)
+    assert len(full) == 8
+
+    items, count = pages(client, url, page_size)
+    assert [r['id'] for r in items] == [r['id'] for r in full]
+    assert len({r['id'] for r in items}) == len(full)
+    assert count == max(1, -(-len(full) // page_size))
+
+
+def test_cursor_keeps_filters(client, history):
+    query = {'product_id': history['식빵'], 'start_date': '2026-01-02'}
+    full = call(client, 'get', '/api/production', query_string=query)
+    first = call(client, 'get', '/api/production', query_string={**query, 'page_size': 2})
+    second = call(client, 'get', '/api/production',
+                  query_string={**query, 'page_size': 2, 'cursor': first['next_cursor']})
+    assert [r['id'] for r in first['items'] + second['items']] == [r['id'] for r in full]
+    assert second['next_cursor'] is None
+
+
+@pytest.mark.parametrize('query', [{'page_size': '0'}, {'page_size': 'abc'}, {'page_size': '-1'},
+                                   {'page_size': '2', 'cursor': 'abc'}, {'page_size': '2', 'cursor': '2026-01-01|x'},
+                                   {'page_size': '2', 'cursor': '|3'}])
+def test_malformed_page_arguments(client, history, query):
+    response = client.get('/api/production', query_string=query)
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False